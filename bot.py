@@ -3,27 +3,66 @@ import logging
 import config
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
-from aiogram.exceptions import TelegramForbiddenError
 from ngrok_executor import get_webhook_host
 from services.user import UserService
-from aiogram.types import FSInputFile
+from services.filter import FilterService
+from services.filter_index import filter_index
+from services.client_pool import client_pool
+from services.cluster import cluster
+from services.login_registry import login_registry
+from services.gift_watcher import GiftWatcher, PyrogramGiftBackend, PurchaseResult
+from services.stickers import sticker_cache
+from services.price_oracle import price_oracle
+from services.deposit_watcher import deposit_watcher
+from services.notifications import notification_outbox, parse_notification
+from models.notification import Notification
+from utils.middlewares import DatabaseMiddleware, UserMiddleware
+from utils.http import http_client
+from utils.fsm_storage import fsm_storage
 from aiohttp import web
 from db import db
-import os
+import asyncio
+import json
 
-CACHE_FOLDER = "cache"
+NOTIFICATIONS_CHUNK_SIZE = 500
 
 bot = Bot(config.TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=fsm_storage)
+dp.update.outer_middleware(DatabaseMiddleware())
+dp.update.outer_middleware(UserMiddleware())
+gift_watcher: GiftWatcher | None = None
 
-async def on_startup(bot: Bot):
+async def set_webhook(bot: Bot):
     webhook_host = await get_webhook_host(config.NGROK_HOST)
-    webhook_url = f"{webhook_host}{config.WEBHOOK_PATH}"
-    await bot.set_webhook(webhook_url)
-    await db.create_db_and_tables()
+    await bot.set_webhook(f"{webhook_host}{config.WEBHOOK_PATH}")
+
+async def start_leader_jobs():
+    await notification_outbox.start(bot)
+    deposit_watcher.start()
+    if gift_watcher is not None:
+      gift_watcher.start()
+
+async def stop_leader_jobs():
+    if gift_watcher is not None:
+      await gift_watcher.stop()
+    await deposit_watcher.stop()
+    await notification_outbox.stop()
+
+async def on_startup(bot: Bot):
+    await http_client.start()
+    # the server only starts listening once startup is over, so the schema can be brought up to date meanwhile
+    await asyncio.gather(db.migrate(), set_webhook(bot))
+    fsm_storage.start()
+    filter_index.load(await FilterService.get_active())
+    client_pool.start()
+    login_registry.start()
+    price_oracle.start()
+    await sticker_cache.preload(bot)
+    # every worker serves updates, only the elected one buys drops, credits deposits and sends notifications
+    cluster.on_leader(start_leader_jobs, stop_leader_jobs)
+    cluster.start()
     for admin in config.ADMIN_ID_LIST:
         try:
             await bot.send_message(admin, 'Bot is working')
@@ -34,71 +73,116 @@ async def on_shutdown():
     logging.warning('Shutting down..')
 
     await bot.delete_webhook()
+    await cluster.stop()
+    await login_registry.stop()
+    await client_pool.close()
+    await price_oracle.stop()
+    await http_client.close()
     await dp.storage.close()
     
 
     logging.warning('Bye!')
 
+async def notify_purchase(result: PurchaseResult):
+    if not result.can_receive_messages:
+      return
+
+    gift = result.gift
+    await notification_outbox.enqueue(Notification(
+      recipient=result.owner_telegram_id,
+      gift_id=gift.id,
+      gift_price=gift.price,
+      gift_title=gift.title,
+      gift_supply=gift.supply,
+      gift_file_id=gift.file_id,
+      amount_succeeded=result.amount_succeeded,
+      amount_tried=result.amount_tried,
+      error=result.error,
+    ))
+
 async def buy_notification_handler(request: web.Request):
-    data = await request.json()
-    recipient = data.get("recipient")
-    gift_id = data.get("id")
-    gift_price = data.get("price")
-    gift_title = data.get("title")
-    gift_supply = data.get("supply")
-    gift_file_id = data.get("file_id")
-    amount_succeeded = data.get("amount_succeeded")
-    amount_tried = data.get("amount_tried")
-    error = data.get("error")
-    if not all([recipient, gift_id, gift_file_id]):
-      return web.json_response({"status": "error"}, status=web.HTTPBadRequest.status_code)
-    
     try:
-      recipient = int(recipient)
+      notification = parse_notification(await request.json())
     except ValueError:
-      return web.json_response({"status": "error", "error": "invalid user"}, status=web.HTTPForbidden.status_code)
-       
-    user = await UserService.get_by_tgid(recipient)
+      return web.json_response({"status": "error"}, status=web.HTTPBadRequest.status_code)
+
+    user = await UserService.get_by_tgid(notification.recipient)
     if user is None:
       return web.json_response({"status": "error", "error": "invalid user"}, status=web.HTTPForbidden.status_code)
 
     if not user.can_receive_messages:
       return web.json_response({"status": "error", "error": "user unreachable"}, status=web.HTTPForbidden.status_code)
-    
-    t = f" \"{gift_title}\"" if gift_title is not None else ""
-    message_text = (
-      f"<b>Completed</b>: sent <b>{amount_succeeded}</b> of <b>{amount_tried}</b>{t} gifts\n"
-      f"<b>Actual cost</b>: <b>{gift_price * amount_succeeded}</b> ⭐\n\n"
-      f"<span class=\"tg-spoiler\">"
-      f"ID: {gift_id}\n"
-      f"TITLE: {gift_title or 'untitled'}\n"
-      f"PRICE: {gift_price} stars\n"
-      f"SUPPLY: {gift_supply or 'unlimited'}\n"
-      f"ERROR: {error}"
-      f"</span>")
-    try:
-      os.makedirs(CACHE_FOLDER, exist_ok=True)
-      filepath = os.path.join(CACHE_FOLDER, f"{gift_id}.tgs")
 
-      if not os.path.exists(filepath):
-        file_obj = await bot.get_file(gift_file_id)
-        await bot.download_file(file_obj.file_path, destination=filepath)
+    await notification_outbox.enqueue(notification)
+    return web.json_response({"status": "queued"}, status=web.HTTPAccepted.status_code)
 
-      sticker = FSInputFile(filepath)
-      msg = await bot.send_sticker(recipient, sticker)
+async def queue_notifications(payloads: list[tuple[int, dict]]) -> tuple[int, list[dict]]:
+    notifications, rejected = [], []
+    for i, data in payloads:
+      try:
+        notifications.append((i, parse_notification(data)))
+      except ValueError as e:
+        rejected.append({"index": i, "error": str(e)})
 
-      await bot.send_message(recipient, message_text, reply_to_message_id=msg.message_id)
-    except TelegramForbiddenError as e:
-      await UserService.update_receive_messages(recipient, False)
-      return web.json_response({"status": "error", "error": "user unreachable"}, status=web.HTTPForbidden.status_code)
+    users = await UserService.get_by_tgids([n.recipient for _, n in notifications])
+    accepted = []
+    for i, notification in notifications:
+      user = users.get(notification.recipient)
+      if user is None:
+        rejected.append({"index": i, "error": "invalid user"})
+      elif not user.can_receive_messages:
+        rejected.append({"index": i, "error": "user unreachable"})
+      else:
+        accepted.append(notification)
+
+    if accepted:
+      await notification_outbox.enqueue(*accepted)
+    return len(accepted), rejected
+
+async def buy_notifications_handler(request: web.Request):
+    """Bulk /buy_notification: a JSON array, or NDJSON queued in chunks while the body streams in."""
+    queued, rejected = 0, []
+    if request.content_type in ("application/x-ndjson", "application/jsonl"):
+      chunk = []
+      i = 0
+      async for line in request.content:
+        line = line.strip()
+        if not line:
+          continue
+        try:
+          chunk.append((i, json.loads(line)))
+        except ValueError:
+          rejected.append({"index": i, "error": "invalid json"})
+        i += 1
+        if len(chunk) >= NOTIFICATIONS_CHUNK_SIZE:
+          amount, chunk_rejected = await queue_notifications(chunk)
+          queued += amount
+          rejected += chunk_rejected
+          chunk = []
+      if chunk:
+        amount, chunk_rejected = await queue_notifications(chunk)
+        queued += amount
+        rejected += chunk_rejected
+    else:
+      try:
+        data = await request.json()
+      except ValueError:
+        return web.json_response({"status": "error"}, status=web.HTTPBadRequest.status_code)
+      if not isinstance(data, list):
+        return web.json_response({"status": "error", "error": "expected an array"}, status=web.HTTPBadRequest.status_code)
+      queued, rejected = await queue_notifications(list(enumerate(data)))
 
-    return web.json_response({"status": "ok"})
+    return web.json_response({"status": "queued", "queued": queued, "rejected": rejected}, status=web.HTTPAccepted.status_code)
 
 def main() -> None:
+    global gift_watcher
+    if config.GIFT_WATCHER_SESSION:
+      gift_watcher = GiftWatcher(PyrogramGiftBackend(config.GIFT_WATCHER_SESSION), notify_purchase, poll_interval=config.GIFT_POLL_INTERVAL, purchases_per_session=config.PURCHASES_PER_SESSION, warm_interval=config.GIFT_WARM_INTERVAL, max_purchases_per_filter=config.MAX_PURCHASES_PER_FILTER)
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     app = web.Application()
     app.router.add_post("/buy_notification", buy_notification_handler)
+    app.router.add_post("/buy_notifications", buy_notifications_handler)
     webhook_requests_handler = SimpleRequestHandler(
         dispatcher=dp,
         bot=bot
@@ -11,6 +11,12 @@ WEBAPP_HOST = os.environ.get("WEBAPP_HOST")
 WEBAPP_PORT = os.environ.get("WEBAPP_PORT")
 TOKEN = os.environ.get("TOKEN")
 DATABASE_URL = os.environ.get("DATABASE_URL")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
 BSC_RPC = os.getenv("BSC_RPC")
 BASE_RPC = os.getenv("BASE_RPC")
 FAQ_LINK = os.environ.get("FAQ_LINK")
@@ -18,6 +24,42 @@ SUPPORT_LINK = os.environ.get("SUPPORT_LINK")
 CHANNEL_LINK = os.environ.get("CHANNEL_LINK")
 CHANNEL_NAME = os.environ.get("CHANNEL_NAME")
 PRICE_30_DAYS = float(os.environ.get("PRICE_30_DAYS"))
+GIFT_WATCHER_SESSION = os.environ.get("GIFT_WATCHER_SESSION")
+GIFT_POLL_INTERVAL = float(os.environ.get("GIFT_POLL_INTERVAL", 1.0))
+PURCHASES_PER_SESSION = int(os.environ.get("PURCHASES_PER_SESSION", 2))
+MAX_PURCHASES_PER_FILTER = int(os.environ.get("MAX_PURCHASES_PER_FILTER", 100))
+GIFT_WARM_INTERVAL = float(os.environ.get("GIFT_WARM_INTERVAL", 60))
+CLIENT_POOL_SIZE = int(os.environ.get("CLIENT_POOL_SIZE", 100))
+CLIENT_IDLE_TIMEOUT = float(os.environ.get("CLIENT_IDLE_TIMEOUT", 600))
+CLIENT_HEALTH_INTERVAL = float(os.environ.get("CLIENT_HEALTH_INTERVAL", 60))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 30))
+STICKER_CACHE_SIZE = int(os.environ.get("STICKER_CACHE_SIZE", 200))
+NOTIFICATION_RATE = float(os.environ.get("NOTIFICATION_RATE", 30))
+NOTIFICATION_CHAT_INTERVAL = float(os.environ.get("NOTIFICATION_CHAT_INTERVAL", 1.0))
+NOTIFICATION_WORKERS = int(os.environ.get("NOTIFICATION_WORKERS", 4))
+NOTIFICATION_OUTBOX_PERSIST = os.environ.get("NOTIFICATION_OUTBOX_PERSIST", "false").lower() in ("1", "true", "yes")
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 100))
+HTTP_LIMIT_PER_HOST = int(os.environ.get("HTTP_LIMIT_PER_HOST", 10))
+HTTP_DNS_TTL = int(os.environ.get("HTTP_DNS_TTL", 300))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 15))
+PRICE_REFRESH_INTERVAL = float(os.environ.get("PRICE_REFRESH_INTERVAL", 60))
+PRICE_MAX_AGE = float(os.environ.get("PRICE_MAX_AGE", 300))
+EVM_XPUB = os.environ.get("EVM_XPUB")
+TRON_XPUB = os.environ.get("TRON_XPUB")
+DEPOSIT_POLL_INTERVAL = float(os.environ.get("DEPOSIT_POLL_INTERVAL", 15))
+DEPOSIT_POLL_TIMEOUT = float(os.environ.get("DEPOSIT_POLL_TIMEOUT", 60))
+DEPOSIT_TTL = float(os.environ.get("DEPOSIT_TTL", 3 * 24 * 60 * 60))
+LOGIN_TTL = float(os.environ.get("LOGIN_TTL", 300))
+LOGINS_PER_PROXY = int(os.environ.get("LOGINS_PER_PROXY", 10))
+LOGINS_PER_CREDS = int(os.environ.get("LOGINS_PER_CREDS", 20))
+# encrypts pending logins at rest, the bot token unless set
+LOGIN_SECRET = os.environ.get("LOGIN_SECRET") or TOKEN
+FSM_TTL = float(os.environ.get("FSM_TTL", 24 * 60 * 60))
+FSM_CACHE_SIZE = int(os.environ.get("FSM_CACHE_SIZE", 10000))
+# > 0 only with a single webhook worker, workers do not see each other's cached states
+FSM_CACHE_TTL = float(os.environ.get("FSM_CACHE_TTL", 0))
+LEADER_ELECTION_INTERVAL = float(os.environ.get("LEADER_ELECTION_INTERVAL", 5))
 ADMIN_ID_LIST = json.loads(os.environ.get("ADMIN_ID_LIST"))
 REQUIRED_CHANNEL_IDS = json.loads(os.environ.get("REQUIRED_CHANNEL_IDS"))
 REQUIRED_CHANNEL_LINKS = json.loads(os.environ.get("REQUIRED_CHANNEL_LINKS"))
@@ -1,6 +1,8 @@
 from aiohttp.client_exceptions import ClientResponseError
-from web3 import AsyncWeb3, AsyncHTTPProvider
+from web3 import AsyncWeb3
 from utils.retry import retry_on_429
+from contracts.block_index import BlockIndex
+from contracts.provider import make_provider
 from functools import wraps
 import aiofiles
 import asyncio
@@ -14,6 +16,18 @@ logger = logging.getLogger(__name__)
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 ZERO_SIGNATURE = "0xb8464ee39aaf781c640e004d9e5c070935744844f5aa24285355ff345b8a21b83b4fdc930e0eb79a6b771d75b98a9b1dadaf91e7d633449575197a81b831f6e31b"
 
+# parsed once per process, shared by every rpc
+_abis: dict[str, list] = {}
+_selectors: dict[str, dict[str, str]] = {}
+
+def abi_type(param: dict) -> str:
+  if param["type"].startswith("tuple"):
+    return "(" + ",".join(abi_type(c) for c in param["components"]) + ")" + param["type"][len("tuple"):]
+  return param["type"]
+
+def abi_signature(entry: dict) -> str:
+  return f"{entry['name']}({','.join(abi_type(param) for param in entry.get('inputs', []))})"
+
 class Base:
   _instances: dict[str, "Base"] = {}
 
@@ -25,37 +39,43 @@ class Base:
     return cls._instances[rpc]
 
   def _init(self, rpc: str):
-    self.web3 = AsyncWeb3(AsyncHTTPProvider(rpc))
+    self.web3 = AsyncWeb3(make_provider(rpc))
+    self.blocks = BlockIndex(self.web3, rpc)
+    self._contracts: dict[tuple[str, str], object] = {}
 
   def _deadline(self) -> int:
     return int(time.time()) + 10 * 60
   
   @retry_on_429()
   async def _block_at_timestamp(self, target_timestamp: int) -> int:
-    current_block = await self.web3.eth.block_number
-    current_timestamp = (await self.web3.eth.get_block(current_block)).timestamp
-
-    if target_timestamp > current_timestamp:
-      raise ValueError("Target timestamp is in the future")
+    return await self.blocks.block_at(target_timestamp)
 
-    low, high = 0, current_block
-
-    while low < high:
-      mid = (low + high) // 2
-      mid_timestamp = (await self.web3.eth.get_block(mid)).timestamp
-      if mid_timestamp < target_timestamp:
-        low = mid + 1
-      else:
-        high = mid
-
-    return low
-
-  async def load_abi(self, name: str) -> str:
-    path = f"{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}/assets/"
-    async with aiofiles.open(os.path.abspath(path + f"{name}.abi")) as f:
-      abi: str = json.loads(await f.read())
+  async def load_abi(self, name: str) -> list:
+    abi = _abis.get(name)
+    if abi is None:
+      path = f"{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}/assets/"
+      async with aiofiles.open(os.path.abspath(path + f"{name}.abi")) as f:
+        abi = _abis[name] = json.loads(await f.read())
     return abi
 
   async def load_contract(self, abi_name, address):
+    # Base is one instance per rpc, so contracts are shared per (rpc, abi, address)
     address = self.web3.to_checksum_address(address)
-    return self.web3.eth.contract(address=address, abi=await self.load_abi(abi_name))
\ No newline at end of file
+    contract = self._contracts.get((abi_name, address))
+    if contract is None:
+      contract = self._contracts[(abi_name, address)] = self.web3.eth.contract(address=address, abi=await self.load_abi(abi_name))
+    return contract
+
+  async def selectors(self, abi_name: str) -> dict[str, str]:
+    """Event topics and 4 byte function selectors of an ABI by name, e.g. {"Transfer": "0xddf2..."}."""
+    selectors = _selectors.get(abi_name)
+    if selectors is None:
+      selectors = {}
+      for entry in await self.load_abi(abi_name):
+        if entry.get("type") not in ("function", "event"):
+          continue
+        digest = AsyncWeb3.keccak(text=abi_signature(entry)).hex()
+        digest = digest if digest.startswith("0x") else "0x" + digest
+        selectors[entry["name"]] = digest if entry["type"] == "event" else digest[:10]
+      _selectors[abi_name] = selectors
+    return selectors
@@ -0,0 +1,126 @@
+from bisect import bisect_left
+from web3 import AsyncWeb3
+import aiofiles
+import hashlib
+import logging
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+CACHE_FOLDER = os.path.join("cache", "blocks")
+
+class BlockIndex:
+  """
+  Persistent block number -> timestamp samples of one chain.
+
+  Every block ever fetched is remembered and written to disk, so a lookup
+  starts from the tightest known bracket around the target. Inside it the
+  search interpolates on timestamps (blocks are produced at a nearly
+  constant rate) and probes a few blocks per JSON-RPC batch, a repeated or
+  nearby lookup needs no RPC at all.
+  """
+  probes = 5
+  max_blocks = 100000
+
+  def __init__(self, web3: AsyncWeb3, rpc: str):
+    self.web3 = web3
+    self.path = os.path.join(CACHE_FOLDER, f"{hashlib.sha1(rpc.encode()).hexdigest()[:16]}.json")
+
+    # sorted block numbers and, index for index, their timestamps (also sorted, timestamps never decrease)
+    self._blocks: list[int] = []
+    self._sorted_timestamps: list[int] = []
+    self._timestamps: dict[int, int] = {}
+    self._loaded = False
+
+  async def _load(self):
+    if self._loaded:
+      return
+    self._loaded = True
+    try:
+      async with aiofiles.open(self.path) as f:
+        timestamps = json.loads(await f.read())
+    except FileNotFoundError:
+      return
+    except Exception as e:
+      logger.warning(f"failed to load block index {self.path}: {e}")
+      return
+    for block, timestamp in timestamps.items():
+      self._add(int(block), timestamp)
+
+  async def _save(self):
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    tmp_path = self.path + ".tmp"
+    async with aiofiles.open(tmp_path, "w") as f:
+      await f.write(json.dumps(self._timestamps))
+    os.replace(tmp_path, self.path)
+
+  def _add(self, block: int, timestamp: int):
+    if block in self._timestamps:
+      return
+    i = bisect_left(self._blocks, block)
+    self._blocks.insert(i, block)
+    self._sorted_timestamps.insert(i, timestamp)
+    self._timestamps[block] = timestamp
+
+  def _compact(self):
+    # every other sample keeps the coverage even while halving the index
+    if len(self._blocks) > self.max_blocks:
+      self._blocks = self._blocks[::2]
+      self._sorted_timestamps = self._sorted_timestamps[::2]
+      self._timestamps = dict(zip(self._blocks, self._sorted_timestamps))
+
+  async def _fetch(self, blocks: list[int]):
+    blocks = [block for block in set(blocks) if block not in self._timestamps]
+    if not blocks:
+      return
+    async with self.web3.batch_requests() as batch:
+      for block in blocks:
+        batch.add(self.web3.eth.get_block(block))
+      results = await batch.async_execute()
+    for block, result in zip(blocks, results):
+      self._add(block, result["timestamp"])
+
+  async def _fetch_head(self) -> int:
+    head = await self.web3.eth.block_number
+    await self._fetch([0, head])
+    return head
+
+  def _bracket(self, target_timestamp: int) -> tuple[int | None, int | None]:
+    """Known (lo, hi) blocks with timestamp(lo) < target <= timestamp(hi), either may be missing."""
+    i = bisect_left(self._sorted_timestamps, target_timestamp)
+    lo = self._blocks[i - 1] if i > 0 else None
+    hi = self._blocks[i] if i < len(self._blocks) else None
+    return lo, hi
+
+  async def block_at(self, target_timestamp: int) -> int:
+    """First block whose timestamp is at or after `target_timestamp`."""
+    await self._load()
+
+    lo, hi = self._bracket(target_timestamp)
+    if lo is None or hi is None:
+      head = await self._fetch_head()
+      if target_timestamp > self._timestamps[head]:
+        raise ValueError("Target timestamp is in the future")
+      lo, hi = self._bracket(target_timestamp)
+      if lo is None:
+        return hi
+
+    fetched = False
+    while hi - lo > 1:
+      lo_timestamp, hi_timestamp = self._timestamps[lo], self._timestamps[hi]
+      estimate = lo + (target_timestamp - lo_timestamp) * (hi - lo) // max(hi_timestamp - lo_timestamp, 1)
+      # probes spread around the estimate, the bracket shrinks to at most their spacing per round trip
+      spacing = max(1, (hi - lo) // (self.probes * 16))
+      probes = [estimate + k * spacing for k in range(-(self.probes // 2), self.probes // 2 + 1)]
+      await self._fetch([min(max(block, lo + 1), hi - 1) for block in probes])
+      fetched = True
+      lo, hi = self._bracket(target_timestamp)
+
+    if fetched:
+      self._compact()
+      try:
+        await self._save()
+      except Exception as e:
+        logger.warning(f"failed to save block index {self.path}: {e}")
+    return hi
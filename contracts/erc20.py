@@ -1,5 +1,55 @@
+from typing import Iterable, NamedTuple
 from contracts.base import Base
-from web3 import AsyncWeb3
+
+# deployed at the same address on every EVM chain we support, see https://www.multicall3.com
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+def address_topic(address: str) -> str:
+  return "0x" + address.lower().removeprefix("0x").rjust(64, "0")
+
+def _raw(value) -> bytes:
+  if isinstance(value, (bytes, bytearray)):
+    return bytes(value)
+  return bytes.fromhex(value.removeprefix("0x"))
+
+class Transfer(NamedTuple):
+  sender: str
+  to: str
+  value: int
+  block_number: int
+  transaction_hash: str
+
+def decode_transfers(logs: Iterable, token: str, topic: str, to: Iterable[str] | None = None) -> list[Transfer]:
+  """
+  ERC20 Transfer events of `token` among raw logs, optionally only those to
+  `to`. Logs are filtered on topic0 (the Transfer `topic`), the emitting
+  address and the `to` topic as raw bytes before anything is decoded,
+  without going through the ABI.
+  """
+  topic_raw = _raw(topic)
+  token_raw = _raw(token.lower())
+  to_raw = None if to is None else {_raw(address.lower()) for address in to}
+
+  transfers = []
+  for log in logs:
+    topics = log["topics"]
+    # ERC721 Transfer shares topic0 but indexes the token id as a fourth topic
+    if len(topics) != 3 or _raw(topics[0]) != topic_raw:
+      continue
+    if _raw(log["address"]) != token_raw:
+      continue
+    recipient = _raw(topics[2])[12:]
+    if to_raw is not None and recipient not in to_raw:
+      continue
+
+    transfers.append(Transfer(
+      sender="0x" + _raw(topics[1])[12:].hex(),
+      to="0x" + recipient.hex(),
+      value=int.from_bytes(_raw(log["data"]), "big"),
+      block_number=log["blockNumber"],
+      transaction_hash="0x" + _raw(log["transactionHash"]).hex(),
+    ))
+  return transfers
 
 class ERC20:
   def __init__(self, rpc: str, address: str):
@@ -7,30 +57,55 @@ class ERC20:
     self.base = Base(rpc)
 
     self.instance = None
+    self.multicall = None
+    # immutable for a deployed token, read once
+    self.__decimals: int | None = None
+    self.__symbol: str | None = None
 
   async def __load_contracts(self):
     if self.instance is None:
       self.instance = await self.base.load_contract("erc20", self.address)
+    if self.multicall is None:
+      self.multicall = await self.base.load_contract("multicall3", MULTICALL3_ADDRESS)
 
   @property
   async def decimals(self) -> int:
-    await self.__load_contracts()
-
-    result = await self.instance.functions.decimals().call()
-    return result
+    if self.__decimals is None:
+      await self.__load_contracts()
+      self.__decimals = await self.instance.functions.decimals().call()
+    return self.__decimals
   
   @property
   async def symbol(self) -> str:
+    if self.__symbol is None:
+      await self.__load_contracts()
+      self.__symbol = await self.instance.functions.symbol().call()
+    return self.__symbol
+
+  async def balance_of(self, address: str, block_identifier: int | str = "latest") -> int:
     await self.__load_contracts()
 
-    result = await self.instance.functions.symbol().call()
+    result = await self.instance.functions.balanceOf(self.base.web3.to_checksum_address(address)).call(block_identifier=block_identifier)
     return result
 
-  async def balance_of(self, address: str) -> int:
+  async def balances_of(self, addresses: list[str], block_identifier: int | str = "latest", chunk_size: int = 500) -> list[int]:
+    """balanceOf of every address packed into Multicall3 aggregate3 calls, one eth_call per `chunk_size` addresses."""
     await self.__load_contracts()
 
-    result = await self.instance.functions.balanceOf(self.base.web3.to_checksum_address(address)).call()
-    return result
+    token = self.base.web3.to_checksum_address(self.address)
+    balances = []
+    for i in range(0, len(addresses), chunk_size):
+      calls = [
+        (token, False, self.instance.encode_abi("balanceOf", args=[self.base.web3.to_checksum_address(address)]))
+        for address in addresses[i:i + chunk_size]
+      ]
+      results = await self.multicall.functions.aggregate3(calls).call(block_identifier=block_identifier)
+      balances += [self.base.web3.codec.decode(["uint256"], return_data)[0] for _, return_data in results]
+    return balances
+
+  @property
+  async def transfer_topic(self) -> str:
+    return (await self.base.selectors("erc20"))["Transfer"]
 
   @property
   async def total_supply(self) -> int:
@@ -39,18 +114,30 @@ class ERC20:
     return await self.instance.functions.totalSupply().call()
   
   async def transfers(self, tx_hash: str, to: str) -> list[int]:
-    await self.__load_contracts()
-
-    transfers = []
     receipt = await self.base.web3.eth.get_transaction_receipt(tx_hash)
-    for log in receipt["logs"]:
-      try:
-        transfer = self.instance.events.Transfer().process_log(log)
-      except:
-        continue
-      
-      if AsyncWeb3.to_checksum_address(transfer['address']) == AsyncWeb3.to_checksum_address(self.address) \
-      and AsyncWeb3.to_checksum_address(transfer['args']['to']) == AsyncWeb3.to_checksum_address(to):
-        transfers.append(transfer['args']['value'])
-
-    return transfers
\ No newline at end of file
+    return [transfer.value for transfer in decode_transfers(receipt["logs"], self.address, await self.transfer_topic, [to])]
+
+  async def transfers_many(self, tx_hashes: list[str], to: Iterable[str]) -> dict[str, list[Transfer]]:
+    """Transfers of this token to any of `to` in each transaction, receipts fetched in one JSON-RPC batch."""
+    if not tx_hashes:
+      return {}
+
+    async with self.base.web3.batch_requests() as batch:
+      for tx_hash in tx_hashes:
+        batch.add(self.base.web3.eth.get_transaction_receipt(tx_hash))
+      receipts = await batch.async_execute()
+
+    to = list(to)
+    topic = await self.transfer_topic
+    return {tx_hash: decode_transfers(receipt["logs"], self.address, topic, to) for tx_hash, receipt in zip(tx_hashes, receipts)}
+
+  async def transfer_logs(self, from_block: int, to_block: int, to: list[str]) -> list[Transfer]:
+    """Transfer events of this token to any of `to` within the block range, one eth_getLogs call."""
+    topic = await self.transfer_topic
+    logs = await self.base.web3.eth.get_logs({
+      "address": self.base.web3.to_checksum_address(self.address),
+      "fromBlock": from_block,
+      "toBlock": to_block,
+      "topics": [topic, None, [address_topic(address) for address in to]],
+    })
+    return decode_transfers(logs, self.address, topic)
@@ -0,0 +1,157 @@
+from collections import deque
+from web3 import AsyncHTTPProvider
+from web3.providers.async_base import AsyncJSONBaseProvider
+import logging
+import asyncio
+import time
+
+logger = logging.getLogger(__name__)
+
+# never hedged nor replayed on another endpoint
+WRITE_METHODS = {"eth_sendRawTransaction", "eth_sendTransaction"}
+# JSON-RPC errors public endpoints answer with when throttling
+RATE_LIMIT_CODES = {429, -32005, -32090}
+
+class _Endpoint:
+  __slots__ = ("url", "provider", "latency", "errors", "samples", "cooldown_until")
+
+  def __init__(self, url: str):
+    self.url = url
+    # retries are ours to make, on another endpoint
+    self.provider = AsyncHTTPProvider(url, exception_retry_configuration=None)
+    self.latency: float | None = None
+    self.errors = 0.0
+    self.samples: deque[float] = deque(maxlen=100)
+    self.cooldown_until = 0.0
+
+  @property
+  def score(self) -> float:
+    return (self.latency or 0.0) * (1 + 10 * self.errors)
+
+  def p95(self, default: float) -> float:
+    if len(self.samples) < 20:
+      return default
+    samples = sorted(self.samples)
+    return samples[int(0.95 * (len(samples) - 1))]
+
+def _is_rate_limited(response) -> bool:
+  if not isinstance(response, dict) or not isinstance(response.get("error"), dict):
+    return False
+  error = response["error"]
+  message = str(error.get("message", "")).lower()
+  return error.get("code") in RATE_LIMIT_CODES or "rate limit" in message or "limit exceeded" in message
+
+class FailoverProvider(AsyncJSONBaseProvider):
+  """
+  JSON-RPC over several endpoints of one chain.
+
+  Every endpoint keeps an EWMA of its latency and error rate, requests go
+  to the best scored healthy one and fail over down the ranking on
+  transport errors or throttling, a failing endpoint sits out `cooldown`
+  seconds. Reads are hedged: if the first endpoint has not answered within
+  its p95 latency the same request is sent to the runner-up and the first
+  answer wins.
+  """
+
+  def __init__(self, urls: list[str], hedge: bool = True, alpha: float = 0.2, cooldown: float = 30, hedge_delay: float = 0.5):
+    super().__init__()
+    self.endpoints = [_Endpoint(url) for url in urls]
+    self.hedge = hedge
+    self.alpha = alpha
+    self.cooldown = cooldown
+    self.hedge_delay = hedge_delay
+
+  def __str__(self) -> str:
+    return f"FailoverProvider({', '.join(e.url for e in self.endpoints)})"
+
+  async def is_connected(self, show_traceback: bool = False) -> bool:
+    results = await asyncio.gather(*(e.provider.is_connected(show_traceback) for e in self.endpoints), return_exceptions=True)
+    return any(r is True for r in results)
+
+  def _ranked(self) -> list[_Endpoint]:
+    now = time.monotonic()
+    healthy = sorted((e for e in self.endpoints if e.cooldown_until <= now), key=lambda e: e.score)
+    # endpoints cooling down stay as a last resort
+    cooling = sorted((e for e in self.endpoints if e.cooldown_until > now), key=lambda e: e.cooldown_until)
+    return healthy + cooling
+
+  def _record(self, endpoint: _Endpoint, elapsed: float, failed: bool):
+    endpoint.latency = elapsed if endpoint.latency is None else (1 - self.alpha) * endpoint.latency + self.alpha * elapsed
+    endpoint.errors = (1 - self.alpha) * endpoint.errors + self.alpha * (1.0 if failed else 0.0)
+    if failed:
+      endpoint.cooldown_until = time.monotonic() + self.cooldown
+    else:
+      endpoint.samples.append(elapsed)
+
+  async def _call(self, endpoint: _Endpoint, request):
+    started_at = time.monotonic()
+    try:
+      response = await request(endpoint)
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      self._record(endpoint, time.monotonic() - started_at, failed=True)
+      logger.warning(f"rpc {endpoint.url} failed: {e}")
+      raise
+
+    if _is_rate_limited(response):
+      self._record(endpoint, time.monotonic() - started_at, failed=True)
+      raise ConnectionError(f"rpc {endpoint.url} is rate limiting: {response['error']}")
+    self._record(endpoint, time.monotonic() - started_at, failed=False)
+    return response
+
+  async def _failover(self, endpoints: list[_Endpoint], request):
+    error = None
+    for endpoint in endpoints:
+      try:
+        return await self._call(endpoint, request)
+      except Exception as e:
+        error = e
+    raise error
+
+  async def _hedged(self, endpoints: list[_Endpoint], request):
+    primary, secondary = endpoints[0], endpoints[1]
+    first = asyncio.create_task(self._call(primary, request))
+    tasks = {first}
+    error = None
+    try:
+      await asyncio.wait(tasks, timeout=primary.p95(self.hedge_delay))
+      if not first.done() or first.exception() is not None:
+        tasks.add(asyncio.create_task(self._call(secondary, request)))
+
+      while tasks:
+        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          if task.exception() is None:
+            return task.result()
+          error = task.exception()
+    finally:
+      for task in tasks:
+        task.cancel()
+
+    # both hedged endpoints failed, the rest of the ranking is tried one by one
+    if len(endpoints) > 2:
+      return await self._failover(endpoints[2:], request)
+    raise error
+
+  async def make_request(self, method, params):
+    request = lambda endpoint: endpoint.provider.make_request(method, params)
+    endpoints = self._ranked()
+    if method in WRITE_METHODS:
+      return await self._call(endpoints[0], request)
+    if self.hedge and len(endpoints) > 1:
+      return await self._hedged(endpoints, request)
+    return await self._failover(endpoints, request)
+
+  async def make_batch_request(self, requests):
+    return await self._failover(self._ranked(), lambda endpoint: endpoint.provider.make_batch_request(requests))
+
+  async def disconnect(self):
+    await asyncio.gather(*(e.provider.disconnect() for e in self.endpoints), return_exceptions=True)
+
+def make_provider(rpc: str):
+  """A plain HTTP provider for one url, failover across a comma separated list."""
+  urls = [url.strip() for url in rpc.split(",") if url.strip()]
+  if len(urls) == 1:
+    return AsyncHTTPProvider(urls[0])
+  return FailoverProvider(urls)
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import asyncio
 
 class CryptoAsset(ABC):
   @property
@@ -17,7 +18,7 @@ class CryptoAsset(ABC):
     pass
   
   @abstractmethod
-  async def create_wallet(self, i: int = 0) -> tuple[str, str]:
+  async def deposit_address(self, i: int) -> str:
     pass
 
   @abstractmethod
@@ -26,4 +27,16 @@ class CryptoAsset(ABC):
 
   @abstractmethod
   async def get_balance(self, address: str) -> float:
-    pass
\ No newline at end of file
+    pass
+
+  async def get_balances(self, addresses: list[str]) -> dict[str, float]:
+    """Balances of many addresses, by default one balance query per address."""
+    balances = await asyncio.gather(*(self.get_balance(address) for address in addresses))
+    return dict(zip(addresses, balances))
+
+  async def received(self, addresses: list[str]) -> dict[str, float]:
+    """
+    Amounts the deposit addresses have received so far, polled by the deposit
+    watcher. By default their current balances.
+    """
+    return await self.get_balances(addresses)
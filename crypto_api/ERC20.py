@@ -1,18 +1,27 @@
-from bip_utils import Bip44Changes, Bip44Coins, Bip44, Bip39SeedGenerator, Bip84, Bip84Coins, Bip39MnemonicGenerator, \
-    Bip39WordsNum
+from bip_utils import Bip44Coins
 from crypto_api.CryptoAsset import CryptoAsset
+from crypto_api.wallet import derive_address
+from config import EVM_XPUB
 from dexscreener import get_token_price
 from utils.retry import retry_on_429
 from contracts.erc20 import ERC20 as ContractERC20
 import asyncio
 
 class ERC20(CryptoAsset):
+  confirmations = 3
+  block_range = 2000
+  addresses_per_query = 500
+
   def __init__(self, rpc: str, symbol: str, contract: str, link: str, network: str):
     self.contract = ContractERC20(rpc, contract)
     self.__symbol = symbol
     self.__link = link
     self.__network = network
 
+    # next block to scan for transfers and, per watched address, (raw amount received, block it is counted up to)
+    self.__cursor: int | None = None
+    self.__received: dict[str, tuple[int, int]] = {}
+
   @property
   async def symbol(self) -> str:
     return self.__symbol
@@ -25,16 +34,8 @@ class ERC20(CryptoAsset):
   async def link(self) -> str:
     return self.__link
 
-  async def create_wallet(self, i: int = 0) -> tuple[str, str]:
-    mnemonic_gen = Bip39MnemonicGenerator().FromWordsNumber(Bip39WordsNum.WORDS_NUM_12)
-    mnemonic_str = mnemonic_gen.ToStr()
-    seed_bytes = Bip39SeedGenerator(mnemonic_str).Generate()
-
-    bip44_mst_ctx = Bip44.FromSeed(seed_bytes, Bip44Coins.ETHEREUM)
-    bip44_acc_ctx = bip44_mst_ctx.Purpose().Coin().Account(0)
-    bip44_chg_ctx = bip44_acc_ctx.Change(Bip44Changes.CHAIN_EXT)
-    bip44_addr_ctx = bip44_chg_ctx.AddressIndex(i).PublicKey().ToAddress()
-    return mnemonic_str, bip44_addr_ctx
+  async def deposit_address(self, i: int) -> str:
+    return derive_address(EVM_XPUB, Bip44Coins.ETHEREUM, i)
   
   async def price_usd(self) -> float:
     return await get_token_price(self.contract.address)
@@ -42,4 +43,44 @@ class ERC20(CryptoAsset):
   @retry_on_429()
   async def get_balance(self, address: str) -> float:
     balance, decimals = await asyncio.gather(self.contract.balance_of(address), self.contract.decimals)
-    return balance / 10**decimals
\ No newline at end of file
+    return balance / 10**decimals
+
+  @retry_on_429()
+  async def get_balances(self, addresses: list[str]) -> dict[str, float]:
+    balances, decimals = await asyncio.gather(self.contract.balances_of(addresses), self.contract.decimals)
+    return {address: balance / 10**decimals for address, balance in zip(addresses, balances)}
+
+  async def received(self, addresses: list[str]) -> dict[str, float]:
+    """
+    An address is seeded with its balance at the confirmed head the first time
+    it is seen, from then on only Transfer logs to the watched addresses are
+    read, a handful of eth_getLogs calls per poll however many are pending.
+    """
+    head = await self.contract.base.web3.eth.block_number - self.confirmations
+    original = {address.lower(): address for address in addresses}
+    addresses = list(original)
+
+    new = [address for address in addresses if address not in self.__received]
+    balances = await self.contract.balances_of(new, block_identifier=head) if new else []
+    for address, balance in zip(new, balances):
+      self.__received[address] = (balance, head)
+    self.__received = {address: self.__received[address] for address in addresses}
+
+    if self.__cursor is None:
+      self.__cursor = head + 1
+    while addresses and self.__cursor <= head:
+      to_block = min(head, self.__cursor + self.block_range - 1)
+      transfers = []
+      for i in range(0, len(addresses), self.addresses_per_query):
+        transfers += await self.contract.transfer_logs(self.__cursor, to_block, addresses[i:i + self.addresses_per_query])
+      # applied only once the whole range was read, a failed poll rescans it without double counting
+      for transfer in transfers:
+        amount, counted_to = self.__received.get(transfer.to, (0, head))
+        if transfer.block_number > counted_to:
+          self.__received[transfer.to] = (amount + transfer.value, counted_to)
+      self.__cursor = to_block + 1
+    if not addresses:
+      self.__cursor = head + 1
+
+    decimals = await self.contract.decimals
+    return {original[address]: amount / 10**decimals for address, (amount, _) in self.__received.items()}
@@ -0,0 +1,11 @@
+from bip_utils import Bip44Changes, Bip44Coins, Bip44
+
+def derive_address(xpub: str, coin: Bip44Coins, i: int) -> str:
+  """
+  Address of the external chain child `i` of an account level extended public
+  key (m/44'/coin'/0'), only public derivation so the master secret never
+  has to be on the server.
+  """
+  bip44_acc_ctx = Bip44.FromExtendedKey(xpub, coin)
+  bip44_chg_ctx = bip44_acc_ctx.Change(Bip44Changes.CHAIN_EXT)
+  return bip44_chg_ctx.AddressIndex(i).PublicKey().ToAddress()
@@ -1,7 +1,11 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
 from sqlalchemy import text
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from config import DATABASE_URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncConnection
+from config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE
 import logging
+import asyncio
 
 logger = logging.getLogger(__name__)
 
@@ -9,40 +13,309 @@ from  models.base import Base
 from models.user import User
 from models.session import Session
 from models.filter import Filter
+from models.notification import Notification
+from models.deposit import Deposit
+from models.fsm import FsmState
+from models.pending_login import PendingLoginRecord
 """
 Imports of these models are needed to correctly create tables in the database.
 For more information see https://stackoverflow.com/questions/7478403/sqlalchemy-classes-across-files
 """
 
+# telegram ids used to be stored as 16 byte big-endian two's complement blobs (models.base.I128),
+# every real id fits the low 8 bytes which postgres can reinterpret as a signed bigint
+I128_TO_BIGINT = "('x' || encode(substring({column} from 9 for 8), 'hex'))::bit(64)::bigint"
+
+# (table, column, unique constraint created by the model)
+I128_COLUMNS = [
+  ("users", "telegram_id", "users_telegram_id_key"),
+  ("filters", "recipient_telegram_id", None),
+]
+
+# every relation of the current schema, with the columns of tables and the validity of indexes
+SCHEMA_QUERY = """
+SELECT c.relname, c.relkind::text, a.attname, format_type(a.atttypid, a.atttypmod), i.indisvalid
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_attribute a ON c.relkind = 'r' AND a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+LEFT JOIN pg_catalog.pg_index i ON c.relkind = 'i' AND i.indexrelid = c.oid
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'i', 'S')
+"""
+
+# (version, description, Database method), applied once each and recorded in schema_migrations.
+# Every migration is idempotent and checks the schema itself, a new model needs a new create_missing_tables entry.
+MIGRATIONS = [
+  (1, "create missing tables", "create_missing_tables"),
+  (2, "store telegram ids as bigint", "migrate_telegram_ids"),
+  (3, "index hot lookups", "create_missing_indexes"),
+  (4, "hand out user ids from a sequence", "sync_user_id_sequence"),
+  (5, "store pending logins apart from the fsm", "create_missing_tables"),
+  (6, "drop login key material from fsm data", "strip_fsm_logins"),
+  (7, "count notification delivery attempts", "add_notification_attempts"),
+]
+MIGRATIONS_LOCK_KEY = 7240315
+
+class Schema:
+  def __init__(self):
+    self.tables: set[str] = set()
+    # index name -> valid
+    self.indexes: dict[str, bool] = {}
+    self.sequences: set[str] = set()
+    # (table, column) -> type as postgres formats it, e.g. "bigint"
+    self.columns: dict[tuple[str, str], str] = {}
+
+class _UnitOfWork:
+  __slots__ = ("conn", "session", "lock", "owner", "depth", "closed")
+
+  def __init__(self):
+    # checked out by the first session() of the update, updates that never reach the database take no connection
+    self.conn: AsyncConnection | None = None
+    self.session: AsyncSession | None = None
+    # tasks spawned by the handler (asyncio.gather) inherit the unit, an AsyncSession serves one of them at a time
+    self.lock = asyncio.Lock()
+    self.owner: asyncio.Task | None = None
+    self.depth = 0
+    self.closed = False
+
+_unit_of_work: ContextVar[_UnitOfWork | None] = ContextVar("unit_of_work", default=None)
+# the unit whose session the current block holds, tasks spawned inside the block inherit it too
+_holding: ContextVar[_UnitOfWork | None] = ContextVar("unit_of_work_holding", default=None)
+
 class Database:
-  def __init__(self, db_url: str, echo: bool = True):
+  def __init__(self, db_url: str, echo: bool = True, pool_size: int = 10, max_overflow: int = 20, pool_timeout: float = 30,
+               pool_recycle: int = 1800, pool_pre_ping: bool = True, statement_cache_size: int = 100):
     self.db_url = db_url
-    self.engine = create_async_engine(self.db_url, echo=echo)
-    self.async_session_maker = async_sessionmaker(self.engine, class_=AsyncSession)
+    self.engine = create_async_engine(
+      self.db_url,
+      echo=echo,
+      pool_size=pool_size,
+      max_overflow=max_overflow,
+      pool_timeout=pool_timeout,
+      pool_recycle=pool_recycle,
+      pool_pre_ping=pool_pre_ping,
+      # both the sqlalchemy and the asyncpg prepared statement caches, 0 behind pgbouncer in transaction mode
+      connect_args={"prepared_statement_cache_size": statement_cache_size, "statement_cache_size": statement_cache_size},
+    )
+    self.async_session_maker = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+  @asynccontextmanager
+  async def unit_of_work(self) -> AsyncIterator[None]:
+    """
+    Shares one connection between every `session()` entered in this task and
+    the tasks it spawns, until exit. The connection is checked out on first
+    use and every service call ends its transaction, so slow Telegram calls
+    in between hold an idle connection, not an open transaction.
+    """
+    if _unit_of_work.get() is not None and not _unit_of_work.get().closed:
+      yield
+      return
+
+    unit = _UnitOfWork()
+    token = _unit_of_work.set(unit)
+    try:
+      yield
+    finally:
+      unit.closed = True
+      _unit_of_work.reset(token)
+      if unit.session is not None:
+        await unit.session.close()
+      if unit.conn is not None:
+        await unit.conn.close()
+
+  @asynccontextmanager
+  async def session(self) -> AsyncIterator[AsyncSession]:
+    """
+    The session of the surrounding unit of work, or a session of its own
+    outside of one. Tasks spawned inside an `async with db.session()` block
+    get a session of their own as well: the block holds the unit's session
+    and may be awaiting them, so waiting for it would deadlock.
+    """
+    unit = _unit_of_work.get()
+    task = asyncio.current_task()
+    if unit is None or unit.closed or (_holding.get() is unit and unit.owner is not task):
+      async with self.async_session_maker() as session:
+        yield session
+      return
+
+    # reentrant: a service calling another service in the same task keeps the lock
+    if unit.owner is not task:
+      await unit.lock.acquire()
+      unit.owner = task
+    unit.depth += 1
+    holding = _holding.set(unit)
+    try:
+      if unit.session is None:
+        unit.conn = await self.engine.connect()
+        unit.session = self.async_session_maker(bind=unit.conn)
+      yield unit.session
+    finally:
+      _holding.reset(holding)
+      unit.depth -= 1
+      if unit.depth == 0:
+        try:
+          # what the service call returned is detached like with a session of its own, and an
+          # uncommitted read transaction does not stay open until the next call
+          unit.session.expunge_all()
+          if unit.session.in_transaction():
+            await unit.session.rollback()
+        finally:
+          unit.owner = None
+          unit.lock.release()
+
+  async def inspect(self) -> Schema:
+    """Tables, indexes, sequences and column types of the current schema in one catalog query."""
+    schema = Schema()
+    async with self.engine.connect() as conn:
+      result = await conn.execute(text(SCHEMA_QUERY))
+    for relname, relkind, column, column_type, valid in result:
+      if relkind == "r":
+        schema.tables.add(relname)
+        if column is not None:
+          schema.columns[(relname, column)] = column_type
+      elif relkind == "i":
+        schema.indexes[relname] = bool(valid)
+      elif relkind == "S":
+        schema.sequences.add(relname)
+    return schema
+
+  async def applied_migrations(self, schema: Schema) -> set[int]:
+    if "schema_migrations" not in schema.tables:
+      return set()
+    async with self.engine.connect() as conn:
+      result = await conn.execute(text("SELECT version FROM schema_migrations"))
+      return set(result.scalars().all())
+
+  async def migrate(self):
+    """
+    Applies the pending MIGRATIONS in order. An up to date database costs a
+    catalog query and a version read, workers starting together take turns
+    on an advisory lock and skip what another one already applied.
+    """
+    applied = await self.applied_migrations(await self.inspect())
+    if all(version in applied for version, _, _ in MIGRATIONS):
+      return
+
+    async with self.engine.connect() as lock_conn:
+      lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+      await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+      try:
+        await lock_conn.execute(text(
+          "CREATE TABLE IF NOT EXISTS schema_migrations ("
+          "version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        schema = await self.inspect()
+        applied = await self.applied_migrations(schema)
+        for version, description, migration in MIGRATIONS:
+          if version in applied:
+            continue
+          logger.warning(f"Applying migration {version}: {description}...")
+          await getattr(self, migration)(schema)
+          await lock_conn.execute(
+            text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description) ON CONFLICT DO NOTHING"),
+            {"version": version, "description": description},
+          )
+          # later migrations see what this one created
+          schema = await self.inspect()
+      finally:
+        await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+
+  async def create_missing_tables(self, schema: Schema):
+    # only the missing tables are created, a new model must not wipe the existing ones
+    missing = [table for table in Base.metadata.sorted_tables if table.name not in schema.tables]
+    if missing:
+      async with self.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=missing)
+
+  async def migrate_telegram_ids(self, schema: Schema, batch_size: int = 5000):
+    for table, column, constraint in I128_COLUMNS:
+      if schema.columns.get((table, column)) == "bytea":
+        logger.warning(f"Converting {table}.{column} to bigint...")
+        await self.convert_i128_column(table, column, constraint, batch_size)
+
+  async def create_missing_indexes(self, schema: Schema):
+    """Model indexes missing from tables created before them, built without blocking writes."""
+    async with self.engine.connect() as conn:
+      conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+      for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+          if schema.indexes.get(index.name):
+            continue
+          if index.name in schema.indexes:
+            # a failed concurrent build leaves an invalid index behind, start from scratch
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+          logger.warning(f"Creating index {index.name}...")
+          columns = ", ".join(column.name for column in index.columns)
+          unique = "UNIQUE " if index.unique else ""
+          await conn.execute(text(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {table.name} ({columns})"))
+
+  async def sync_user_id_sequence(self, schema: Schema):
+    # user ids used to be max(id) + 1 computed in python, the sequence has to continue after them
+    async with self.engine.begin() as conn:
+      await conn.execute(text("CREATE SEQUENCE IF NOT EXISTS users_id_seq OWNED BY users.id"))
+      await conn.execute(text("ALTER TABLE users ALTER COLUMN id SET DEFAULT nextval('users_id_seq')"))
+      await conn.execute(text("SELECT setval('users_id_seq', COALESCE((SELECT max(id) FROM users), 0) + 1, false)"))
+
+  async def strip_fsm_logins(self, schema: Schema):
+    # logins used to be exported whole into the fsm data, auth key included, now it holds their token only
+    if "fsm_states" in schema.tables:
+      async with self.engine.begin() as conn:
+        await conn.execute(text("UPDATE fsm_states SET data = data - 'login' WHERE jsonb_typeof(data -> 'login') = 'object'"))
+
+  async def add_notification_attempts(self, schema: Schema):
+    if "notifications" in schema.tables and ("notifications", "attempts") not in schema.columns:
+      async with self.engine.begin() as conn:
+        await conn.execute(text(
+          "ALTER TABLE notifications ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0, "
+          "ADD COLUMN IF NOT EXISTS failed_at TIMESTAMPTZ"
+        ))
+
+  async def convert_i128_column(self, table: str, column: str, constraint: str | None, batch_size: int):
+    """
+    Rewrites an I128 blob column as BIGINT without holding long locks: a shadow
+    column is backfilled in small transactions (old workers can keep writing),
+    the unique index is built concurrently, and only the final swap takes an
+    exclusive lock to convert rows written in the meantime.
+    """
+    shadow = f"{column}_bigint"
+    index = f"ix_{table}_{shadow}"
+    convert = I128_TO_BIGINT.format(column=column)
 
-  async def check_all_tables_exist(self) -> bool:
     async with self.engine.begin() as conn:
-      for table in Base.metadata.tables.values():
+      await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {shadow} BIGINT"))
+
+    while True:
+      async with self.engine.begin() as conn:
         result = await conn.execute(
           text(
-            "SELECT EXISTS ("
-            "SELECT 1 FROM information_schema.tables "
-            "WHERE table_name = :table_name)"
+            f"UPDATE {table} SET {shadow} = {convert} "
+            f"WHERE id IN (SELECT id FROM {table} WHERE {shadow} IS NULL LIMIT :batch_size FOR UPDATE SKIP LOCKED)"
           ),
-          {"table_name": table.name},
+          {"batch_size": batch_size},
         )
-        if not result.scalar():
-          return False
-    return True
+      if result.rowcount == 0:
+        break
+
+    if constraint is not None:
+      async with self.engine.connect() as conn:
+        duplicate = await conn.execute(text(f"SELECT {shadow} FROM {table} WHERE {shadow} IS NOT NULL GROUP BY {shadow} HAVING count(*) > 1 LIMIT 1"))
+        duplicate = duplicate.scalar()
+      if duplicate is not None:
+        raise RuntimeError(f"{table}.{column} has duplicate value {duplicate}, resolve it before migrating")
+
+      async with self.engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # a failed concurrent build leaves an invalid index behind, start from scratch
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index}"))
+        await conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY {index} ON {table} ({shadow})"))
 
-  async def create_db_and_tables(self):
     async with self.engine.begin() as conn:
-      if await self.check_all_tables_exist():
-        logger.warning("All tables exist. Skipping creation.")
-      else:
-        logger.warning("Tables missing. Recreating database...")
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+      await conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+      await conn.execute(text(f"UPDATE {table} SET {shadow} = {convert} WHERE {shadow} IS NULL"))
+      await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+      await conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN {shadow} TO {column}"))
+      await conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"))
+      if constraint is not None:
+        await conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {constraint} UNIQUE USING INDEX {index}"))
 
   async def get_session(self) -> AsyncSession:
     return self.async_session_maker()
@@ -50,4 +323,13 @@ class Database:
   async def close(self):
     await self.engine.dispose()
 
-db = Database(DATABASE_URL, echo=False)
\ No newline at end of file
+db = Database(
+  DATABASE_URL,
+  echo=False,
+  pool_size=DB_POOL_SIZE,
+  max_overflow=DB_MAX_OVERFLOW,
+  pool_timeout=DB_POOL_TIMEOUT,
+  pool_recycle=DB_POOL_RECYCLE,
+  pool_pre_ping=DB_POOL_PRE_PING,
+  statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+)
\ No newline at end of file
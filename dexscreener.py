@@ -1,11 +1,10 @@
 from utils.retry import retry_on_429
-import aiohttp
+from utils.http import http_client
 
 @retry_on_429()
 async def get_token_price(token_address):
-  async with aiohttp.ClientSession() as session:
-    url = f"https://api.dexscreener.com/latest/dex/tokens/{token_address}"
-    async with session.get(url) as response:
-      data = await response.json()
-      pairs = data.get("pairs")
-      return float(pairs[0]["priceUsd"]) if pairs else 0.0
\ No newline at end of file
+  url = f"https://api.dexscreener.com/latest/dex/tokens/{token_address}"
+  async with http_client.session.get(url, raise_for_status=True) as response:
+    data = await response.json()
+    pairs = data.get("pairs")
+    return float(pairs[0]["priceUsd"]) if pairs else 0.0
\ No newline at end of file
@@ -7,16 +7,16 @@ from aiogram.types import CallbackQuery, Message
 import pyrogram.errors
 from handlers.common.common import get_back_to_menu_button, send_message
 from utils.custom_filters import IsUserExistFilter
-from config import random_creds, random_proxy
 from aiogram.filters import StateFilter
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from language import LanguageService
 from services.user import UserService
 from services.session import SessionService
+from services.client_pool import client_pool, INVALID_SESSION_ERRORS
+from services.login_registry import login_registry
 from utils.phone_number import is_valid_phone_number
 from utils.login_code import validate_login_code
-from utils.proxy import parse_proxy_url
 from utils.session import hide_session_string
 from bot import bot
 import traceback
@@ -66,12 +66,12 @@ async def get_accounts_markup(telegram_id: int, language_code: str):
   keyboard_builder = InlineKeyboardBuilder()
   session_buttons = []
 
-  user = await UserService.get_by_tgid(telegram_id)
-  for session in user.sessions:
+  sessions = await SessionService.get_overview(telegram_id)
+  for session in sessions:
     session_buttons.append(types.InlineKeyboardButton(text=hide_session_string(session.session_string), callback_data=create_callback_accounts(2, session_id=session.id)))
 
   keyboard_builder.add(*session_buttons)
-  if await UserService.new_session_available(telegram_id):
+  if len(sessions) < UserService.sessions_per_user:
     add_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "add"), callback_data=create_callback_accounts(1))
     keyboard_builder.add(add_button, get_back_to_menu_button(language_code))
     adj = len(session_buttons) * [1] + [2]
@@ -136,20 +136,36 @@ async def get_phone_number(message: types.Message, state: FSMContext):
     await asyncio.gather(state.update_data(msg_id=msg_id), state.set_state(AccountsStates.phone_number), bot.delete_message(message.chat.id, message.message_id))
     return
   
-  api_id, api_hash = random_creds()
-  proxy = random_proxy()
-  if proxy is not None:
-    proxy = parse_proxy_url(proxy)
-  app = pyrogram.Client(":memory:", device_model="Snoops Buy", client_platform=pyrogram.enums.ClientPlatform.ANDROID, app_version="Android 11.14.1", api_id=api_id, api_hash=api_hash, in_memory=True, proxy=proxy)
-  await app.connect()
+  login = None
   try:
-    sent = await app.send_code(phone_number)
+    login = await login_registry.begin(chat_id)
+    if login is not None:
+      sent = await login.app.send_code(phone_number)
   except Exception as e:
     tb_str = traceback.format_exc()
     logger.warning(f"[{telegram_id}] failed to login: {e} / {tb_str}")
-    await asyncio.gather(state.update_data(msg_id=msg_id), state.set_state(AccountsStates.phone_number), bot.delete_message(message.chat.id, message.message_id), app.disconnect())
+    await asyncio.gather(state.update_data(msg_id=msg_id), state.set_state(AccountsStates.phone_number), bot.delete_message(message.chat.id, message.message_id))
+    if login is not None:
+      await login_registry.discard(login.token)
     return
 
+  if login is None:
+    # every proxy and credential is busy with other logins (the registry logs it), the same number may be sent again
+    back_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "back"), callback_data=create_callback_accounts(0))
+    markup = types.InlineKeyboardMarkup(inline_keyboard=[[back_button]])
+    msg = LanguageService.get_translation(language_code, "login_busy")
+    if msg_id is not None:
+      try:
+        await bot.edit_message_text(msg, message_id=msg_id, chat_id=chat_id, reply_markup=markup)
+      except Exception:
+        msg_id = (await bot.send_message(chat_id, msg, reply_markup=markup)).message_id
+    else:
+      msg_id = (await bot.send_message(chat_id, msg, reply_markup=markup)).message_id
+    await asyncio.gather(state.update_data(msg_id=msg_id), state.set_state(AccountsStates.phone_number), bot.delete_message(message.chat.id, message.message_id))
+    return
+  login.phone_number = phone_number
+  login.phone_code_hash = sent.phone_code_hash
+
   back_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "back"), callback_data=create_callback_accounts(1))
   markup = types.InlineKeyboardMarkup(inline_keyboard=[[back_button]])
   login_code_sent = LanguageService.get_translation(language_code, "login_code_sent")
@@ -175,29 +191,32 @@ async def get_phone_number(message: types.Message, state: FSMContext):
   else:
     await bot.send_message(chat_id, msg, reply_markup=markup)
 
-  await asyncio.gather(state.update_data(msg_id=msg_id, app=app, phone_number=phone_number, phone_code_hash=sent.phone_code_hash), bot.delete_message(message.chat.id, message.message_id), state.set_state(AccountsStates.login_code))
+  # the next step may reach another worker, it finds the login by the token
+  await login_registry.save(login)
+  await asyncio.gather(state.update_data(msg_id=msg_id, login=login.token), bot.delete_message(message.chat.id, message.message_id), state.set_state(AccountsStates.login_code))
 
 @accounts_router.message(IsUserExistFilter(), StateFilter(AccountsStates.login_code))
 async def get_login_code(message: types.Message, state: FSMContext):
   data = await state.get_data()
   await state.clear()
   msg_id = data.get("msg_id")
-  app = data.get("app")
-  phone_number = data.get("phone_number")
-  phone_code_hash = data.get("phone_code_hash")
+  token = data.get("login")
   chat_id = message.chat.id
   username = message.from_user.username or ""
   telegram_id = chat_id
   language_code = await UserService.get_language_code(telegram_id)
-  if not all([msg_id, app, phone_number, phone_code_hash]):
-    logger.warning(f"[{telegram_id}] invalid login code data: {data}")
-    await asyncio.gather(state.update_data(msg_id=msg_id, app=app, phone_number=phone_number, phone_code_hash=phone_code_hash), state.set_state(AccountsStates.login_code), bot.delete_message(message.chat.id, message.message_id))
-    return
+  login = await login_registry.get(chat_id, token)
+  if login is None:
+    # expired or never started, the login starts over from the phone number
+    logger.warning(f"[{telegram_id}] login code for an expired or unknown login")
+    await bot.delete_message(message.chat.id, message.message_id)
+    return await add_session(None, state, chat_id=chat_id, msg_id=msg_id, username=username)
+  app = login.app
 
   login_code = validate_login_code(message.text or "")
 
   try:
-    await app.sign_in(phone_number, phone_code_hash, login_code)
+    await app.sign_in(login.phone_number, login.phone_code_hash, login_code)
   except pyrogram.errors.SessionPasswordNeeded:
     back_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "back"), callback_data=create_callback_accounts(1))
     markup = types.InlineKeyboardMarkup(inline_keyboard=[[back_button]])
@@ -220,22 +239,22 @@ async def get_login_code(message: types.Message, state: FSMContext):
     else:
       await send_message(message, msg, reply_markup=markup)
 
-    await asyncio.gather(state.update_data(msg_id=msg_id, app=app, phone_number=phone_number, phone_code_hash=phone_code_hash), state.set_state(AccountsStates.password), bot.delete_message(message.chat.id, message.message_id))
+    await asyncio.gather(state.update_data(msg_id=msg_id, login=token), state.set_state(AccountsStates.password), bot.delete_message(message.chat.id, message.message_id))
     return
   except pyrogram.errors.PhoneCodeExpired:
-    await asyncio.gather(bot.delete_message(message.chat.id, message.message_id), app.disconnect())
+    await asyncio.gather(bot.delete_message(message.chat.id, message.message_id), login_registry.finish(login.token))
     return await add_session(None, state, chat_id=chat_id, msg_id=msg_id, username=username)
   except Exception as e:
     tb_str = traceback.format_exc()
     logger.warning(f"[{telegram_id}] failed to login: {e} / {tb_str}")
-    await asyncio.gather(state.update_data(msg_id=msg_id, app=app, phone_number=phone_number, phone_code_hash=phone_code_hash), state.set_state(AccountsStates.login_code), bot.delete_message(message.chat.id, message.message_id))
+    await asyncio.gather(state.update_data(msg_id=msg_id, login=token), state.set_state(AccountsStates.login_code), bot.delete_message(message.chat.id, message.message_id))
     return
   
   s = await app.export_session_string()
   if await UserService.new_session_available(telegram_id):
     await UserService.add_session(telegram_id, app.api_id, app.api_hash, s)
 
-  await asyncio.gather(bot.delete_message(message.chat.id, message.message_id), app.disconnect())
+  await asyncio.gather(bot.delete_message(message.chat.id, message.message_id), login_registry.finish(login.token))
   await accounts(None, chat_id=chat_id, msg_id=msg_id)
 
 @accounts_router.message(IsUserExistFilter(), StateFilter(AccountsStates.password))
@@ -243,33 +262,34 @@ async def get_password(message: types.Message, state: FSMContext):
   data = await state.get_data()
   await state.clear()
   msg_id = data.get("msg_id")
-  app = data.get("app")
-  phone_number = data.get("phone_number")
-  phone_code_hash = data.get("phone_code_hash")
+  token = data.get("login")
   chat_id = message.chat.id
+  username = message.from_user.username or ""
   telegram_id = chat_id
-  if not all([msg_id, app, phone_number, phone_code_hash]):
-    logger.warning(f"[{telegram_id}] invalid password data: {data}")
-    await asyncio.gather(state.update_data(msg_id=msg_id, app=app, phone_number=phone_number, phone_code_hash=phone_code_hash), state.set_state(AccountsStates.password), bot.delete_message(message.chat.id, message.message_id))
-    return
+  login = await login_registry.get(chat_id, token)
+  if login is None:
+    logger.warning(f"[{telegram_id}] password for an expired or unknown login")
+    await bot.delete_message(message.chat.id, message.message_id)
+    return await add_session(None, state, chat_id=chat_id, msg_id=msg_id, username=username)
+  app = login.app
 
   password = message.text or ""
   try:
     await app.check_password(password)
   except pyrogram.errors.PasswordHashInvalid:
-    await asyncio.gather(state.update_data(msg_id=msg_id, app=app, phone_number=phone_number, phone_code_hash=phone_code_hash), state.set_state(AccountsStates.password), bot.delete_message(message.chat.id, message.message_id))
+    await asyncio.gather(state.update_data(msg_id=msg_id, login=token), state.set_state(AccountsStates.password), bot.delete_message(message.chat.id, message.message_id))
     return
   except Exception as e:
     tb_str = traceback.format_exc()
     logger.warning(f"[{telegram_id}] failed to login: {e} / {tb_str}")
-    await asyncio.gather(state.update_data(msg_id=msg_id, app=app, phone_number=phone_number, phone_code_hash=phone_code_hash), state.set_state(AccountsStates.password), bot.delete_message(message.chat.id, message.message_id))
+    await asyncio.gather(state.update_data(msg_id=msg_id, login=token), state.set_state(AccountsStates.password), bot.delete_message(message.chat.id, message.message_id))
     return
 
   s = await app.export_session_string()
   if await UserService.new_session_available(telegram_id):
     await UserService.add_session(telegram_id, app.api_id, app.api_hash, s)
 
-  await asyncio.gather(bot.delete_message(message.chat.id, message.message_id), app.disconnect())
+  await asyncio.gather(bot.delete_message(message.chat.id, message.message_id), login_registry.finish(login.token))
   await accounts(None, chat_id=chat_id, msg_id=msg_id)
 
 async def session_details(callback: types.CallbackQuery):
@@ -280,64 +300,44 @@ async def session_details(callback: types.CallbackQuery):
   session = await SessionService.get_by_id(unpacked_callback.session_id)
   if session is None:
     return
-  proxy = random_proxy()
-  if proxy is not None:
-    proxy = parse_proxy_url(proxy)
-  app = pyrogram.Client(":memory:", device_model="Snoops Buy", client_platform=pyrogram.enums.ClientPlatform.ANDROID, app_version="Android 11.14.1", session_string=session.session_string, api_id=session.api_id, api_hash=session.api_hash, in_memory=True, proxy=proxy)
 
   try:
-    await app.connect()
-  except pyrogram.errors.AuthKeyInvalid:
-    await UserService.remove_session(telegram_id, session.id)
-    return await accounts(callback)
-  except pyrogram.errors.SessionExpired:
+    async with client_pool.borrow(session) as app:
+      me, star_balance, active_sessions = await asyncio.gather(app.get_me(), app.get_stars_balance(), app.get_active_sessions())
+  except INVALID_SESSION_ERRORS:
     await UserService.remove_session(telegram_id, session.id)
     return await accounts(callback)
   except Exception as e:
     tb_str = traceback.format_exc()
-    logger.warning(f"[{telegram_id}] failed to connect using session: {e} / {tb_str}")
+    logger.warning(f"[{telegram_id}] failed to get session info: {e} / {tb_str}")
     return
+
+  current_session = next((s for s in active_sessions.active_sessions if s.is_current), None)
+
+  id = LanguageService.get_translation(language_code, "id")
+  phone_number = LanguageService.get_translation(language_code, "phone_number")
+  username = LanguageService.get_translation(language_code, "username")
+  stars = LanguageService.get_translation(language_code, "stars")
+  session_created_at = LanguageService.get_translation(language_code, "session_created_at")
+  last_active = LanguageService.get_translation(language_code, "last_active")
+  msg = (f"{id}: <code>{me.id}</code>\n"
+        f"{phone_number}: <code>{me.phone_number}</code>\n"
+        f"{username}: <b>{me.username}</b>\n"
+        f"{stars}: {star_balance} ⭐\n\n")
   
-  try:
-    me, star_balance, active_sessions = await asyncio.gather(app.get_me(), app.get_stars_balance(), app.get_active_sessions())
-    current_session = next((s for s in active_sessions.active_sessions if s.is_current), None)
-
-    id = LanguageService.get_translation(language_code, "id")
-    phone_number = LanguageService.get_translation(language_code, "phone_number")
-    username = LanguageService.get_translation(language_code, "username")
-    stars = LanguageService.get_translation(language_code, "stars")
-    session_created_at = LanguageService.get_translation(language_code, "session_created_at")
-    last_active = LanguageService.get_translation(language_code, "last_active")
-    msg = (f"{id}: <code>{me.id}</code>\n"
-          f"{phone_number}: <code>{me.phone_number}</code>\n"
-          f"{username}: <b>{me.username}</b>\n"
-          f"{stars}: {star_balance} ⭐\n\n")
+  if current_session is not None:
+    if current_session.last_active_date is not None:
+      formatted_date = current_session.last_active_date.strftime("%d.%m.%Y %H:%M %p")
+      msg += f"{last_active}: {formatted_date}\n"
     
-    if current_session is not None:
-      if current_session.last_active_date is not None:
-        formatted_date = current_session.last_active_date.strftime("%d.%m.%Y %H:%M %p")
-        msg += f"{last_active}: {formatted_date}\n"
-      
-      if current_session.log_in_date is not None:
-        formatted_date = current_session.log_in_date.strftime("%d.%m.%Y %H:%M %p")
-        msg += f"{session_created_at}: {formatted_date}\n"
-    
-    logout_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "logout"), callback_data=create_callback_accounts(3, session_id=session.id))
-    back_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "back"), callback_data=create_callback_accounts(0))
-    markup = types.InlineKeyboardMarkup(inline_keyboard=[[logout_button, back_button]])
-    await send_message(callback, msg, reply_markup=markup)
-  except pyrogram.errors.AuthKeyInvalid:
-    await UserService.remove_session(telegram_id, session.id)
-    return await accounts(callback)
-  except pyrogram.errors.SessionExpired:
-    await UserService.remove_session(telegram_id, session.id)
-    return await accounts(callback)  
-  except Exception as e:
-    tb_str = traceback.format_exc()
-    logger.warning(f"[{telegram_id}] failed to get session info: {e} / {tb_str}")
-    return
-  finally:
-    await app.disconnect()
+    if current_session.log_in_date is not None:
+      formatted_date = current_session.log_in_date.strftime("%d.%m.%Y %H:%M %p")
+      msg += f"{session_created_at}: {formatted_date}\n"
+  
+  logout_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "logout"), callback_data=create_callback_accounts(3, session_id=session.id))
+  back_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "back"), callback_data=create_callback_accounts(0))
+  markup = types.InlineKeyboardMarkup(inline_keyboard=[[logout_button, back_button]])
+  await send_message(callback, msg, reply_markup=markup)
 
 async def remove_session_confirmation(callback: types.CallbackQuery):
   telegram_id = callback.from_user.id
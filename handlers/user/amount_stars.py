@@ -20,8 +20,8 @@ def create_callback_amount_stars(session_id: int, filter_id: int, amount_stars:
 
 @amount_stars_router.callback_query(AmountStarsCallback.filter(), IsUserExistFilter())
 async def amount_stars(callback: CallbackQuery, state: FSMContext, callback_data: AmountStarsCallback):
-  await FilterService.set_amount_stars(callback_data.filter_id, callback_data.amount_stars)
+  f = await FilterService.set_amount_stars(callback_data.filter_id, callback_data.amount_stars)
   data_str = create_callback_autobuy(2, session_id=callback_data.session_id, filter_id=callback_data.filter_id)
 
   new_callback = callback.model_copy(update={"data": data_str})
-  return await filter_details(new_callback, state)
\ No newline at end of file
+  return await filter_details(new_callback, state, f=f)
\ No newline at end of file
@@ -11,6 +11,8 @@ from aiogram.filters import StateFilter
 from utils.session import hide_session_string
 from services.session import SessionService
 from models.session import Session
+from models.user import User
+from models.filter import Filter
 from language import LanguageService
 from services.user import UserService
 from services.filter import FilterService
@@ -66,9 +68,8 @@ async def get_accounts_markup(telegram_id: int, language_code: str):
   keyboard_builder = InlineKeyboardBuilder()
   session_buttons = []
 
-  user = await UserService.get_by_tgid(telegram_id)
-  for session in user.sessions:
-    status = "🟢" if await SessionService.is_active(session.id) else "🔴"
+  for session in await SessionService.get_overview(telegram_id):
+    status = "🟢" if session.active else "🔴"
     display = f"{status} {hide_session_string(session.session_string)}"
     session_buttons.append(types.InlineKeyboardButton(text=display, callback_data=create_callback_autobuy(1, session_id=session.id)))
 
@@ -84,7 +85,7 @@ async def session_details(callback: CallbackQuery):
   language_code = await UserService.get_language_code(telegram_id)
   unpacked_callback = AutobuyCallback.unpack(callback.data)
   
-  session = await SessionService.get_by_id(unpacked_callback.session_id)
+  session = await SessionService.get_owned(telegram_id, unpacked_callback.session_id)
   if session is None:
     return
   
@@ -106,21 +107,26 @@ async def get_session_details_markup(telegram_id: int, session: Session, languag
     filter_buttons.append(types.InlineKeyboardButton(text=display, callback_data=create_callback_autobuy(2, session_id=session.id, filter_id=filter.id)))
 
   keyboard_builder.add(*filter_buttons)
-  if await SessionService.new_filter_available(session.id):
+  adj = len(filter_buttons) * [1]
+  if len(filter_buttons) > 0:
+    session_status = "pause_all" if any(f.active for f in session.filters) else "activate_all"
+    session_status_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, session_status), callback_data=create_callback_autobuy(12, session_id=session.id))
+    keyboard_builder.add(session_status_button)
+    adj += [1]
+  if len(session.filters) < SessionService.filters_per_session:
     add_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "add"), callback_data=create_callback_autobuy(3, session_id=session.id))
     back_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "back"), callback_data=create_callback_autobuy(0))
     keyboard_builder.add(add_button, back_button)
-    adj = len(filter_buttons) * [1] + [2]
-    keyboard_builder.adjust(*adj)
+    adj += [2]
   else:
     back_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "back"), callback_data=create_callback_autobuy(0))
     keyboard_builder.add(back_button)
-    adj = len(filter_buttons) * [1] + [1]
-    keyboard_builder.adjust(*adj)
+    adj += [1]
+  keyboard_builder.adjust(*adj)
   
   return keyboard_builder.as_markup()
 
-async def filter_details(callback: CallbackQuery | None, state: FSMContext, session_id: int | None = None, filter_id: int | None = None, username: str | None = None, chat_id: int | None = None, msg_id: int | None = None):
+async def filter_details(callback: CallbackQuery | None, state: FSMContext, session_id: int | None = None, filter_id: int | None = None, username: str | None = None, chat_id: int | None = None, msg_id: int | None = None, f: Filter | None = None):
   await state.clear()  
   if all([session_id, filter_id, username, chat_id, msg_id]):
     telegram_id = chat_id
@@ -133,7 +139,8 @@ async def filter_details(callback: CallbackQuery | None, state: FSMContext, sess
 
   language_code = await UserService.get_language_code(telegram_id)
 
-  f = await FilterService.get_by_id(filter_id)
+  if f is None:
+    f = await FilterService.get_by_id(filter_id)
   if f is None:
     return
 
@@ -180,12 +187,11 @@ async def filter_details(callback: CallbackQuery | None, state: FSMContext, sess
 async def set_status(callback: CallbackQuery, state: FSMContext):
   unpacked_callback = AutobuyCallback.unpack(callback.data)
 
-  f = await FilterService.get_by_id(unpacked_callback.filter_id)
+  f = await FilterService.toggle_status(unpacked_callback.filter_id)
   if f is None:
     return
-  
-  await FilterService.set_status(f.id, not f.active)
-  return await filter_details(callback, state)
+
+  return await filter_details(callback, state, f=f)
 
 async def set_min_price(callback: CallbackQuery, state: FSMContext):
   from handlers.user.min_price import create_callback_min_price
@@ -243,9 +249,9 @@ async def get_min_price(message: types.Message, state: FSMContext):
     await asyncio.gather(state.update_data(msg_id=msg_id, session_id=session_id, filter_id=filter_id), state.set_state(AutobuyStates.min_price), bot.delete_message(message.chat.id, message.message_id))
     return
 
-  await FilterService.set_min_price(filter_id, min_price)
+  f = await FilterService.set_min_price(filter_id, min_price)
   await bot.delete_message(message.chat.id, message.message_id)
-  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id)
+  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id, f=f)
 
 async def set_max_price(callback: CallbackQuery, state: FSMContext):
   from handlers.user.max_price import create_callback_max_price
@@ -304,9 +310,9 @@ async def get_max_price(message: types.Message, state: FSMContext):
     await asyncio.gather(state.update_data(msg_id=msg_id, session_id=session_id, filter_id=filter_id), state.set_state(AutobuyStates.max_price), bot.delete_message(message.chat.id, message.message_id))
     return
 
-  await FilterService.set_max_price(filter_id, max_price)
+  f = await FilterService.set_max_price(filter_id, max_price)
   await bot.delete_message(message.chat.id, message.message_id)
-  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id)
+  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id, f=f)
 
 async def set_min_supply(callback: CallbackQuery, state: FSMContext):
   from handlers.user.min_supply import create_callback_min_supply
@@ -364,9 +370,9 @@ async def get_min_supply(message: types.Message, state: FSMContext):
     await asyncio.gather(state.update_data(msg_id=msg_id, session_id=session_id, filter_id=filter_id), state.set_state(AutobuyStates.min_supply), bot.delete_message(message.chat.id, message.message_id))
     return
 
-  await FilterService.set_min_supply(filter_id, min_supply)
+  f = await FilterService.set_min_supply(filter_id, min_supply)
   await bot.delete_message(message.chat.id, message.message_id)
-  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id)
+  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id, f=f)
 
 async def set_max_supply(callback: CallbackQuery, state: FSMContext):
   from handlers.user.max_supply import create_callback_max_supply
@@ -425,9 +431,9 @@ async def get_max_supply(message: types.Message, state: FSMContext):
     await asyncio.gather(state.update_data(msg_id=msg_id, session_id=session_id, filter_id=filter_id), state.set_state(AutobuyStates.max_supply), bot.delete_message(message.chat.id, message.message_id))
     return
 
-  await FilterService.set_max_supply(filter_id, max_supply)
+  f = await FilterService.set_max_supply(filter_id, max_supply)
   await bot.delete_message(message.chat.id, message.message_id)
-  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id)
+  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id, f=f)
 
 async def set_amount_stars(callback: CallbackQuery, state: FSMContext):
   from handlers.user.amount_stars import create_callback_amount_stars
@@ -486,9 +492,9 @@ async def get_amount_stars(message: types.Message, state: FSMContext):
     await asyncio.gather(state.update_data(msg_id=msg_id, session_id=session_id, filter_id=filter_id), state.set_state(AutobuyStates.amount_stars), bot.delete_message(message.chat.id, message.message_id))
     return
 
-  await FilterService.set_amount_stars(filter_id, amount_stars)
+  f = await FilterService.set_amount_stars(filter_id, amount_stars)
   await bot.delete_message(message.chat.id, message.message_id)
-  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id)
+  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id, f=f)
 
 async def set_recipient_telegram_id(callback: CallbackQuery, state: FSMContext):
   telegram_id = callback.from_user.id
@@ -541,9 +547,9 @@ async def get_recipient_telegram_id(message: types.Message, state: FSMContext):
     await asyncio.gather(state.update_data(msg_id=msg_id, session_id=session_id, filter_id=filter_id), state.set_state(AutobuyStates.recipient), bot.delete_message(message.chat.id, message.message_id))
     return
 
-  await FilterService.set_recipient_telegram_id(filter_id, recipient_telegram_id)
+  f = await FilterService.set_recipient_telegram_id(filter_id, recipient_telegram_id)
   await bot.delete_message(message.chat.id, message.message_id)
-  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id)
+  return await filter_details(None, state, session_id=session_id, filter_id=filter_id, username=message.from_user.username, chat_id=message.chat.id, msg_id=msg_id, f=f)
   
 async def add_filter(callback: CallbackQuery, state: FSMContext):
   unpacked_callback = AutobuyCallback.unpack(callback.data)
@@ -559,6 +565,18 @@ async def add_filter(callback: CallbackQuery, state: FSMContext):
   new_callback = callback.model_copy(update={"data": data_str})
   return await filter_details(new_callback, state)
 
+async def set_session_status(callback: CallbackQuery):
+  telegram_id = callback.from_user.id
+  unpacked_callback = AutobuyCallback.unpack(callback.data)
+
+  session = await SessionService.get_owned(telegram_id, unpacked_callback.session_id)
+  if session is None:
+    return
+
+  active = any(f.active for f in session.filters)
+  await FilterService.update_session(session.id, active=not active)
+  return await session_details(callback)
+
 async def delete_filter(callback: CallbackQuery, state: FSMContext):
   unpacked_callback = AutobuyCallback.unpack(callback.data)
   
@@ -569,7 +587,7 @@ async def delete_filter(callback: CallbackQuery, state: FSMContext):
   return await session_details(new_callback)
 
 @autobuy_router.callback_query(AutobuyCallback.filter(), IsUserExistFilter())
-async def navigate(callback: CallbackQuery, state: FSMContext, callback_data: AutobuyCallback):
+async def navigate(callback: CallbackQuery, state: FSMContext, callback_data: AutobuyCallback, user: User):
   current_level = callback_data.level
 
   levels = {
@@ -584,9 +602,10 @@ async def navigate(callback: CallbackQuery, state: FSMContext, callback_data: Au
     8: set_min_supply,
     9: set_max_supply,
     10: set_amount_stars,
-    11: set_recipient_telegram_id
+    11: set_recipient_telegram_id,
+    12: set_session_status
   }
-  is_valid = await UserService.is_subscription_valid(callback.from_user.id)
+  is_valid = UserService.is_subscription_active(user)
   if current_level != 0 and not is_valid:
     return
 
@@ -20,8 +20,8 @@ def create_callback_max_price(session_id: int, filter_id: int, max_price: int):
 
 @max_price_router.callback_query(MaxPriceCallback.filter(), IsUserExistFilter())
 async def max_price(callback: CallbackQuery, state: FSMContext, callback_data: MaxPriceCallback):
-  await FilterService.set_max_price(callback_data.filter_id, callback_data.max_price)
+  f = await FilterService.set_max_price(callback_data.filter_id, callback_data.max_price)
   data_str = create_callback_autobuy(2, session_id=callback_data.session_id, filter_id=callback_data.filter_id)
 
   new_callback = callback.model_copy(update={"data": data_str})
-  return await filter_details(new_callback, state)
\ No newline at end of file
+  return await filter_details(new_callback, state, f=f)
\ No newline at end of file
@@ -20,8 +20,8 @@ def create_callback_max_supply(session_id: int, filter_id: int, max_supply: int)
 
 @max_supply_router.callback_query(MaxSupplyCallback.filter(), IsUserExistFilter())
 async def max_supply(callback: CallbackQuery, state: FSMContext, callback_data: MaxSupplyCallback):
-  await FilterService.set_max_supply(callback_data.filter_id, callback_data.max_supply)
+  f = await FilterService.set_max_supply(callback_data.filter_id, callback_data.max_supply)
   data_str = create_callback_autobuy(2, session_id=callback_data.session_id, filter_id=callback_data.filter_id)
 
   new_callback = callback.model_copy(update={"data": data_str})
-  return await filter_details(new_callback, state)
\ No newline at end of file
+  return await filter_details(new_callback, state, f=f)
\ No newline at end of file
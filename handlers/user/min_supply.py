@@ -20,8 +20,8 @@ def create_callback_min_supply(session_id: int, filter_id: int, min_supply: int)
 
 @min_supply_router.callback_query(MinSupplyCallback.filter(), IsUserExistFilter())
 async def min_supply(callback: CallbackQuery, state: FSMContext, callback_data: MinSupplyCallback):
-  await FilterService.set_min_supply(callback_data.filter_id, callback_data.min_supply)
+  f = await FilterService.set_min_supply(callback_data.filter_id, callback_data.min_supply)
   data_str = create_callback_autobuy(2, session_id=callback_data.session_id, filter_id=callback_data.filter_id)
 
   new_callback = callback.model_copy(update={"data": data_str})
-  return await filter_details(new_callback, state)
\ No newline at end of file
+  return await filter_details(new_callback, state, f=f)
\ No newline at end of file
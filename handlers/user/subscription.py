@@ -5,14 +5,18 @@ from aiogram.filters.callback_data import CallbackData
 from utils.custom_filters import IsUserExistFilter
 from aiogram.types import CallbackQuery, Message
 from handlers.common.common import send_message, send_to_admins
+from bot import bot
 from aiogram.fsm.context import FSMContext
 from config import PRICE_30_DAYS, BASE_RPC
 from services.user import UserService
+from services.price_oracle import price_oracle
+from services.deposit import DepositService
+from services.deposit_watcher import deposit_watcher
+from models.deposit import Deposit
 from language import LanguageService
 from crypto_api.TRC20 import TRC20
 from crypto_api.BEP20 import BEP20
 from crypto_api.ERC20 import ERC20
-import asyncio
 import inspect
 import logging
 
@@ -23,6 +27,8 @@ assets = [
   BEP20("USDT", "0x55d398326f99059fF775485246999027B3197955"),
   TRC20("USDT", "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"),
 ]
+price_oracle.register(*assets)
+deposit_watcher.register(*assets)
 
 subscription_router = Router()
 
@@ -85,48 +91,62 @@ async def crypto_payment(callback: CallbackQuery, state: FSMContext):
   crypto_deposit_amount = LanguageService.get_translation(language_code, "crypto_deposit_amount")
   crypto_address = LanguageService.get_translation(language_code, "crypto_address")
   symbol = await asset.symbol
-  price_usd = await asset.price_usd()
-  deposit_amount = unpacked_callback.price / price_usd
+  price_usd = await price_oracle.price_usd(asset)
+  # stored as shown, a user paying exactly the displayed amount must not fall short by rounding
+  deposit_amount = round(unpacked_callback.price / price_usd, 6)
 
-  secret_key, public_key = await asset.create_wallet()
+  deposit = await DepositService.create(telegram_id, asset, deposit_amount, unpacked_callback.price)
   msg = (f'<a href="{await asset.link}">{await asset.network} | {symbol}</a> {crypto_deposit_warning}\n\n'
-         f'{crypto_deposit_amount}<code>{round(deposit_amount, 6)}</code> <b>{symbol}</b>\n'
-         f'{crypto_address}: <code>{public_key}</code>')
+         f'{crypto_deposit_amount}<code>{deposit_amount}</code> <b>{symbol}</b>\n'
+         f'{crypto_address}: <code>{deposit.address}</code>')
   
   check_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "check"), callback_data=create_callback_subscription(3, price=unpacked_callback.price, asset_i=unpacked_callback.asset_i))
   cancel_button = types.InlineKeyboardButton(text=LanguageService.get_translation(language_code, "cancel"), callback_data=create_callback_subscription(0))
   markup = types.InlineKeyboardMarkup(inline_keyboard=[[check_button], [cancel_button]])
-  await state.update_data(secret_key=secret_key, public_key=public_key, deposit_amount=deposit_amount)
+  await state.update_data(deposit_id=deposit.id)
   await send_message(callback, msg, reply_markup=markup)
   
 async def check_payment(callback: CallbackQuery, state: FSMContext):
   from handlers.user.my_profile import my_profile
 
   data = await state.get_data()
-  await state.clear()
-  secret_key = data.get("secret_key")
-  public_key = data.get("public_key")
-  deposit_amount = data.get("deposit_amount")
-
+  deposit_id = data.get("deposit_id")
   telegram_id = callback.from_user.id
-  unpacked_callback = SubscriptionCallback.unpack(callback.data)
-
-  asset = assets[unpacked_callback.asset_i]
 
-  balance = await asset.get_balance(public_key)
-  if balance < deposit_amount:
-    await state.update_data(secret_key=secret_key, public_key=public_key, deposit_amount=deposit_amount)
-    await callback.answer()
+  # deposits are credited by the deposit watcher, this only reports where it stands
+  deposit = await DepositService.get_by_id(deposit_id) if deposit_id is not None else None
+  if deposit is not None and deposit.telegram_id == telegram_id and deposit.status == "pending":
+    language_code = await UserService.get_language_code(telegram_id)
+    await callback.answer(LanguageService.get_translation(language_code, "payment_pending"))
     return
 
-  symbol = await asset.symbol
-  admin_msg = (f'<b>Payment</b> for {deposit_amount} <a href="{await asset.link}">{await asset.network} | {symbol}</a>\n\n'
-               f'ID: <code>{telegram_id}</code>\n'
-               f'Username: <b>{callback.from_user.username or "unknown"}</b>\n'
-               f'Wallet: <span class=\"tg-spoiler\">{secret_key}</span>')
-  await asyncio.gather(send_to_admins(admin_msg), UserService.subscribe_user_for_3_months(telegram_id))
+  await state.clear()
   return await my_profile(callback)
 
+async def notify_deposit(deposit: Deposit):
+  link = ""
+  for asset in assets:
+    if await asset.network == deposit.network and await asset.symbol == deposit.symbol:
+      link = await asset.link
+      break
+  user = await UserService.get_by_tgid(deposit.telegram_id)
+  username = user.telegram_username if user is not None else None
+
+  admin_msg = (f'<b>Payment</b> for {deposit.amount} <a href="{link}">{deposit.network} | {deposit.symbol}</a>\n\n'
+               f'ID: <code>{deposit.telegram_id}</code>\n'
+               f'Username: <b>{username or "unknown"}</b>\n'
+               f'Deposit: <code>#{deposit.index}</code> <code>{deposit.address}</code>')
+  await send_to_admins(admin_msg)
+
+  if user is not None and user.can_receive_messages:
+    language_code = await UserService.get_language_code(deposit.telegram_id)
+    try:
+      await bot.send_message(deposit.telegram_id, LanguageService.get_translation(language_code, "payment_received"))
+    except Exception as e:
+      logger.warning(f"[{deposit.telegram_id}] failed to send payment confirmation: {e}")
+
+deposit_watcher.subscribe(notify_deposit)
+
 @subscription_router.callback_query(SubscriptionCallback.filter(), IsUserExistFilter())
 async def navigate(callback: CallbackQuery, state: FSMContext, callback_data: SubscriptionCallback):
   current_level = callback_data.level
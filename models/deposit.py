@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime, String, Float, Sequence, func
+
+from models.base import Base
+
+# persisted, atomic counter handing out HD derivation indexes
+deposit_index_seq = Sequence("deposit_index_seq", start=0, minvalue=0)
+
+class Deposit(Base):
+    __tablename__ = 'deposits'
+
+    id = Column(Integer, primary_key=True)
+    index = Column(BigInteger, deposit_index_seq, nullable=False, unique=True)
+    telegram_id = Column(BigInteger, nullable=False, index=True)
+    network = Column(String, nullable=False)
+    symbol = Column(String, nullable=False)
+    address = Column(String, nullable=False, index=True)
+    amount = Column(Float, nullable=False)
+    price = Column(Float, nullable=False)
+    status = Column(String, nullable=False, default="pending", index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    paid_at = Column(DateTime(timezone=True), default=None)
@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, DateTime, String, Boolean, Float, func, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, DateTime, String, Boolean, Float, func, ForeignKey
 from sqlalchemy.orm import relationship, backref
 
 from language import LanguageService
-from models.base import Base, I128
+from models.base import Base
 
 class Filter(Base):
     __tablename__ = 'filters'
@@ -14,6 +14,6 @@ class Filter(Base):
     min_supply = Column(Integer, default=0)
     max_supply = Column(Integer, default=-1)
     amount_stars = Column(Integer, default=-1)
-    recipient_telegram_id = Column(I128, nullable=False)
-    session_id = Column(Integer, ForeignKey("sessions.id"))
+    recipient_telegram_id = Column(BigInteger, nullable=False)
+    session_id = Column(Integer, ForeignKey("sessions.id"), index=True)
     session = relationship("Session", back_populates="filters")
\ No newline at end of file
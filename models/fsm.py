@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, DateTime, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from models.base import Base
+
+class FsmState(Base):
+    __tablename__ = 'fsm_states'
+
+    # aiogram storage key, "fsm:<bot>:<chat>:<user>:<destiny>"
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
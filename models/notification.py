@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime, String, func
+
+from models.base import Base
+
+class Notification(Base):
+    __tablename__ = 'notifications'
+
+    id = Column(Integer, primary_key=True)
+    recipient = Column(BigInteger, nullable=False, index=True)
+    gift_id = Column(BigInteger, nullable=False)
+    gift_price = Column(Integer, nullable=True)
+    gift_title = Column(String, nullable=True)
+    gift_supply = Column(Integer, nullable=True)
+    gift_file_id = Column(String, nullable=False)
+    amount_succeeded = Column(Integer, nullable=True)
+    amount_tried = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # failed deliveries so far, the outbox gives up and sets failed_at after a few
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    failed_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, BigInteger, DateTime, LargeBinary
+
+from models.base import Base
+
+class PendingLoginRecord(Base):
+    __tablename__ = 'pending_logins'
+
+    # the opaque token the FSM holds
+    token = Column(String, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    # encrypted JSON: auth key, api credentials, proxy and sign in details, see services/login_registry.py
+    data = Column(LargeBinary, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -13,5 +13,5 @@ class Session(Base):
     api_id = Column(Integer, nullable=False)
     api_hash = Column(String, nullable=False)
     filters = relationship("Filter", back_populates="session", cascade="all, delete-orphan", lazy="selectin", order_by="Filter.id")
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     user = relationship("User", back_populates="sessions")
\ No newline at end of file
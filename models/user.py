@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, DateTime, String, Boolean, Float, func, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, DateTime, String, Boolean, Float, func, ForeignKey
 from sqlalchemy.orm import relationship, backref
 
 from language import LanguageService
-from models.base import Base, I128
+from models.base import Base
 
 
 class User(Base):
@@ -10,7 +10,7 @@ class User(Base):
 
     id = Column(Integer, primary_key=True)
     telegram_username = Column(String, unique=True)
-    telegram_id = Column(I128, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False, unique=True)
     registered_at = Column(DateTime, default=func.now())
     can_receive_messages = Column(Boolean, default=True)
     language = Column(String, default=LanguageService.get_default_code())
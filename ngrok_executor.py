@@ -1,6 +1,6 @@
 import os
-import aiohttp
 from pyngrok import ngrok
+from utils.http import http_client
 
 def start_ngrok():
   ngrok_token = os.environ.get("NGROK_TOKEN")
@@ -10,14 +10,13 @@ def start_ngrok():
   return http_tunnel.public_url
 
 async def get_ngrok_public_url(ngrok_hostname: str):
-  async with aiohttp.ClientSession() as session:
-    async with session.get(f"http://{ngrok_hostname}/api/tunnels", timeout=5) as resp:
-      resp.raise_for_status()
-      data = await resp.json()
-      for t in data.get("tunnels", []):
-        pub = t.get("public_url", "")
-        if pub.startswith("https://"):
-          return pub
+  async with http_client.session.get(f"http://{ngrok_hostname}/api/tunnels", timeout=5) as resp:
+    resp.raise_for_status()
+    data = await resp.json()
+    for t in data.get("tunnels", []):
+      pub = t.get("public_url", "")
+      if pub.startswith("https://"):
+        return pub
 
 async def get_webhook_host(ngrok_hostname: str | None = None) -> str:
   if ngrok_hostname is None:
@@ -0,0 +1,48 @@
+"""
+Latency of the postgres FSM storage, against the database of DATABASE_URL:
+the keys it writes are negative chat ids no Telegram chat has. Run from the
+repo root with `python -m scripts.bench_fsm_storage`.
+"""
+import statistics
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from db import db
+from utils.fsm_storage import PostgresStorage, fsm_storage
+
+async def benchmark(storage: PostgresStorage, rounds: int = 1000) -> dict[str, dict[str, float]]:
+  """Median and p95 latency in ms of state/data reads and writes on fresh keys, uncached and, with the cache on, cached."""
+  async def measure(operation) -> dict[str, float]:
+    samples = []
+    for i in range(rounds):
+      started_at = time.perf_counter()
+      await operation(StorageKey(bot_id=0, chat_id=-i - 1, user_id=-i - 1))
+      samples.append((time.perf_counter() - started_at) * 1000)
+    samples.sort()
+    return {"p50": statistics.median(samples), "p95": samples[int(0.95 * (len(samples) - 1))]}
+
+  results = {
+    "set_state": await measure(lambda key: storage.set_state(key, "benchmark:state")),
+    "set_data": await measure(lambda key: storage.set_data(key, {"msg_id": 1})),
+  }
+  storage._cache.clear()
+  results["get_state_uncached"] = await measure(storage.get_state)
+  # FSM_CACHE_TTL=0 (the default, for several workers) turns the cache off, these would be reads again
+  if storage.cache_ttl > 0:
+    results["get_state_cached"] = await measure(storage.get_state)
+    results["update_data_cached"] = await measure(lambda key: storage.update_data(key, {"msg_id": 2}))
+  await measure(lambda key: storage.set_state(key, None))
+  await measure(lambda key: storage.set_data(key, {}))
+  await storage.cleanup()
+  return results
+
+if __name__ == "__main__":
+  async def main():
+    await db.migrate()
+    for operation, latency in (await benchmark(fsm_storage)).items():
+      print(f"{operation:<20} p50 {latency['p50']:.2f} ms  p95 {latency['p95']:.2f} ms")
+    await db.close()
+
+  asyncio.run(main())
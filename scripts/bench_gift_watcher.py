@@ -0,0 +1,72 @@
+"""
+Detection-to-purchase latency of the gift watcher, no Telegram nor database
+involved. Run from the repo root with `python -m scripts.bench_gift_watcher`.
+"""
+import datetime
+import statistics
+import asyncio
+import random
+import math
+
+from models.filter import Filter
+from models.session import Session
+from models.user import User
+from services.filter_index import FilterIndex
+from services.gift_watcher import FakeGiftBackend, Gift, GiftWatcher, PurchaseResult
+
+async def benchmark(filters: int = 10000, drops: int = 20, poll_interval: float = 0.05, catalog_latency: float = 0.02, buy_latency: float = 0.05) -> dict[str, dict[str, float]]:
+  """
+  Median and p95 latency in ms from detection and from release to the first
+  purchase, over `drops` limited gifts against `filters` random filters, all
+  local: FakeGiftBackend, a FilterIndex of its own and in-memory sessions.
+  """
+  rng = random.Random(0)
+  owner = User(id=0, telegram_id=0, can_receive_messages=True, subscription_expires=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1))
+  sessions = {}
+  for i in range(filters // 10 + 1):
+    sessions[i] = Session(id=i, api_id=0, api_hash="", session_string="")
+    sessions[i].user = owner
+
+  def random_filter(i: int) -> Filter:
+    min_price = rng.randrange(0, 5000)
+    min_supply = rng.randrange(0, 50000)
+    return Filter(
+      id=i, session_id=i % len(sessions), recipient_telegram_id=0, active=True, amount_stars=rng.randrange(1000, 100000),
+      min_price=min_price, max_price=rng.choice([-1, min_price + rng.randrange(0, 5000)]),
+      min_supply=min_supply, max_supply=rng.choice([-1, min_supply + rng.randrange(0, 50000)]),
+    )
+  index = FilterIndex()
+  index.load(random_filter(i) for i in range(filters))
+
+  async def get_sessions(ids: list[int]) -> list[Session]:
+    return [sessions[i] for i in ids if i in sessions]
+
+  async def notify(result: PurchaseResult):
+    pass
+
+  backend = FakeGiftBackend(catalog_latency=catalog_latency, buy_latency=buy_latency)
+  watcher = GiftWatcher(backend, notify, poll_interval=poll_interval, get_sessions=get_sessions, index=index)
+  await watcher.poll()
+
+  from_detection, from_release = [], []
+  for i in range(drops):
+    gift = Gift(id=i + 1, price=rng.randrange(1, 5000), supply=rng.randrange(1, 50000), available=1, file_id=None)
+    backend.release(gift)
+    while not await watcher.poll():
+      await asyncio.sleep(poll_interval)
+    await watcher.drain()
+    if gift.id in backend.first_buy_at:
+      from_detection.append(watcher.last_latency * 1000)
+      from_release.append((backend.first_buy_at[gift.id] - backend.released_at[gift.id]) * 1000)
+
+  def percentiles(samples: list[float]) -> dict[str, float]:
+    samples = sorted(samples)
+    if not samples:
+      return {"p50": math.nan, "p95": math.nan}
+    return {"p50": statistics.median(samples), "p95": samples[int(0.95 * (len(samples) - 1))]}
+
+  return {"detection_to_first_buy": percentiles(from_detection), "release_to_first_buy": percentiles(from_release)}
+
+if __name__ == "__main__":
+  for stage, latency in asyncio.run(benchmark()).items():
+    print(f"{stage:<24} p50 {latency['p50']:.2f} ms  p95 {latency['p95']:.2f} ms")
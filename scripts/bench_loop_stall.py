@@ -0,0 +1,84 @@
+"""
+Event-loop stall while a burst of payments derives deposit addresses, with
+the derivation run on the loop and in a worker thread. Run from the repo
+root with `python -m scripts.bench_loop_stall`, no Telegram nor database
+involved.
+
+The stub deriver stands in for the per-payment wallets of before deposits
+used xpubs: BIP39 seeding is 2048 rounds of PBKDF2-HMAC-SHA512, which
+dominates it. The xpub deriver is crypto_api.wallet.derive_address, what
+deposit_address runs now, on a throwaway account key (needs bip_utils).
+"""
+from typing import Callable
+import statistics
+import asyncio
+import hashlib
+import secrets
+import time
+
+def stub_deriver() -> Callable[[int], str]:
+  def derive(i: int) -> str:
+    return hashlib.pbkdf2_hmac("sha512", secrets.token_bytes(64), b"mnemonic", 2048).hex()[:40]
+  return derive
+
+def xpub_deriver() -> Callable[[int], str]:
+  from bip_utils import Bip39MnemonicGenerator, Bip39SeedGenerator, Bip44, Bip44Coins
+  from crypto_api.wallet import derive_address
+
+  seed = Bip39SeedGenerator(Bip39MnemonicGenerator().FromWordsNumber(12)).Generate()
+  xpub = Bip44.FromSeed(seed, Bip44Coins.ETHEREUM).Purpose().Coin().Account(0).PublicKey().ToExtended()
+  return lambda i: derive_address(xpub, Bip44Coins.ETHEREUM, i)
+
+async def measure(derive: Callable[[int], str], offload: bool, payments: int = 200, tick: float = 0.001) -> dict[str, float]:
+  """
+  Lateness in ms of a 1ms ticker, the way webhook updates would be delayed,
+  while `payments` concurrent requests derive an address each.
+  """
+  lags = []
+  done = asyncio.Event()
+
+  async def ticker():
+    while not done.is_set():
+      expected = time.perf_counter() + tick
+      await asyncio.sleep(tick)
+      lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+  async def payment(i: int):
+    # a payment request arriving every so often, not all at the same instant
+    await asyncio.sleep(i * tick)
+    if offload:
+      await asyncio.to_thread(derive, i)
+    else:
+      derive(i)
+
+  ticking = asyncio.create_task(ticker())
+  started_at = time.perf_counter()
+  await asyncio.gather(*(payment(i) for i in range(payments)))
+  elapsed = time.perf_counter() - started_at
+  done.set()
+  await ticking
+
+  lags.sort()
+  return {
+    "p50": statistics.median(lags),
+    "p99": lags[int(0.99 * (len(lags) - 1))],
+    "max": lags[-1],
+    "total": elapsed * 1000,
+  }
+
+async def benchmark(payments: int = 200) -> dict[str, dict[str, float]]:
+  derivers = {"stub": stub_deriver()}
+  try:
+    derivers["xpub"] = xpub_deriver()
+  except ImportError:
+    pass
+
+  results = {}
+  for name, derive in derivers.items():
+    for offload in (False, True):
+      results[f"{name} {'thread' if offload else 'inline'}"] = await measure(derive, offload, payments)
+  return results
+
+if __name__ == "__main__":
+  for run, lag in asyncio.run(benchmark()).items():
+    print(f"{run:<14} lag p50 {lag['p50']:.2f} ms  p99 {lag['p99']:.2f} ms  max {lag['max']:.2f} ms  ({lag['total']:.0f} ms in all)")
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from config import random_proxy, CLIENT_POOL_SIZE, CLIENT_IDLE_TIMEOUT, CLIENT_HEALTH_INTERVAL
+from models.session import Session
+from utils.proxy import parse_proxy_url
+import pyrogram.errors
+import traceback
+import logging
+import asyncio
+import pyrogram
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+INVALID_SESSION_ERRORS = (pyrogram.errors.AuthKeyInvalid, pyrogram.errors.SessionExpired)
+
+def create_client(api_id: int, api_hash: str, session_string: str | None = None, proxy: str | None = None) -> pyrogram.Client:
+  # a random configured proxy unless the caller picked one
+  if proxy is None:
+    proxy = random_proxy()
+  if proxy is not None:
+    proxy = parse_proxy_url(proxy)
+  return pyrogram.Client(":memory:", device_model="Snoops Buy", client_platform=pyrogram.enums.ClientPlatform.ANDROID, app_version="Android 11.14.1", session_string=session_string, api_id=api_id, api_hash=api_hash, in_memory=True, proxy=proxy)
+
+class _PooledClient:
+  __slots__ = ("app", "borrowed", "last_used")
+
+  def __init__(self, app: pyrogram.Client):
+    self.app = app
+    self.borrowed = 0
+    self.last_used = time.monotonic()
+
+class ClientPool:
+  """
+  Warm, connected pyrogram clients keyed by Session.id.
+
+  Clients are evicted least-recently-used past `max_size`, after
+  `idle_timeout` seconds without a borrower, when a periodic ping fails
+  and as soon as Telegram reports the session as invalid. Pinned sessions
+  (see `pin`) are exempt from the idle and size evictions, drops are rare
+  and their first purchase must not wait for a handshake.
+  """
+
+  def __init__(self, max_size: int = 100, idle_timeout: float = 600, health_interval: float = 60):
+    self.max_size = max_size
+    self.idle_timeout = idle_timeout
+    self.health_interval = health_interval
+
+    self._clients: OrderedDict[int, _PooledClient] = OrderedDict()
+    self._connecting: dict[int, asyncio.Future] = {}
+    self._pinned: set[int] = set()
+    self._task: asyncio.Task | None = None
+
+  def __len__(self) -> int:
+    return len(self._clients)
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+
+  async def close(self):
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+    clients = list(self._clients.values())
+    self._clients.clear()
+    await asyncio.gather(*(self._disconnect(c.app) for c in clients))
+
+  @asynccontextmanager
+  async def borrow(self, session: Session) -> AsyncIterator[pyrogram.Client]:
+    pooled = await self._acquire(session)
+    pooled.borrowed += 1
+    try:
+      yield pooled.app
+    except INVALID_SESSION_ERRORS:
+      await self.discard(session.id)
+      raise
+    finally:
+      pooled.borrowed -= 1
+      pooled.last_used = time.monotonic()
+
+  def pin(self, session_ids: set[int]):
+    """Replaces the pinned sessions, unpinned clients age out as usual."""
+    self._pinned = set(session_ids)
+
+  async def warm(self, sessions: list[Session]):
+    """Connects the clients of `sessions` ahead of their first borrow."""
+    async def connect(session: Session):
+      try:
+        await self._acquire(session)
+      except INVALID_SESSION_ERRORS:
+        await self.discard(session.id)
+      except Exception as e:
+        logger.warning(f"[session {session.id}] failed to warm client: {e}")
+
+    await asyncio.gather(*(connect(session) for session in sessions if session.id not in self._clients))
+
+  async def discard(self, session_id: int):
+    pooled = self._clients.pop(session_id, None)
+    if pooled is not None:
+      await self._disconnect(pooled.app)
+
+  async def _acquire(self, session: Session) -> _PooledClient:
+    pooled = self._clients.get(session.id)
+    if pooled is not None:
+      self._clients.move_to_end(session.id)
+      return pooled
+
+    # concurrent borrowers of a cold session share a single handshake
+    connecting = self._connecting.get(session.id)
+    if connecting is not None:
+      return await asyncio.shield(connecting)
+
+    connecting = self._connecting[session.id] = asyncio.get_running_loop().create_future()
+    try:
+      app = create_client(session.api_id, session.api_hash, session_string=session.session_string)
+      await app.connect()
+      pooled = self._clients[session.id] = _PooledClient(app)
+      connecting.set_result(pooled)
+    except BaseException as e:
+      connecting.set_exception(e)
+      # nobody may be waiting on the future, mark the exception as retrieved
+      connecting.exception()
+      raise
+    finally:
+      self._connecting.pop(session.id, None)
+
+    await self._evict_overflow()
+    return pooled
+
+  async def _evict_overflow(self):
+    overflow = len(self._clients) - self.max_size
+    if overflow <= 0:
+      return
+
+    victims = [session_id for session_id, pooled in self._clients.items() if pooled.borrowed == 0 and session_id not in self._pinned][:overflow]
+    await asyncio.gather(*(self.discard(session_id) for session_id in victims))
+
+  async def _run(self):
+    while True:
+      await asyncio.sleep(self.health_interval)
+      try:
+        await self._check()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"client pool health check failed: {e} / {tb_str}")
+
+  async def _check(self):
+    now = time.monotonic()
+    idle, alive = [], []
+    for session_id, pooled in self._clients.items():
+      if pooled.borrowed > 0:
+        continue
+      if now - pooled.last_used > self.idle_timeout and session_id not in self._pinned:
+        idle.append(session_id)
+      else:
+        alive.append(session_id)
+
+    await asyncio.gather(*(self.discard(session_id) for session_id in idle))
+    await asyncio.gather(*(self._ping(session_id) for session_id in alive))
+
+  async def _ping(self, session_id: int):
+    pooled = self._clients.get(session_id)
+    if pooled is None:
+      return
+
+    try:
+      await asyncio.wait_for(pooled.app.invoke(pyrogram.raw.functions.Ping(ping_id=random.getrandbits(63))), timeout=10)
+    except Exception as e:
+      logger.warning(f"[session {session_id}] dropping unhealthy client: {e}")
+      await self.discard(session_id)
+
+  async def _disconnect(self, app: pyrogram.Client):
+    try:
+      if app.is_connected:
+        await app.disconnect()
+    except Exception as e:
+      logger.warning(f"failed to disconnect client: {e}")
+
+client_pool = ClientPool(max_size=CLIENT_POOL_SIZE, idle_timeout=CLIENT_IDLE_TIMEOUT, health_interval=CLIENT_HEALTH_INTERVAL)
@@ -0,0 +1,223 @@
+from typing import Any, Awaitable, Callable, Iterable
+from sqlalchemy.ext.asyncio import AsyncConnection
+from config import LEADER_ELECTION_INTERVAL
+from db import Database, db
+import traceback
+import inspect
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+LEADER_LOCK_KEY = 7240316
+
+class Cluster:
+  """
+  Coordination between the webhook workers sharing the database.
+
+  Every worker keeps one connection of its own that LISTENs on `channel`, a
+  message one worker publishes (a cache invalidation, a queued notification)
+  reaches the handlers subscribed in every other worker. The same connection
+  tries to take an advisory lock every `election_interval` seconds: the worker
+  holding it leads and runs the jobs registered with `on_leader`, the ones
+  that must not run once per worker (buying drops, sending notifications).
+  The lock lives and dies with the connection, a worker that loses it steps
+  down and another one takes over within an interval. Messages sent while a
+  worker was disconnected are lost to it, so after a reconnect the
+  `on_resync` callbacks rebuild whatever they may have left stale.
+  """
+
+  def __init__(self, database: Database, channel: str = "bot_events", lock_key: int = LEADER_LOCK_KEY, election_interval: float = 5):
+    self.db = database
+    self.channel = channel
+    self.lock_key = lock_key
+    self.election_interval = election_interval
+    self.is_leader = False
+
+    self._handlers: dict[str, list[Callable[[str], Any]]] = {}
+    self._resync: list[Callable[[], Any]] = []
+    self._jobs: list[tuple[Callable[[], Awaitable], Callable[[], Awaitable]]] = []
+    self._outgoing: list[str] = []
+    self._flush = asyncio.Event()
+    self._lost = asyncio.Event()
+    # the asyncpg connection runs one query at a time, elections and publishes take turns
+    self._lock = asyncio.Lock()
+    self._conn: AsyncConnection | None = None
+    self._raw = None
+    self._task: asyncio.Task | None = None
+    self._publisher: asyncio.Task | None = None
+    self._callbacks: set[asyncio.Task] = set()
+
+  def subscribe(self, kind: str, handler: Callable[[str], Any]):
+    """`handler` is called, and awaited if it returns an awaitable, with the payload of every `kind` message of another worker."""
+    self._handlers.setdefault(kind, []).append(handler)
+
+  def on_resync(self, callback: Callable[[], Any]):
+    self._resync.append(callback)
+
+  def on_leader(self, start: Callable[[], Awaitable], stop: Callable[[], Awaitable]):
+    """`start` runs when this worker is elected, `stop` when it steps down, in reverse registration order."""
+    self._jobs.append((start, stop))
+
+  def publish(self, kind: str, payload: str = ""):
+    """Queues a message for the other workers, a no-op while the cluster is not running (scripts, tests)."""
+    if self._task is None:
+      return
+    self._outgoing.append(f"{kind} {payload}")
+    self._flush.set()
+
+  def publish_ids(self, kind: str, ids: Iterable[int], chunk_size: int = 500):
+    # NOTIFY payloads are limited to 8000 bytes
+    ids = list(ids)
+    for i in range(0, len(ids), chunk_size):
+      self.publish(kind, ",".join(str(id) for id in ids[i:i + chunk_size]))
+
+  @staticmethod
+  def ids(payload: str) -> list[int]:
+    return [int(id) for id in payload.split(",") if id]
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+      self._publisher = asyncio.create_task(self._run_publisher())
+
+  async def stop(self):
+    tasks = [task for task in (self._task, self._publisher) if task is not None]
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    self._task = self._publisher = None
+    try:
+      await self._send()
+    except Exception as e:
+      logger.warning(f"failed to publish {len(self._outgoing)} cluster messages on shutdown: {e}")
+    await self._step_down()
+    await self._disconnect()
+
+  async def _run(self):
+    connected_before = False
+    while True:
+      try:
+        await self._connect()
+        if connected_before:
+          await self._run_resync()
+        connected_before = True
+        self._flush.set()
+
+        while not self._lost.is_set():
+          if not self.is_leader:
+            async with self._lock:
+              elected = await self._raw.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_key)
+            if elected:
+              await self._step_up()
+          else:
+            async with self._lock:
+              await self._raw.fetchval("SELECT 1")
+          try:
+            await asyncio.wait_for(self._lost.wait(), timeout=self.election_interval)
+          except asyncio.TimeoutError:
+            pass
+        logger.warning("cluster connection lost")
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"cluster connection failed: {e} / {tb_str}")
+      await self._step_down()
+      await self._disconnect()
+      await asyncio.sleep(self.election_interval)
+
+  async def _run_publisher(self):
+    while True:
+      await self._flush.wait()
+      self._flush.clear()
+      try:
+        await self._send()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        # kept for the next connection, whose setup sets the flush event again
+        logger.warning(f"failed to publish cluster messages: {e}")
+
+  async def _send(self):
+    if self._raw is None or not self._outgoing:
+      return
+    messages, self._outgoing = self._outgoing, []
+    try:
+      async with self._lock:
+        await self._raw.execute("SELECT pg_notify($1, m) FROM unnest($2::text[]) AS m", self.channel, messages)
+    except BaseException:
+      self._outgoing[:0] = messages
+      raise
+
+  async def _connect(self):
+    self._lost.clear()
+    self._conn = await self.db.engine.connect()
+    self._raw = (await self._conn.get_raw_connection()).driver_connection
+    self._raw.add_termination_listener(lambda connection: self._lost.set())
+    await self._raw.add_listener(self.channel, self._on_message)
+
+  async def _disconnect(self):
+    conn, self._conn, self._raw = self._conn, None, None
+    if conn is None:
+      return
+    try:
+      # the lock and the LISTEN belong to this connection, it must not go back to the pool with them
+      await conn.invalidate()
+      await conn.close()
+    except Exception as e:
+      logger.warning(f"failed to close cluster connection: {e}")
+
+  async def _step_up(self):
+    self.is_leader = True
+    logger.warning("this worker leads now")
+    for start, _ in self._jobs:
+      await start()
+
+  async def _step_down(self):
+    if not self.is_leader:
+      return
+    self.is_leader = False
+    logger.warning("this worker no longer leads")
+    for _, stop in reversed(self._jobs):
+      try:
+        await stop()
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to stop a leader job: {e} / {tb_str}")
+
+  async def _run_resync(self):
+    for callback in self._resync:
+      try:
+        result = callback()
+        if inspect.isawaitable(result):
+          await result
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to resync after reconnecting: {e} / {tb_str}")
+
+  def _on_message(self, connection, pid: int, channel: str, message: str):
+    # a worker hears its own NOTIFY too, its handlers already ran locally
+    if pid == connection.get_server_pid():
+      return
+    kind, _, payload = message.partition(" ")
+    for handler in self._handlers.get(kind, []):
+      try:
+        result = handler(payload)
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to handle {kind} message: {e} / {tb_str}")
+        continue
+      if inspect.isawaitable(result):
+        task = asyncio.ensure_future(self._await(kind, result))
+        self._callbacks.add(task)
+        task.add_done_callback(self._callbacks.discard)
+
+  async def _await(self, kind: str, result: Awaitable):
+    try:
+      await result
+    except Exception as e:
+      tb_str = traceback.format_exc()
+      logger.warning(f"failed to handle {kind} message: {e} / {tb_str}")
+
+cluster = Cluster(db, election_interval=LEADER_ELECTION_INTERVAL)
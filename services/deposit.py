@@ -0,0 +1,70 @@
+import datetime
+
+from sqlalchemy import select, update
+from db import db
+
+from models.deposit import Deposit, deposit_index_seq
+from crypto_api.CryptoAsset import CryptoAsset
+
+class DepositService:
+    @staticmethod
+    async def create(telegram_id: int, asset: CryptoAsset, amount: float, price: float) -> Deposit:
+        async with db.session() as session:
+            index = await session.scalar(select(deposit_index_seq.next_value()))
+            deposit = Deposit(
+                index=index,
+                telegram_id=telegram_id,
+                network=await asset.network,
+                symbol=await asset.symbol,
+                address=await asset.deposit_address(index),
+                amount=amount,
+                price=price,
+            )
+            session.add(deposit)
+            await session.commit()
+            return deposit
+
+    @staticmethod
+    async def get_by_id(id: int) -> Deposit | None:
+        async with db.session() as session:
+            stmt = select(Deposit).where(Deposit.id == id)
+            deposit = await session.execute(stmt)
+            return deposit.scalar()
+
+    @staticmethod
+    async def get_pending(network: str | None = None, symbol: str | None = None) -> list[Deposit]:
+        async with db.session() as session:
+            stmt = select(Deposit).where(Deposit.status == "pending").order_by(Deposit.id)
+            if network is not None:
+                stmt = stmt.where(Deposit.network == network, Deposit.symbol == symbol)
+            deposits = await session.execute(stmt)
+            return deposits.scalars().all()
+
+    @staticmethod
+    async def mark_paid(id: int) -> Deposit | None:
+        """Flips a pending deposit to paid, returns None if it was not pending so it is credited once."""
+        async with db.session() as session:
+            stmt = (
+                update(Deposit)
+                .where(Deposit.id == id, Deposit.status == "pending")
+                .values(status="paid", paid_at=datetime.datetime.now(datetime.timezone.utc))
+                .returning(Deposit)
+            )
+            deposit = await session.execute(stmt)
+            deposit = deposit.scalar()
+            await session.commit()
+            return deposit
+
+    @staticmethod
+    async def expire_older_than(seconds: float) -> int:
+        """Stops watching deposits nobody paid within `seconds`, returns how many expired."""
+        async with db.session() as session:
+            created_before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=seconds)
+            stmt = (
+                update(Deposit)
+                .where(Deposit.status == "pending", Deposit.created_at < created_before)
+                .values(status="expired")
+            )
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount
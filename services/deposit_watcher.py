@@ -0,0 +1,132 @@
+from typing import Awaitable, Callable
+from config import DEPOSIT_POLL_INTERVAL, DEPOSIT_POLL_TIMEOUT, DEPOSIT_TTL
+from crypto_api.CryptoAsset import CryptoAsset
+from models.deposit import Deposit
+from services.deposit import DepositService
+from services.user import UserService
+import traceback
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+class DepositWatcher:
+  """
+  Polls the pending deposit addresses of every asset and credits the
+  subscription of the ones that received their amount, the user no longer
+  has to press "check". Each asset runs its own loop, a throttled network
+  only delays its own deposits, and a poll gives up after `poll_timeout`
+  seconds instead of sitting through every retry of a rate limited API.
+  """
+
+  def __init__(self, poll_interval: float = 15, ttl: float = 3 * 24 * 60 * 60, poll_timeout: float = 60):
+    self.poll_interval = poll_interval
+    self.ttl = ttl
+    self.poll_timeout = poll_timeout
+
+    self._assets: dict[tuple[str, str], CryptoAsset] = {}
+    self._pending_assets: list[CryptoAsset] = []
+    self._callbacks: list[Callable[[Deposit], Awaitable]] = []
+    self._task: asyncio.Task | None = None
+    self._asset_tasks: dict[tuple[str, str], asyncio.Task] = {}
+
+  def register(self, *assets: CryptoAsset):
+    # keyed by (network, symbol) like the deposits table, resolved by the running watcher since both are async
+    self._pending_assets.extend(assets)
+
+  def subscribe(self, callback: Callable[[Deposit], Awaitable]):
+    """`callback` is awaited with every deposit the watcher credited."""
+    self._callbacks.append(callback)
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+
+  async def stop(self):
+    tasks = [task for task in (self._task, *self._asset_tasks.values()) if task is not None]
+    for task in tasks:
+      task.cancel()
+    self._task = None
+    self._asset_tasks.clear()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+  async def _run(self):
+    while True:
+      try:
+        await self._resolve_assets()
+        for key in self._assets:
+          if key not in self._asset_tasks:
+            self._asset_tasks[key] = asyncio.create_task(self._run_asset(key))
+        await self.expire()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to expire deposits: {e} / {tb_str}")
+      await asyncio.sleep(self.poll_interval)
+
+  async def _run_asset(self, key: tuple[str, str]):
+    while True:
+      try:
+        await self.poll_asset(key)
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to poll {key[0]} | {key[1]} deposits: {e} / {tb_str}")
+      await asyncio.sleep(self.poll_interval)
+
+  async def _resolve_assets(self):
+    while self._pending_assets:
+      asset = self._pending_assets.pop()
+      self._assets[(await asset.network, await asset.symbol)] = asset
+
+  async def expire(self) -> int:
+    expired = await DepositService.expire_older_than(self.ttl)
+    if expired:
+      logger.info(f"{expired} deposits expired unpaid")
+    return expired
+
+  async def poll(self) -> list[Deposit]:
+    """A single pass over every asset, what the per-asset loops do on their own schedule."""
+    await self._resolve_assets()
+    await self.expire()
+    results = await asyncio.gather(*(self.poll_asset(key) for key in self._assets))
+    return [deposit for credited in results for deposit in credited]
+
+  async def poll_asset(self, key: tuple[str, str]) -> list[Deposit]:
+    asset = self._assets.get(key)
+    if asset is None:
+      return []
+
+    deposits = await DepositService.get_pending(*key)
+    if not deposits:
+      return []
+
+    try:
+      received = await asyncio.wait_for(asset.received([d.address for d in deposits]), timeout=self.poll_timeout)
+    except asyncio.TimeoutError:
+      logger.warning(f"{key[0]} | {key[1]} deposits poll timed out after {self.poll_timeout}s, retrying next round")
+      return []
+
+    credited = []
+    for deposit in deposits:
+      if received.get(deposit.address, 0) < deposit.amount:
+        continue
+      deposit = await self.credit(deposit)
+      if deposit is not None:
+        credited.append(deposit)
+    return credited
+
+  async def credit(self, deposit: Deposit) -> Deposit | None:
+    # the conditional update makes sure a deposit extends the subscription once
+    deposit = await DepositService.mark_paid(deposit.id)
+    if deposit is None:
+      return None
+
+    await UserService.subscribe_user_for_3_months(deposit.telegram_id)
+    logger.info(f"deposit #{deposit.index} of {deposit.telegram_id} paid, {deposit.amount} {deposit.network} | {deposit.symbol}")
+    await asyncio.gather(*(callback(deposit) for callback in self._callbacks), return_exceptions=True)
+    return deposit
+
+deposit_watcher = DepositWatcher(poll_interval=DEPOSIT_POLL_INTERVAL, ttl=DEPOSIT_TTL, poll_timeout=DEPOSIT_POLL_TIMEOUT)
@@ -1,76 +1,123 @@
 import datetime
 import math
 
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update, func, not_
 from db import db
 
 import config
 
 from models.filter import Filter
+from models.session import Session
+from models.user import User
+from services.filter_index import filter_index
+from services.cluster import cluster, Cluster
+from services.user import UserService
 from language import LanguageService
 
 class FilterService:
   @staticmethod
   async def is_exist(id: int) -> bool:
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       stmt = select(Filter).where(Filter.id == id)
       is_exist = await session.execute(stmt)
       return is_exist.scalar() is not None
 
   @staticmethod
   async def get_by_id(id: int) -> Filter | None:
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       stmt = select(Filter).where(Filter.id == id)
       filter_from_db = await session.execute(stmt)
       filter_from_db = filter_from_db.scalar()
       return filter_from_db
     
   @staticmethod
-  async def set_status(id: int, status: bool):
-    async with db.async_session_maker() as session:
-      stmt = update(Filter).where(Filter.id == id).values(
-        active=status)
-      await session.execute(stmt)
-      await session.commit()
+  async def get_many(ids: list[int]) -> list[Filter]:
+    async with db.session() as session:
+      stmt = select(Filter).where(Filter.id.in_(ids))
+      filters = await session.execute(stmt)
+      return filters.scalars().all()
+
   @staticmethod
-  async def set_min_price(id: int, min_price: int):
-    async with db.async_session_maker() as session:
-      stmt = update(Filter).where(Filter.id == id).values(
-        min_price=min_price)
-      await session.execute(stmt)
-      await session.commit()
+  async def get_active() -> list[Filter]:
+    async with db.session() as session:
+      stmt = select(Filter).where(Filter.active == True)
+      filters = await session.execute(stmt)
+      return filters.scalars().all()
+
   @staticmethod
-  async def set_max_price(id: int, max_price: int):
-    async with db.async_session_maker() as session:
-      stmt = update(Filter).where(Filter.id == id).values(
-        max_price=max_price)
-      await session.execute(stmt)
+  async def _update_where(where, values: dict) -> list[Filter]:
+    async with db.session() as session:
+      stmt = (
+        update(Filter)
+        .where(where)
+        .values(**values)
+        .returning(Filter)
+        # the update's session may already hold these filters (and their user) from earlier in the update
+        .execution_options(synchronize_session=False, populate_existing=True)
+      )
+      filters = await session.execute(stmt)
+      filters = filters.scalars().all()
       await session.commit()
+
+    for f in filters:
+      filter_index.update(f)
+    cluster.publish_ids("filter", [f.id for f in filters])
+    for session_id in {f.session_id for f in filters}:
+      UserService.invalidate_session(session_id)
+    return filters
+
   @staticmethod
-  async def set_min_supply(id: int, min_supply: int):
-    async with db.async_session_maker() as session:
-      stmt = update(Filter).where(Filter.id == id).values(
-        min_supply=min_supply)
-      await session.execute(stmt)
-      await session.commit()
+  async def update(id: int, **values) -> Filter | None:
+    filters = await FilterService._update_where(Filter.id == id, values)
+    return filters[0] if filters else None
+
   @staticmethod
-  async def set_max_supply(id: int, max_supply: int):
-    async with db.async_session_maker() as session:
-      stmt = update(Filter).where(Filter.id == id).values(
-        max_supply=max_supply)
-      await session.execute(stmt)
-      await session.commit()
+  async def update_session(session_id: int, **values) -> list[Filter]:
+    return await FilterService._update_where(Filter.session_id == session_id, values)
+
   @staticmethod
-  async def set_amount_stars(id: int, amount_stars: int):
-    async with db.async_session_maker() as session:
-      stmt = update(Filter).where(Filter.id == id).values(
-        amount_stars=amount_stars)
-      await session.execute(stmt)
-      await session.commit()
+  async def update_user(telegram_id: int, **values) -> list[Filter]:
+    session_ids = select(Session.id).join(Session.user).where(User.telegram_id == telegram_id)
+    return await FilterService._update_where(Filter.session_id.in_(session_ids), values)
+
   @staticmethod
-  async def set_recipient_telegram_id(id: int, recipient_telegram_id: int):
-    async with db.async_session_maker() as session:
-      stmt = update(Filter).where(Filter.id == id).values(
-        recipient_telegram_id=recipient_telegram_id)
-      await session.execute(stmt)
-      await session.commit()
\ No newline at end of file
+  async def toggle_status(id: int) -> Filter | None:
+    return await FilterService.update(id, active=not_(Filter.active))
+
+  @staticmethod
+  async def set_status(id: int, status: bool) -> Filter | None:
+    return await FilterService.update(id, active=status)
+  @staticmethod
+  async def set_min_price(id: int, min_price: int) -> Filter | None:
+    return await FilterService.update(id, min_price=min_price)
+  @staticmethod
+  async def set_max_price(id: int, max_price: int) -> Filter | None:
+    return await FilterService.update(id, max_price=max_price)
+  @staticmethod
+  async def set_min_supply(id: int, min_supply: int) -> Filter | None:
+    return await FilterService.update(id, min_supply=min_supply)
+  @staticmethod
+  async def set_max_supply(id: int, max_supply: int) -> Filter | None:
+    return await FilterService.update(id, max_supply=max_supply)
+  @staticmethod
+  async def set_amount_stars(id: int, amount_stars: int) -> Filter | None:
+    return await FilterService.update(id, amount_stars=amount_stars)
+  @staticmethod
+  async def set_recipient_telegram_id(id: int, recipient_telegram_id: int) -> Filter | None:
+    return await FilterService.update(id, recipient_telegram_id=recipient_telegram_id)
+
+async def _reload_filters(payload: str):
+  """Applies filter writes of another worker to this worker's index."""
+  ids = Cluster.ids(payload)
+  filters = {f.id: f for f in await FilterService.get_many(ids)}
+  for filter_id in ids:
+    if filter_id in filters:
+      filter_index.update(filters[filter_id])
+    else:
+      filter_index.remove(filter_id)
+
+async def _reload_all_filters():
+  filter_index.load(await FilterService.get_active())
+
+cluster.subscribe("filter", _reload_filters)
+cluster.on_resync(_reload_all_filters)
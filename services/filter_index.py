@@ -0,0 +1,209 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterable, NamedTuple
+import traceback
+import logging
+import asyncio
+import math
+
+from models.filter import Filter
+
+logger = logging.getLogger(__name__)
+
+UNBOUNDED = -1
+
+class IndexedFilter(NamedTuple):
+  id: int
+  session_id: int
+  recipient_telegram_id: int
+  min_price: int
+  max_price: float
+  min_supply: int
+  max_supply: float
+  amount_stars: int
+
+  @staticmethod
+  def from_model(f: Filter) -> "IndexedFilter":
+    return IndexedFilter(
+      id=f.id,
+      session_id=f.session_id,
+      recipient_telegram_id=f.recipient_telegram_id,
+      min_price=f.min_price,
+      max_price=math.inf if f.max_price == UNBOUNDED else f.max_price,
+      min_supply=f.min_supply,
+      max_supply=math.inf if f.max_supply == UNBOUNDED else f.max_supply,
+      amount_stars=f.amount_stars,
+    )
+
+class _SupplyTree:
+  """Centered interval tree over the closed supply intervals of its filters."""
+  __slots__ = ("center", "by_low", "by_high", "left", "right")
+
+  def __init__(self, filters: list[IndexedFilter]):
+    endpoints = sorted(e for f in filters for e in (f.min_supply, f.max_supply) if e != math.inf)
+    self.center = endpoints[len(endpoints) // 2] if endpoints else math.inf
+
+    left, right, here = [], [], []
+    for f in filters:
+      if f.max_supply < self.center:
+        left.append(f)
+      elif f.min_supply > self.center:
+        right.append(f)
+      else:
+        here.append(f)
+
+    self.by_low = sorted(here, key=lambda f: f.min_supply)
+    self.by_high = sorted(here, key=lambda f: f.max_supply, reverse=True)
+    self.left = _SupplyTree(left) if left else None
+    self.right = _SupplyTree(right) if right else None
+
+  def stab(self, supply: float, out: list[IndexedFilter]):
+    node = self
+    while node is not None:
+      if supply < node.center:
+        for f in node.by_low:
+          if f.min_supply > supply:
+            break
+          out.append(f)
+        node = node.left
+      elif supply > node.center:
+        for f in node.by_high:
+          if f.max_supply < supply:
+            break
+          out.append(f)
+        node = node.right
+      else:
+        out.extend(node.by_low)
+        return
+
+def _accepts(f: IndexedFilter, price: int, supply: float) -> bool:
+  return f.min_price <= price <= f.max_price and f.min_supply <= supply <= f.max_supply
+
+def _build(filters: list[IndexedFilter]) -> tuple[list[int], list[_SupplyTree | None]]:
+  xs = sorted({f.min_price for f in filters} | {f.max_price + 1 for f in filters if f.max_price != math.inf})
+  n = len(xs)
+
+  buckets: list[list[IndexedFilter]] = [[] for _ in range(2 * n)]
+  for f in filters:
+    l = bisect_left(xs, f.min_price) + n
+    r = (n if f.max_price == math.inf else bisect_left(xs, f.max_price + 1)) + n
+    while l < r:
+      if l & 1:
+        buckets[l].append(f)
+        l += 1
+      if r & 1:
+        r -= 1
+        buckets[r].append(f)
+      l >>= 1
+      r >>= 1
+
+  return xs, [_SupplyTree(b) if b else None for b in buckets]
+
+class FilterIndex:
+  """
+  In-memory index of active filters over (price, supply).
+
+  Prices are split into elementary ranges by a segment tree, every canonical
+  node keeps an interval tree over supply, so a lookup walks one root-to-leaf
+  path and costs O(log^2 n + k). Lookups never rebuild: filters written since
+  the last build are kept aside and checked one by one, while the trees are
+  rebuilt off the event loop `rebuild_delay` seconds after the first write.
+  """
+
+  def __init__(self, rebuild_delay: float = 1.0):
+    self.rebuild_delay = rebuild_delay
+    self._filters: dict[int, IndexedFilter] = {}
+    self._version = 0
+    # filter id -> version of its latest write the trees do not reflect yet
+    self._pending: dict[int, int] = {}
+    # swapped as a whole, a lookup never sees half of a build
+    self._trees: tuple[list[int], list[_SupplyTree | None]] = ([], [])
+    self._rebuild_task: asyncio.Task | None = None
+
+  def __len__(self) -> int:
+    return len(self._filters)
+
+  def session_ids(self) -> set[int]:
+    """Sessions with at least one active filter, the ones a drop may buy with."""
+    return {f.session_id for f in self._filters.values()}
+
+  def load(self, filters: Iterable[Filter]):
+    self._filters = {}
+    for f in filters:
+      self.update(f)
+    self.rebuild()
+
+  def update(self, f: Filter):
+    entry = IndexedFilter.from_model(f)
+    # inverted ranges can never match, keeping them out also keeps the trees finite
+    if f.active and entry.min_price <= entry.max_price and entry.min_supply <= entry.max_supply:
+      self._filters[f.id] = entry
+    else:
+      self._filters.pop(f.id, None)
+    self._touch(f.id)
+
+  def remove(self, *filter_ids: int):
+    for filter_id in filter_ids:
+      self._filters.pop(filter_id, None)
+      self._touch(filter_id)
+
+  def _touch(self, filter_id: int):
+    self._version += 1
+    self._pending[filter_id] = self._version
+    if self._rebuild_task is None:
+      try:
+        loop = asyncio.get_running_loop()
+      except RuntimeError:
+        # no loop to rebuild on, lookups keep checking the pending filters until rebuild()
+        return
+      self._rebuild_task = loop.create_task(self._rebuild_later())
+
+  def _apply(self, version: int, trees: tuple[list[int], list[_SupplyTree | None]]):
+    self._trees = trees
+    for filter_id, written_at in list(self._pending.items()):
+      if written_at <= version:
+        del self._pending[filter_id]
+
+  def rebuild(self):
+    self._apply(self._version, _build(list(self._filters.values())))
+
+  async def _rebuild_later(self):
+    try:
+      await asyncio.sleep(self.rebuild_delay)
+      # writes made while a build runs stay pending and get another round
+      while self._pending:
+        version = self._version
+        trees = await asyncio.to_thread(_build, list(self._filters.values()))
+        self._apply(version, trees)
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      tb_str = traceback.format_exc()
+      logger.warning(f"failed to rebuild filter index: {e} / {tb_str}")
+    finally:
+      self._rebuild_task = None
+
+  def match(self, price: int, supply: int | None) -> list[IndexedFilter]:
+    """Returns active filters accepting a gift, `supply=None` means unlimited."""
+    supply = math.inf if supply is None else supply
+    xs, nodes = self._trees
+    out: list[IndexedFilter] = []
+
+    i = bisect_right(xs, price) - 1
+    if i >= 0:
+      i += len(xs)
+      while i >= 1:
+        node = nodes[i]
+        if node is not None:
+          node.stab(supply, out)
+        i >>= 1
+
+    pending = self._pending
+    if pending:
+      out = [f for f in out if f.id not in pending]
+      for filter_id in pending:
+        f = self._filters.get(filter_id)
+        if f is not None and _accepts(f, price, supply):
+          out.append(f)
+    return out
+
+filter_index = FilterIndex()
@@ -0,0 +1,285 @@
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, NamedTuple
+from config import random_creds
+from models.session import Session
+from services.client_pool import client_pool, create_client
+from services.filter_index import filter_index, FilterIndex, IndexedFilter
+from services.session import SessionService
+import traceback
+import datetime
+import logging
+import asyncio
+import time
+
+logger = logging.getLogger(__name__)
+
+class Gift(NamedTuple):
+  id: int
+  price: int
+  supply: int | None
+  available: int | None
+  file_id: str | None
+  title: str | None = None
+
+class PurchaseResult(NamedTuple):
+  owner_telegram_id: int
+  can_receive_messages: bool
+  gift: Gift
+  amount_succeeded: int
+  amount_tried: int
+  error: str | None
+
+class GiftBackend(ABC):
+  """Telegram side of the pipeline, swapped for a local stand-in when testing."""
+
+  @abstractmethod
+  async def get_gifts(self) -> list[Gift]:
+    pass
+
+  @abstractmethod
+  async def buy(self, session: Session, gift: Gift, recipient_telegram_id: int):
+    pass
+
+  async def warm(self, sessions: list[Session]):
+    """Readies the sessions the next drop may buy with."""
+    pass
+
+  async def close(self):
+    pass
+
+class PyrogramGiftBackend(GiftBackend):
+  def __init__(self, session_string: str):
+    api_id, api_hash = random_creds()
+    self.catalog = create_client(api_id, api_hash, session_string=session_string)
+
+  async def get_gifts(self) -> list[Gift]:
+    if not self.catalog.is_connected:
+      await self.catalog.connect()
+
+    gifts = await self.catalog.get_available_gifts()
+    return [
+      Gift(
+        id=g.id,
+        price=g.price,
+        supply=g.total_amount if g.is_limited else None,
+        available=g.available_amount if g.is_limited else None,
+        file_id=g.sticker.file_id if g.sticker else None,
+      )
+      for g in gifts
+    ]
+
+  async def buy(self, session: Session, gift: Gift, recipient_telegram_id: int):
+    async with client_pool.borrow(session) as app:
+      await app.send_gift(chat_id=recipient_telegram_id, gift_id=gift.id)
+
+  async def warm(self, sessions: list[Session]):
+    client_pool.pin({session.id for session in sessions})
+    await client_pool.warm(sessions)
+
+  async def close(self):
+    if self.catalog.is_connected:
+      await self.catalog.disconnect()
+
+class FakeGiftBackend(GiftBackend):
+  """Local catalog and purchases with fixed latencies, for benchmarks and dry runs."""
+
+  def __init__(self, catalog_latency: float = 0.05, buy_latency: float = 0.1):
+    self.catalog_latency = catalog_latency
+    self.buy_latency = buy_latency
+    self.gifts: list[Gift] = []
+    self.released_at: dict[int, float] = {}
+    self.first_buy_at: dict[int, float] = {}
+    # (session id, gift id, recipient telegram id) per purchase
+    self.purchases: list[tuple[int, int, int]] = []
+
+  def release(self, gift: Gift):
+    self.gifts.append(gift)
+    self.released_at[gift.id] = time.perf_counter()
+
+  async def get_gifts(self) -> list[Gift]:
+    await asyncio.sleep(self.catalog_latency)
+    return list(self.gifts)
+
+  async def buy(self, session: Session, gift: Gift, recipient_telegram_id: int):
+    self.first_buy_at.setdefault(gift.id, time.perf_counter())
+    await asyncio.sleep(self.buy_latency)
+    self.purchases.append((session.id, gift.id, recipient_telegram_id))
+
+class _Drop:
+  __slots__ = ("detected_at", "first_buy_at")
+
+  def __init__(self, detected_at: float):
+    self.detected_at = detected_at
+    self.first_buy_at: float | None = None
+
+class GiftWatcher:
+  def __init__(self, backend: GiftBackend, notify: Callable[[PurchaseResult], Awaitable], poll_interval: float = 1.0, purchases_per_session: int = 2,
+               warm_interval: float = 60, get_sessions: Callable[[list[int]], Awaitable[list[Session]]] = SessionService.get_many, max_purchases_per_filter: int = 100,
+               index: FilterIndex = filter_index):
+    self.backend = backend
+    self.index = index
+    self.notify = notify
+    self.poll_interval = poll_interval
+    self.purchases_per_session = purchases_per_session
+    self.max_purchases_per_filter = max_purchases_per_filter
+    self.warm_interval = warm_interval
+    self.get_sessions = get_sessions
+    self.last_latency: float | None = None
+
+    self._known: set[int] | None = None
+    self._semaphores: dict[int, asyncio.Semaphore] = {}
+    self._tasks: set[asyncio.Task] = set()
+    self._task: asyncio.Task | None = None
+    self._warm_task: asyncio.Task | None = None
+
+  def start(self):
+    if self._task is None:
+      # gifts released while another worker was watching are not new, start from a fresh snapshot
+      self._known = None
+      self._task = asyncio.create_task(self._run())
+    if self._warm_task is None:
+      self._warm_task = asyncio.create_task(self._run_warm())
+
+  async def stop(self):
+    for task in (self._task, self._warm_task):
+      if task is not None:
+        task.cancel()
+    self._task = self._warm_task = None
+    for task in list(self._tasks):
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    await self.backend.close()
+
+  async def _run(self):
+    while True:
+      try:
+        await self.poll()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to poll gifts: {e} / {tb_str}")
+      await asyncio.sleep(self.poll_interval)
+
+  async def _run_warm(self):
+    while True:
+      try:
+        await self.warm()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to warm sniping sessions: {e} / {tb_str}")
+      await asyncio.sleep(self.warm_interval)
+
+  async def warm(self):
+    """
+    Hands the backend every subscribed session with an active filter, so a
+    drop finds them connected, and drops the semaphores of the other ones.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    session_ids = self.index.session_ids()
+    # sessions without filters any more (removed, or every filter turned off) buy nothing
+    for session_id in set(self._semaphores) - session_ids:
+      del self._semaphores[session_id]
+    sessions = await self.get_sessions(list(session_ids))
+    await self.backend.warm([s for s in sessions if s.user is not None and s.user.subscription_expires is not None and s.user.subscription_expires > now])
+
+  async def drain(self):
+    """Waits for the purchases of drops already detected."""
+    await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+  async def poll(self) -> list[Gift]:
+    gifts = await self.backend.get_gifts()
+    detected_at = time.perf_counter()
+
+    # the first snapshot only seeds the known set, everything in it was already on sale
+    if self._known is None:
+      self._known = {g.id for g in gifts}
+      return []
+
+    new_gifts = [g for g in gifts if g.id not in self._known]
+    self._known.update(g.id for g in new_gifts)
+    for gift in new_gifts:
+      # unlimited gifts can be bought at any time, only limited drops are sniped
+      if gift.supply is None:
+        continue
+      task = asyncio.create_task(self.dispatch(gift, detected_at))
+      self._tasks.add(task)
+      task.add_done_callback(self._tasks.discard)
+    return new_gifts
+
+  async def dispatch(self, gift: Gift, detected_at: float | None = None) -> list[PurchaseResult]:
+    drop = _Drop(detected_at or time.perf_counter())
+    matches = self.index.match(gift.price, gift.supply)
+    if not matches:
+      return []
+
+    sessions = {s.id: s for s in await self.get_sessions(list({f.session_id for f in matches}))}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    purchases = []
+    for f in matches:
+      session = sessions.get(f.session_id)
+      if session is None or session.user is None:
+        continue
+      expires = session.user.subscription_expires
+      if expires is None or expires <= now:
+        continue
+      purchases.append(self._purchase(session, f, gift, drop))
+
+    results = [r for r in await asyncio.gather(*purchases) if r is not None]
+    if drop.first_buy_at is not None:
+      self.last_latency = drop.first_buy_at - drop.detected_at
+      logger.info(f"gift {gift.id}: first purchase {self.last_latency * 1000:.1f}ms after detection, {len(results)} filters matched")
+
+    await asyncio.gather(*(self.notify(r) for r in results), return_exceptions=True)
+    return results
+
+  async def _purchase(self, session: Session, f: IndexedFilter, gift: Gift, drop: _Drop) -> PurchaseResult | None:
+    amount = gift.available if gift.available is not None else gift.supply
+    if f.amount_stars >= 0:
+      amount = min(amount, f.amount_stars // max(gift.price, 1))
+    # an unlimited budget (-1) would otherwise try the whole remaining supply
+    amount = min(amount, self.max_purchases_per_filter)
+    if amount <= 0:
+      return None
+
+    semaphore = self._semaphores.get(session.id)
+    if semaphore is None:
+      semaphore = self._semaphores[session.id] = asyncio.Semaphore(self.purchases_per_session)
+
+    tried, succeeded, error = 0, 0, None
+
+    async def buyer():
+      nonlocal tried, succeeded, error
+      # the balance or the supply ran out, the other buyers stop too
+      while tried < amount and error is None:
+        async with semaphore:
+          if tried >= amount or error is not None:
+            return
+          if drop.first_buy_at is None:
+            drop.first_buy_at = time.perf_counter()
+          tried += 1
+          try:
+            await self.backend.buy(session, gift, f.recipient_telegram_id)
+          except Exception as e:
+            error = str(e)
+            return
+          succeeded += 1
+
+    # up to purchases_per_session purchases in flight per session, across its filters; one buyer runs
+    # right here so the first purchase does not wait for the tasks of every other matched filter
+    others = [asyncio.ensure_future(buyer()) for _ in range(min(amount, self.purchases_per_session) - 1)]
+    try:
+      await buyer()
+    finally:
+      await asyncio.gather(*others)
+
+    return PurchaseResult(
+      owner_telegram_id=session.user.telegram_id,
+      can_receive_messages=session.user.can_receive_messages,
+      gift=gift,
+      amount_succeeded=succeeded,
+      amount_tried=tried,
+      error=error,
+    )
@@ -0,0 +1,249 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pyrogram.storage import Storage
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from config import proxies, creds, LOGIN_TTL, LOGINS_PER_PROXY, LOGINS_PER_CREDS, LOGIN_SECRET
+from db import db
+from models.pending_login import PendingLoginRecord
+from services.client_pool import create_client
+from utils.encryption import Cipher
+import traceback
+import logging
+import asyncio
+import secrets
+import struct
+import base64
+import random
+import json
+import time
+import pyrogram
+
+logger = logging.getLogger(__name__)
+
+class PendingLogin:
+  __slots__ = ("token", "chat_id", "app", "proxy", "api_id", "api_hash", "expires_at", "phone_number", "phone_code_hash")
+
+  def __init__(self, token: str, chat_id: int, app: pyrogram.Client, proxy: str | None, api_id: int, api_hash: str, expires_at: float):
+    self.token = token
+    self.chat_id = chat_id
+    self.app = app
+    self.proxy = proxy
+    self.api_id = api_id
+    self.api_hash = api_hash
+    self.expires_at = expires_at
+    self.phone_number: str | None = None
+    self.phone_code_hash: str | None = None
+
+class LoginRegistry:
+  """
+  Connected clients of logins in progress, the FSM only keeps their token.
+
+  A login lives at most `ttl` seconds before its client is disconnected, a
+  chat has one login at a time and every proxy / api credential serves a
+  bounded number of logins at once, so abandoned logins can not pile up
+  sockets and proxy slots.
+
+  Once the code is sent, `save` stores what another webhook worker needs to
+  finish the login, the client's auth key (the code is bound to it) and the
+  sign in details, encrypted in the pending_logins table under the token
+  until the login expires. A worker that gets the next step without the
+  login in memory rebuilds the client from that row in `get`.
+  """
+
+  def __init__(self, ttl: float = 300, per_proxy: int = 10, per_creds: int = 20, sweep_interval: float = 30, secret: str | None = None):
+    self.ttl = ttl
+    self.per_proxy = per_proxy
+    self.per_creds = per_creds
+    self.sweep_interval = sweep_interval
+    self.cipher = Cipher(secret or "", "pending-login")
+
+    self._logins: dict[str, PendingLogin] = {}
+    self._by_chat: dict[int, str] = {}
+    self._per_proxy: Counter = Counter()
+    self._per_creds: Counter = Counter()
+    self._expired = 0
+    self._rejected = 0
+    self._task: asyncio.Task | None = None
+
+  def __len__(self) -> int:
+    return len(self._logins)
+
+  def gauges(self) -> dict:
+    return {
+      "pending": len(self._logins),
+      "per_proxy": dict(self._per_proxy),
+      "per_creds": dict(self._per_creds),
+      "expired_total": self._expired,
+      "rejected_total": self._rejected,
+    }
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+    await asyncio.gather(*(self.discard(token) for token in list(self._logins)))
+
+  def _pick(self) -> tuple[str | None, dict] | None:
+    candidates = [p for p in (proxies or [None]) if self._per_proxy[p] < self.per_proxy]
+    credentials = [c for c in creds if self._per_creds[c["api_id"]] < self.per_creds]
+    if not candidates or not credentials:
+      return None
+    return random.choice(candidates), random.choice(credentials)
+
+  async def begin(self, chat_id: int) -> PendingLogin | None:
+    """Connects a fresh client for `chat_id`, None when every proxy or credential is at capacity."""
+    previous = self._by_chat.get(chat_id)
+    if previous is not None:
+      await self.finish(previous)
+
+    picked = self._pick()
+    if picked is None:
+      self._rejected += 1
+      logger.warning(f"[{chat_id}] login rejected, at capacity: {self.gauges()}")
+      return None
+
+    proxy, credentials = picked
+    app = create_client(credentials["api_id"], credentials["api_hash"], proxy=proxy)
+    login = PendingLogin(secrets.token_urlsafe(16), chat_id, app, proxy, credentials["api_id"], credentials["api_hash"], time.monotonic() + self.ttl)
+    # slots are taken before connecting so concurrent logins can not overshoot the caps
+    self._add(login)
+    try:
+      await app.connect()
+    except BaseException:
+      await self.discard(login.token)
+      raise
+    return login
+
+  async def save(self, login: PendingLogin):
+    """Stores the login for `get` on any worker, call it once the code is sent."""
+    storage = login.app.storage
+    # export_session_string() needs a user id, there is none before sign in
+    packed = struct.pack(Storage.SESSION_STRING_FORMAT, await storage.dc_id(), login.api_id, await storage.test_mode(), await storage.auth_key(), 0, False)
+    data = json.dumps({
+      "session_string": base64.urlsafe_b64encode(packed).decode().rstrip("="),
+      "proxy": login.proxy,
+      "api_id": login.api_id,
+      "api_hash": login.api_hash,
+      "phone_number": login.phone_number,
+      "phone_code_hash": login.phone_code_hash,
+    }).encode()
+    values = {
+      "chat_id": login.chat_id,
+      "data": self.cipher.encrypt(data),
+      "expires_at": datetime.now(timezone.utc) + timedelta(seconds=login.expires_at - time.monotonic()),
+    }
+    statement = insert(PendingLoginRecord).values(token=login.token, **values).on_conflict_do_update(index_elements=[PendingLoginRecord.token], set_=values)
+    async with db.session() as session:
+      await session.execute(statement)
+      await session.commit()
+
+  async def get(self, chat_id: int, token: str | None) -> PendingLogin | None:
+    """The login of a `save`d token, reconnected from its auth key when it started on another worker."""
+    if not isinstance(token, str):
+      return None
+
+    login = self._logins.get(token)
+    if login is not None:
+      if login.chat_id != chat_id or login.expires_at <= time.monotonic():
+        return None
+      return login
+
+    async with db.session() as session:
+      stmt = select(PendingLoginRecord).where(
+        PendingLoginRecord.token == token,
+        PendingLoginRecord.chat_id == chat_id,
+        PendingLoginRecord.expires_at > datetime.now(timezone.utc),
+      )
+      record = (await session.execute(stmt)).scalar()
+    if record is None:
+      return None
+    try:
+      saved = json.loads(self.cipher.decrypt(record.data))
+    except ValueError as e:
+      # e.g. LOGIN_SECRET changed since the login started
+      logger.warning(f"[{chat_id}] failed to decrypt pending login: {e}")
+      return None
+
+    previous = self._by_chat.get(chat_id)
+    if previous is not None:
+      await self.discard(previous)
+
+    app = create_client(saved["api_id"], saved["api_hash"], session_string=saved["session_string"], proxy=saved["proxy"])
+    expires_at = time.monotonic() + (record.expires_at - datetime.now(timezone.utc)).total_seconds()
+    login = PendingLogin(token, chat_id, app, saved["proxy"], saved["api_id"], saved["api_hash"], expires_at)
+    login.phone_number = saved["phone_number"]
+    login.phone_code_hash = saved["phone_code_hash"]
+    # resumed logins count against the caps but are never refused, the code is already sent
+    self._add(login)
+    try:
+      await app.connect()
+    except asyncio.CancelledError:
+      await self.discard(login.token)
+      raise
+    except Exception as e:
+      logger.warning(f"[{chat_id}] failed to resume login: {e}")
+      await self.discard(login.token)
+      return None
+    return login
+
+  async def finish(self, token: str):
+    """Ends a login for every worker: disconnects it here and deletes its saved row."""
+    await self.discard(token)
+    async with db.session() as session:
+      await session.execute(delete(PendingLoginRecord).where(PendingLoginRecord.token == token))
+      await session.commit()
+
+  def _add(self, login: PendingLogin):
+    self._logins[login.token] = login
+    self._by_chat[login.chat_id] = login.token
+    self._per_proxy[login.proxy] += 1
+    self._per_creds[login.api_id] += 1
+
+  async def discard(self, token: str):
+    login = self._logins.pop(token, None)
+    if login is None:
+      return
+    if self._by_chat.get(login.chat_id) == token:
+      del self._by_chat[login.chat_id]
+    self._per_proxy[login.proxy] -= 1
+    if self._per_proxy[login.proxy] <= 0:
+      del self._per_proxy[login.proxy]
+    self._per_creds[login.api_id] -= 1
+    if self._per_creds[login.api_id] <= 0:
+      del self._per_creds[login.api_id]
+
+    try:
+      if login.app.is_connected:
+        await login.app.disconnect()
+    except Exception as e:
+      logger.warning(f"[{login.chat_id}] failed to disconnect login client: {e}")
+
+  async def _run(self):
+    while True:
+      await asyncio.sleep(self.sweep_interval)
+      try:
+        await self.sweep()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to sweep logins: {e} / {tb_str}")
+
+  async def sweep(self):
+    now = time.monotonic()
+    expired = [token for token, login in self._logins.items() if login.expires_at <= now]
+    self._expired += len(expired)
+    await asyncio.gather(*(self.discard(token) for token in expired))
+    if expired:
+      logger.info(f"expired {len(expired)} abandoned logins: {self.gauges()}")
+
+    async with db.session() as session:
+      await session.execute(delete(PendingLoginRecord).where(PendingLoginRecord.expires_at <= datetime.now(timezone.utc)))
+      await session.commit()
+
+login_registry = LoginRegistry(ttl=LOGIN_TTL, per_proxy=LOGINS_PER_PROXY, per_creds=LOGINS_PER_CREDS, secret=LOGIN_SECRET)
@@ -0,0 +1,292 @@
+from collections import OrderedDict
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import select, delete, update, func
+from config import NOTIFICATION_RATE, NOTIFICATION_CHAT_INTERVAL, NOTIFICATION_WORKERS, NOTIFICATION_OUTBOX_PERSIST
+from db import db
+from models.notification import Notification
+from services.stickers import sticker_cache
+from services.user import UserService
+from services.cluster import cluster, Cluster
+from utils.cache import TTLCache
+from utils.rate_limit import RateLimiter
+import traceback
+import logging
+import asyncio
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+def _optional_int(value) -> int | None:
+  return None if value is None else int(value)
+
+def parse_notification(data: dict) -> Notification:
+  """Builds a notification from a /buy_notification payload, raises ValueError when it is malformed."""
+  if not isinstance(data, dict):
+    raise ValueError("notification must be an object")
+  if not all([data.get("recipient"), data.get("id"), data.get("file_id")]):
+    raise ValueError("recipient, id and file_id are required")
+
+  try:
+    return Notification(
+      recipient=int(data["recipient"]),
+      gift_id=int(data["id"]),
+      gift_price=_optional_int(data.get("price")),
+      gift_title=data.get("title"),
+      gift_supply=_optional_int(data.get("supply")),
+      gift_file_id=str(data["file_id"]),
+      amount_succeeded=_optional_int(data.get("amount_succeeded")),
+      amount_tried=_optional_int(data.get("amount_tried")),
+      error=None if data.get("error") is None else str(data["error"]),
+    )
+  except (TypeError, ValueError) as e:
+    raise ValueError(f"invalid notification: {e}")
+
+def notification_payload(n: Notification) -> dict:
+  """The /buy_notification payload `parse_notification` turns back into `n`."""
+  return {
+    "recipient": n.recipient,
+    "id": n.gift_id,
+    "price": n.gift_price,
+    "title": n.gift_title,
+    "supply": n.gift_supply,
+    "file_id": n.gift_file_id,
+    "amount_succeeded": n.amount_succeeded,
+    "amount_tried": n.amount_tried,
+    "error": n.error,
+  }
+
+def format_notification(n: Notification) -> str:
+  t = f" \"{n.gift_title}\"" if n.gift_title is not None else ""
+  return (
+    f"<b>Completed</b>: sent <b>{n.amount_succeeded}</b> of <b>{n.amount_tried}</b>{t} gifts\n"
+    f"<b>Actual cost</b>: <b>{(n.gift_price or 0) * (n.amount_succeeded or 0)}</b> ⭐\n\n"
+    f"<span class=\"tg-spoiler\">"
+    f"ID: {n.gift_id}\n"
+    f"TITLE: {n.gift_title or 'untitled'}\n"
+    f"PRICE: {n.gift_price} stars\n"
+    f"SUPPLY: {n.gift_supply or 'unlimited'}\n"
+    f"ERROR: {n.error}"
+    f"</span>")
+
+class NotificationOutbox:
+  """
+  Queue of purchase notifications drained by a few sender tasks.
+
+  Every Telegram call waits on a global token bucket, a chat is not written
+  to again within `chat_interval` seconds, and results piling up for the same
+  recipient meanwhile are sent as one message. Flood waits pause all senders
+  and the call is retried. Any other failure sends the batch again after an
+  exponential backoff, up to `max_delivery_attempts` times. With `persist`
+  the queue is mirrored into the notifications table and reloaded on start,
+  a row is deleted once its message went out or the recipient blocked the
+  bot, and is kept with `failed_at` set, never to be loaded again, once the
+  outbox gave up on it.
+
+  Only the leader worker sends (see services/cluster.py). The others hand
+  what they enqueue over to it, as row ids with `persist` and as the whole
+  notification otherwise, which is lost if no leader is listening.
+  """
+  max_batch = 10
+  max_attempts = 5
+  max_delivery_attempts = 5
+  retry_delay = 5
+  max_retry_delay = 300
+
+  def __init__(self, rate: float = 30, chat_interval: float = 1.0, workers: int = 4, persist: bool = False):
+    self.limiter = RateLimiter(rate)
+    self.chat_interval = chat_interval
+    self.workers = workers
+    self.persist = persist
+    self.bot: Bot | None = None
+
+    self._queues: OrderedDict[int, list[Notification]] = OrderedDict()
+    # ids of the persisted notifications queued or being sent, a row is never queued twice
+    self._queued: set[int] = set()
+    self._busy: set[int] = set()
+    # recipient -> monotonic time its chat may be written to again
+    self._next_at = TTLCache(max_size=100000, ttl=chat_interval)
+    self._wakeup = asyncio.Event()
+    self._tasks: list[asyncio.Task] = []
+
+  def __len__(self) -> int:
+    return sum(len(queue) for queue in self._queues.values())
+
+  async def start(self, bot: Bot):
+    self.bot = bot
+    if not self._tasks:
+      self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    if self.persist:
+      pending = await self._load()
+      if pending:
+        logger.warning(f"resuming {len(pending)} queued notifications")
+
+  async def stop(self):
+    for task in self._tasks:
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    self._tasks = []
+    if self.persist:
+      # the rows stay, whichever worker leads next reloads them
+      self._queues.clear()
+      self._queued.clear()
+
+  async def enqueue(self, *notifications: Notification):
+    if self.persist:
+      async with db.session() as session:
+        session.add_all(notifications)
+        await session.commit()
+    if self._tasks:
+      self._push(notifications)
+    elif self.persist:
+      cluster.publish_ids("notification", [n.id for n in notifications])
+    else:
+      for n in notifications:
+        cluster.publish("notification_data", json.dumps(notification_payload(n)))
+
+  async def _load(self, ids: list[int] | None = None) -> list[Notification]:
+    async with db.session() as session:
+      stmt = select(Notification).where(Notification.failed_at.is_(None)).order_by(Notification.id)
+      if ids is not None:
+        stmt = stmt.where(Notification.id.in_(ids))
+      result = await session.execute(stmt)
+      pending = result.scalars().all()
+    return self._push(pending)
+
+  async def _received(self, payload: str):
+    if self._tasks:
+      await self._load(Cluster.ids(payload))
+
+  def _received_data(self, payload: str):
+    if self._tasks:
+      self._push([parse_notification(json.loads(payload))])
+
+  def _push(self, notifications) -> list[Notification]:
+    pushed = []
+    for n in notifications:
+      if n.id is not None:
+        if n.id in self._queued:
+          continue
+        self._queued.add(n.id)
+      self._queues.setdefault(n.recipient, []).append(n)
+      pushed.append(n)
+    self._wakeup.set()
+    return pushed
+
+  async def _take(self) -> tuple[int, list[Notification]]:
+    while True:
+      now = time.monotonic()
+      delay = None
+      for recipient in self._queues:
+        if recipient in self._busy:
+          continue
+        wait = self._next_at.get(recipient, now) - now
+        if wait > 0:
+          delay = wait if delay is None else min(delay, wait)
+          continue
+
+        queue = self._queues.pop(recipient)
+        if len(queue) > self.max_batch:
+          self._queues[recipient] = queue[self.max_batch:]
+        self._busy.add(recipient)
+        return recipient, queue[:self.max_batch]
+
+      self._wakeup.clear()
+      try:
+        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+      except asyncio.TimeoutError:
+        pass
+
+  async def _worker(self):
+    while True:
+      recipient, batch = await self._take()
+      wait = self.chat_interval
+      try:
+        await self._deliver(recipient, batch)
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to notify {recipient}: {e} / {tb_str}")
+        retry_in = await self._retry(recipient, batch, e)
+        if retry_in is not None:
+          wait = max(wait, retry_in)
+      finally:
+        self._busy.discard(recipient)
+        self._next_at.set(recipient, time.monotonic() + wait, ttl=wait)
+        self._wakeup.set()
+
+  async def _deliver(self, recipient: int, batch: list[Notification]):
+    try:
+      reply_to_message_id = None
+      # a sticker only makes sense when every coalesced result is about the same gift,
+      # and a retried batch may have had its sticker sent already
+      if len({n.gift_id for n in batch}) == 1 and not any(n.attempts for n in batch):
+        msg = await self._call(sticker_cache.send, self.bot, recipient, batch[0].gift_id, batch[0].gift_file_id)
+        reply_to_message_id = msg.message_id
+
+      message_text = "\n\n".join(format_notification(n) for n in batch)
+      await self._call(self.bot.send_message, recipient, message_text, reply_to_message_id=reply_to_message_id)
+    except TelegramForbiddenError:
+      await UserService.update_receive_messages(recipient, False)
+    await self._forget(batch)
+
+  async def _retry(self, recipient: int, batch: list[Notification], error: Exception) -> float | None:
+    """Counts a failed delivery of `batch`, requeues what has attempts left and returns the backoff before it goes out again."""
+    for n in batch:
+      n.attempts = (n.attempts or 0) + 1
+    failed = [n for n in batch if n.attempts >= self.max_delivery_attempts]
+    retried = [n for n in batch if n.attempts < self.max_delivery_attempts]
+    if retried:
+      # ahead of whatever was queued for the recipient meanwhile
+      self._queues[recipient] = retried + self._queues.get(recipient, [])
+    if failed:
+      logger.warning(f"giving up on {len(failed)} notifications to {recipient} after {self.max_delivery_attempts} attempts: {error}")
+      self._queued.difference_update(n.id for n in failed)
+
+    if self.persist:
+      try:
+        async with db.session() as session:
+          await session.execute(
+            update(Notification)
+            .where(Notification.id.in_([n.id for n in batch]))
+            .values(attempts=Notification.attempts + 1)
+          )
+          if failed:
+            await session.execute(
+              update(Notification)
+              .where(Notification.id.in_([n.id for n in failed]))
+              .values(failed_at=func.now())
+            )
+          await session.commit()
+      except Exception as e:
+        # the attempts still count in this worker, a restart only allows a few more
+        logger.warning(f"failed to record notification attempts of {recipient}: {e}")
+
+    if not retried:
+      return None
+    attempts = max(n.attempts for n in retried)
+    return min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+
+  async def _call(self, method, *args, **kwargs):
+    for attempt in range(self.max_attempts):
+      await self.limiter.acquire()
+      try:
+        return await method(*args, **kwargs)
+      except TelegramRetryAfter as e:
+        logger.warning(f"flood wait, retrying in {e.retry_after}s...")
+        self.limiter.pause(e.retry_after)
+    raise Exception("Max retries reached")
+
+  async def _forget(self, batch: list[Notification]):
+    self._queued.difference_update(n.id for n in batch)
+    if not self.persist:
+      return
+    async with db.session() as session:
+      await session.execute(delete(Notification).where(Notification.id.in_([n.id for n in batch])))
+      await session.commit()
+
+notification_outbox = NotificationOutbox(rate=NOTIFICATION_RATE, chat_interval=NOTIFICATION_CHAT_INTERVAL, workers=NOTIFICATION_WORKERS, persist=NOTIFICATION_OUTBOX_PERSIST)
+cluster.subscribe("notification", notification_outbox._received)
+cluster.subscribe("notification_data", notification_outbox._received_data)
@@ -0,0 +1,97 @@
+from crypto_api.CryptoAsset import CryptoAsset
+from config import PRICE_REFRESH_INTERVAL, PRICE_MAX_AGE
+import traceback
+import logging
+import asyncio
+import time
+
+logger = logging.getLogger(__name__)
+
+class PriceOracle:
+  """
+  USD prices of the registered assets, refreshed in the background.
+
+  A price younger than `max_age` seconds is served from memory. An older
+  one is refetched inline, and if the upstream API fails the last known
+  good price is served instead, so only a cold start can wait on it.
+  """
+
+  def __init__(self, refresh_interval: float = 60, max_age: float = 300, fetch_timeout: float = 10):
+    self.refresh_interval = refresh_interval
+    self.max_age = max_age
+    self.fetch_timeout = fetch_timeout
+
+    self._assets: list[CryptoAsset] = []
+    # asset -> (price, monotonic time it was fetched)
+    self._prices: dict[CryptoAsset, tuple[float, float]] = {}
+    self._locks: dict[CryptoAsset, asyncio.Lock] = {}
+    self._task: asyncio.Task | None = None
+
+  def register(self, *assets: CryptoAsset):
+    for asset in assets:
+      if asset not in self._locks:
+        self._assets.append(asset)
+        self._locks[asset] = asyncio.Lock()
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+
+  async def _run(self):
+    while True:
+      await self.refresh()
+      await asyncio.sleep(self.refresh_interval)
+
+  async def refresh(self):
+    await asyncio.gather(*(self._fetch(asset) for asset in self._assets), return_exceptions=True)
+
+  async def _fetch(self, asset: CryptoAsset) -> float:
+    try:
+      price = await asyncio.wait_for(asset.price_usd(), timeout=self.fetch_timeout)
+      # the price APIs answer 0.0 when they know nothing about the token
+      if not price or price <= 0:
+        raise ValueError("no price returned")
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      tb_str = traceback.format_exc()
+      logger.warning(f"failed to fetch {await asset.network} | {await asset.symbol} price: {e} / {tb_str}")
+      raise
+
+    self._prices[asset] = (price, time.monotonic())
+    return price
+
+  def _fresh(self, asset: CryptoAsset) -> float | None:
+    entry = self._prices.get(asset)
+    if entry is None:
+      return None
+    price, fetched_at = entry
+    return price if time.monotonic() - fetched_at <= self.max_age else None
+
+  async def price_usd(self, asset: CryptoAsset) -> float:
+    self.register(asset)
+    price = self._fresh(asset)
+    if price is not None:
+      return price
+
+    async with self._locks[asset]:
+      # whoever held the lock may have just refreshed it
+      price = self._fresh(asset)
+      if price is not None:
+        return price
+
+      try:
+        return await self._fetch(asset)
+      except Exception:
+        entry = self._prices.get(asset)
+        if entry is None:
+          raise
+        logger.warning(f"serving {await asset.network} | {await asset.symbol} price from {time.monotonic() - entry[1]:.0f}s ago")
+        return entry[0]
+
+price_oracle = PriceOracle(refresh_interval=PRICE_REFRESH_INTERVAL, max_age=PRICE_MAX_AGE)
@@ -1,5 +1,6 @@
 import datetime
 import math
+from typing import NamedTuple
 
 from sqlalchemy import select, update, func
 from sqlalchemy.orm import selectinload
@@ -9,27 +10,73 @@ import config
 
 from models.session import Session
 from models.filter import Filter
+from services.filter_index import filter_index
+from services.cluster import cluster
+from services.user import UserService
 from language import LanguageService
 
+class SessionOverview(NamedTuple):
+  id: int
+  session_string: str
+  filters_amount: int
+  active: bool
+
 class SessionService:
+  filters_per_session = 5
+
   @staticmethod
   async def is_exist(id: int) -> bool:
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       stmt = select(Session).where(Session.id == id)
       is_exist = await session.execute(stmt)
       return is_exist.scalar() is not None
 
   @staticmethod
   async def get_by_id(id: int) -> Session | None:
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       stmt = select(Session).where(Session.id == id)
       session_from_db = await session.execute(stmt)
       session_from_db = session_from_db.scalar()
       return session_from_db
   
+  @staticmethod
+  async def get_many(ids: list[int]) -> list[Session]:
+    async with db.session() as session:
+      stmt = (
+        select(Session)
+        .where(Session.id.in_(ids))
+        .options(selectinload(Session.user))
+      )
+      sessions = await session.execute(stmt)
+      return sessions.scalars().all()
+
+  @staticmethod
+  async def get_overview(telegram_id: int) -> list[SessionOverview]:
+    # sessions and their filters come eagerly loaded (and cached) with the user
+    user = await UserService.get_by_tgid(telegram_id)
+    if user is None:
+      return []
+
+    return [
+      SessionOverview(
+        id=s.id,
+        session_string=s.session_string,
+        filters_amount=len(s.filters),
+        active=any(f.active for f in s.filters),
+      )
+      for s in user.sessions
+    ]
+
+  @staticmethod
+  async def get_owned(telegram_id: int, id: int) -> Session | None:
+    user = await UserService.get_by_tgid(telegram_id)
+    if user is None:
+      return None
+    return next((s for s in user.sessions if s.id == id), None)
+
   @staticmethod
   async def is_active(id: int) -> bool:
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       stmt = select(Filter).where(Filter.session_id == id).where(Filter.active == True)
       filter_from_db = await session.execute(stmt)
       filter_from_db = filter_from_db.first()
@@ -38,7 +85,7 @@ class SessionService:
     
   @staticmethod
   async def add_filter(id: int, recipient_tg_id: int, min_price: int = 0, max_price: int = -1, min_supply: int = 0, max_supply: int = -1, amount_stars: int = -1) -> int | None:
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       stmt = (
         select(Session)
         .where(Session.id == id)
@@ -65,11 +112,14 @@ class SessionService:
       await session.refresh(new_filter)
       new_filter_id = new_filter.id
       await session.commit()
+      filter_index.update(new_filter)
+      cluster.publish_ids("filter", [new_filter_id])
+      UserService.invalidate_session(id)
       return new_filter_id
     
   @staticmethod
   async def remove_filter(session_id: int, filter_id: int):
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       result = await session.execute(
         select(Session)
           .where(Session.id == session_id)
@@ -86,11 +136,14 @@ class SessionService:
       s.filters.remove(target)
 
       await session.commit()
+      filter_index.remove(filter_id)
+      cluster.publish_ids("filter", [filter_id])
+      UserService.invalidate_session(session_id)
       return True
 
   @staticmethod
   async def filters_amount(id: int) -> int:
-    async with db.async_session_maker() as session:
+    async with db.session() as session:
       stmt = select(func.count(Filter.id))\
         .join(Filter.session)\
         .where(Session.id == id)
@@ -101,4 +154,4 @@ class SessionService:
   @staticmethod
   async def new_filter_available(id: int) -> bool:
     a = await SessionService.filters_amount(id)
-    return a < 5
\ No newline at end of file
+    return a < SessionService.filters_per_session
\ No newline at end of file
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+from config import STICKER_CACHE_SIZE
+import traceback
+import logging
+import asyncio
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+# TelegramBadRequest descriptions meaning the file_id itself is unusable, anything else (chat not found, ...) is about the recipient
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference", "file_reference")
+
+class StickerCache:
+  """
+  Gift stickers for purchase notifications.
+
+  A sticker is uploaded once per gift, the file_id Telegram returns for it
+  is remembered (and persisted) so every later notification is sent by
+  reference. Concurrent downloads/uploads of the same gift share one
+  in-flight future and the files on disk are evicted least-recently-used
+  past `max_files`. Nothing is read from disk before `preload`, or the
+  first send or download without one.
+  """
+
+  def __init__(self, folder: str = "cache", max_files: int = 200):
+    self.folder = folder
+    self.max_files = max_files
+    self.file_ids_path = os.path.join(folder, "file_ids.json")
+
+    self._file_ids: dict[str, str] = {}
+    self._files: OrderedDict[str, str] = OrderedDict()
+    self._downloading: dict[str, asyncio.Future] = {}
+    self._uploading: dict[str, asyncio.Future] = {}
+    self._loaded = False
+
+  def _load(self):
+    if self._loaded:
+      return
+    self._loaded = True
+    os.makedirs(self.folder, exist_ok=True)
+    try:
+      with open(self.file_ids_path, "r", encoding="utf-8") as f:
+        self._file_ids = json.load(f)
+    except FileNotFoundError:
+      pass
+    except Exception as e:
+      logger.warning(f"failed to load sticker file ids: {e}")
+
+    files = []
+    for name in os.listdir(self.folder):
+      if not name.endswith(".tgs"):
+        continue
+      path = os.path.join(self.folder, name)
+      files.append((os.path.getmtime(path), name[:-len(".tgs")], path))
+    for _, gift_id, path in sorted(files):
+      self._files[gift_id] = path
+    self._evict_overflow()
+
+  def _save(self):
+    tmp_path = self.file_ids_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      json.dump(self._file_ids, f)
+    os.replace(tmp_path, self.file_ids_path)
+
+  def _remember(self, gift_id: str, file_id: str):
+    if self._file_ids.get(gift_id) == file_id:
+      return
+    self._file_ids[gift_id] = file_id
+    self._try_save()
+
+  def _forget(self, gift_id: str, file_id: str):
+    if self._file_ids.get(gift_id) != file_id:
+      return
+    del self._file_ids[gift_id]
+    self._try_save()
+
+  def _try_save(self):
+    try:
+      self._save()
+    except Exception as e:
+      logger.warning(f"failed to save sticker file ids: {e}")
+
+  def _evict_overflow(self):
+    while len(self._files) > self.max_files:
+      _, path = self._files.popitem(last=False)
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+
+  async def send(self, bot: Bot, chat_id: int, gift_id: int | str, file_id: str) -> Message:
+    self._load()
+    gift_id = str(gift_id)
+
+    cached_file_id = self._file_ids.get(gift_id)
+    if cached_file_id is not None:
+      try:
+        return await bot.send_sticker(chat_id, cached_file_id)
+      except TelegramBadRequest as e:
+        if not any(error in e.message.lower() for error in STALE_FILE_ID_ERRORS):
+          raise
+        # the remembered file_id went stale, forget it (on disk too, a restart would try it again) and upload again
+        logger.warning(f"gift {gift_id}: cached sticker rejected: {e}")
+        self._forget(gift_id, cached_file_id)
+
+    # the first notification of a drop uploads, everyone else waits for its file_id
+    uploading = self._uploading.get(gift_id)
+    if uploading is not None:
+      uploaded_file_id = await asyncio.shield(uploading)
+      if uploaded_file_id is not None:
+        return await bot.send_sticker(chat_id, uploaded_file_id)
+      return await bot.send_sticker(chat_id, FSInputFile(await self.download(bot, gift_id, file_id)))
+
+    uploading = self._uploading[gift_id] = asyncio.get_running_loop().create_future()
+    uploaded_file_id = None
+    try:
+      msg = await bot.send_sticker(chat_id, FSInputFile(await self.download(bot, gift_id, file_id)))
+      if msg.sticker is not None:
+        uploaded_file_id = msg.sticker.file_id
+        self._remember(gift_id, uploaded_file_id)
+      return msg
+    finally:
+      # a failed upload (e.g. the recipient blocked the bot) must not fail the waiters
+      uploading.set_result(uploaded_file_id)
+      self._uploading.pop(gift_id, None)
+
+  async def download(self, bot: Bot, gift_id: int | str, file_id: str) -> str:
+    self._load()
+    gift_id = str(gift_id)
+
+    path = self._files.get(gift_id)
+    if path is not None and os.path.exists(path):
+      self._files.move_to_end(gift_id)
+      return path
+
+    downloading = self._downloading.get(gift_id)
+    if downloading is not None:
+      return await asyncio.shield(downloading)
+
+    downloading = self._downloading[gift_id] = asyncio.get_running_loop().create_future()
+    try:
+      path = os.path.join(self.folder, f"{gift_id}.tgs")
+      file_obj = await bot.get_file(file_id)
+      await bot.download_file(file_obj.file_path, destination=path)
+      self._files[gift_id] = path
+      self._files.move_to_end(gift_id)
+      self._evict_overflow()
+      downloading.set_result(path)
+    except BaseException as e:
+      downloading.set_exception(e)
+      # nobody may be waiting on the future, mark the exception as retrieved
+      downloading.exception()
+      raise
+    finally:
+      self._downloading.pop(gift_id, None)
+
+    return path
+
+  async def preload(self, bot: Bot):
+    """Loads the cache from disk, remembers the bot-side file_id of every gift on sale and downloads the limited ones."""
+    self._load()
+    try:
+      gifts = await bot.get_available_gifts()
+    except Exception as e:
+      tb_str = traceback.format_exc()
+      logger.warning(f"failed to preload gift stickers: {e} / {tb_str}")
+      return
+
+    for gift in gifts.gifts:
+      self._file_ids.setdefault(str(gift.id), gift.sticker.file_id)
+    self._try_save()
+
+    hot = [g for g in gifts.gifts if g.total_count is not None][:self.max_files]
+    results = await asyncio.gather(*(self.download(bot, g.id, g.sticker.file_id) for g in hot), return_exceptions=True)
+    failed = sum(isinstance(r, BaseException) for r in results)
+    logger.info(f"preloaded {len(gifts.gifts)} gift stickers, {len(hot) - failed} limited ones on disk")
+
+sticker_cache = StickerCache(max_files=STICKER_CACHE_SIZE)
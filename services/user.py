@@ -4,74 +4,131 @@ import math
 from dateutil.relativedelta import relativedelta
 from sqlalchemy import select, update, func
 from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert
 from db import db
 
 from models.user import User
 from models.session import Session
+from services.filter_index import filter_index
+from services.client_pool import client_pool
+from services.cluster import cluster
+from utils.cache import TTLCache
+from config import USER_CACHE_SIZE, USER_CACHE_TTL
 from language import LanguageService
 
+_MISSING = object()
+user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# session id -> owner telegram id, lets session/filter writes find the cached user to drop
+_session_owners: dict[int, int] = {}
+
 class UserService:
     users_per_page = 20
+    sessions_per_user = 3
+
+    @staticmethod
+    def invalidate(telegram_id: int):
+        user_cache.pop(telegram_id)
+        cluster.publish("user", str(telegram_id))
+
+    @staticmethod
+    def invalidate_session(session_id: int):
+        _forget_session_owner(session_id)
+        cluster.publish("session", str(session_id))
+
+    @staticmethod
+    def is_subscription_active(user: User | None) -> bool:
+        if user is None:
+            return False
+        return user.subscription_expires is not None and user.subscription_expires > datetime.datetime.now(datetime.timezone.utc)
 
     @staticmethod
     async def is_exist(telegram_id: int) -> bool:
-        async with db.async_session_maker() as session:
-            stmt = select(User).where(User.telegram_id == telegram_id)
-            is_exist = await session.execute(stmt)
-            return is_exist.scalar() is not None
-
-    @staticmethod
-    async def get_next_user_id() -> int:
-        async with db.async_session_maker() as session:
-            query = select(User.id).order_by(User.id.desc()).limit(1)
-            last_user_id = await session.execute(query)
-            last_user_id = last_user_id.scalar()
-            if last_user_id is None:
-                return 0
-            else:
-                return int(last_user_id) + 1
-
-    @staticmethod
-    async def create(telegram_id: int, telegram_username: str):
-        async with db.async_session_maker() as session:
-            next_user_id = await UserService.get_next_user_id()
-            new_user = User(
-                id=next_user_id,
-                telegram_username=telegram_username,
-                telegram_id=telegram_id,
-            )
-            session.add(new_user)
+        return await UserService.get_by_tgid(telegram_id) is not None
+
+    @staticmethod
+    async def upsert(telegram_id: int, telegram_username: str) -> User:
+        """
+        Registers the user, or marks them reachable again and refreshes their
+        username, in one INSERT ... ON CONFLICT statement. Ids come from the
+        users id sequence, so concurrent /starts can not race on them.
+        """
+        stmt = insert(User).values(telegram_id=telegram_id, telegram_username=telegram_username, can_receive_messages=True)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={"telegram_username": stmt.excluded.telegram_username, "can_receive_messages": True},
+        ).returning(User)
+        async with db.session() as session:
+            user = (await session.scalars(stmt, execution_options={"populate_existing": True})).one()
             await session.commit()
+        UserService.invalidate(telegram_id)
+        UserService._cache(telegram_id, user)
+        return user
 
     @staticmethod
-    async def user_logged(telegram_id: int, telegram_username: str):
-        is_exist = await UserService.is_exist(telegram_id)
-        if is_exist is False:
-            await UserService.create(telegram_id, telegram_username)
-        else:
-            await UserService.update_receive_messages(telegram_id, True)
-            await UserService.update_username(telegram_id, telegram_username)
+    async def user_logged(telegram_id: int, telegram_username: str) -> User:
+        return await UserService.upsert(telegram_id, telegram_username)
 
     @staticmethod
     async def update_username(telegram_id: int, telegram_username: str):
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             user_from_db = await UserService.get_by_tgid(telegram_id)
             if user_from_db and user_from_db.telegram_username != telegram_username:
                 stmt = update(User).where(User.telegram_id == telegram_id).values(telegram_username=telegram_username)
                 await session.execute(stmt)
                 await session.commit()
+                UserService.invalidate(telegram_id)
 
     @staticmethod
     async def get_by_tgid(telegram_id: int) -> User | None:
-        async with db.async_session_maker() as session:
-            stmt = select(User).where(User.telegram_id == telegram_id)
+        user_from_db = user_cache.get(telegram_id, _MISSING)
+        if user_from_db is not _MISSING:
+            return user_from_db
+
+        async with db.session() as session:
+            stmt = select(User).where(User.telegram_id == telegram_id).execution_options(populate_existing=True)
             user_from_db = await session.execute(stmt)
             user_from_db = user_from_db.scalar()
-            return user_from_db
+
+        UserService._cache(telegram_id, user_from_db)
+        return user_from_db
+
+    @staticmethod
+    async def get_by_tgids(telegram_ids: list[int], chunk_size: int = 1000) -> dict[int, User]:
+        """Resolves many users at once, only ids missing from the cache are queried."""
+        users = {}
+        missing = []
+        for telegram_id in set(telegram_ids):
+            user_from_db = user_cache.get(telegram_id, _MISSING)
+            if user_from_db is _MISSING:
+                missing.append(telegram_id)
+            elif user_from_db is not None:
+                users[telegram_id] = user_from_db
+
+        if not missing:
+            return users
+
+        async with db.session() as session:
+            for i in range(0, len(missing), chunk_size):
+                chunk = missing[i:i + chunk_size]
+                stmt = select(User).where(User.telegram_id.in_(chunk)).execution_options(populate_existing=True)
+                found = {u.telegram_id: u for u in (await session.execute(stmt)).scalars().all()}
+                for telegram_id in chunk:
+                    user_from_db = found.get(telegram_id)
+                    UserService._cache(telegram_id, user_from_db)
+                    if user_from_db is not None:
+                        users[telegram_id] = user_from_db
+        return users
+
+    @staticmethod
+    def _cache(telegram_id: int, user: User | None):
+        user_cache.set(telegram_id, user)
+        if user is not None:
+            for s in user.sessions:
+                _session_owners[s.id] = telegram_id
 
     @staticmethod
     async def get_by_id(id: int) -> User:
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             stmt = select(User).where(User.id == id)
             user_from_db = await session.execute(stmt)
             user_from_db = user_from_db.scalar()
@@ -79,16 +136,17 @@ class UserService:
 
     @staticmethod
     async def update_language(telegram_id: int, language_code):
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             user_from_db = await UserService.get_by_tgid(telegram_id)
             if user_from_db and user_from_db.language != language_code:
                 stmt = update(User).where(User.telegram_id == telegram_id).values(language=language_code)
                 await session.execute(stmt)
                 await session.commit()
+                UserService.invalidate(telegram_id)
 
     @staticmethod
     async def get_users_tg_ids_for_sending():
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             stmt = select(User.telegram_id).where(User.can_receive_messages == True)
             user_ids = await session.execute(stmt)
             user_ids = user_ids.scalars().all()
@@ -96,14 +154,14 @@ class UserService:
 
     @staticmethod
     async def get_all_users_count():
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             stmt = func.count(User.id)
             users_count = await session.execute(stmt)
             return users_count.scalar()
 
     @staticmethod
     async def get_new_users_by_timedelta(timedelta_int, page):
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             current_time = datetime.datetime.now()
             one_day_interval = datetime.timedelta(days=int(timedelta_int))
             time_to_subtract = current_time - one_day_interval
@@ -117,7 +175,7 @@ class UserService:
 
     @staticmethod
     async def get_max_page_for_users_by_timedelta(timedelta_int):
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             current_time = datetime.datetime.now()
             one_day_interval = datetime.timedelta(days=int(timedelta_int))
             time_to_subtract = current_time - one_day_interval
@@ -132,11 +190,12 @@ class UserService:
 
     @staticmethod
     async def update_receive_messages(telegram_id, new_value):
-        async with db.async_session_maker() as session:
+        async with db.session() as session:
             stmt = update(User).where(User.telegram_id == telegram_id).values(
                 can_receive_messages=new_value)
             await session.execute(stmt)
             await session.commit()
+        UserService.invalidate(telegram_id)
 
     @staticmethod
     async def get_language_code(telegram_id):
@@ -147,22 +206,19 @@ class UserService:
     
     @staticmethod
     async def sessions_amount(telegram_id: int) -> int:
-      async with db.async_session_maker() as session:
-        stmt = select(func.count(Session.id))\
-          .join(Session.user)\
-          .where(User.telegram_id == telegram_id)
-        session_count = await session.execute(stmt)
-        session_count = session_count.scalar_one()
-        return session_count
+      user = await UserService.get_by_tgid(telegram_id)
+      if user is None:
+        return 0
+      return len(user.sessions)
 
     @staticmethod
     async def new_session_available(telegram_id: int) -> bool:
       a = await UserService.sessions_amount(telegram_id)
-      return a < 3
+      return a < UserService.sessions_per_user
     
     @staticmethod
     async def subscribe_user_for_3_months(telegram_id: int) -> bool:
-      async with db.async_session_maker() as session:
+      async with db.session() as session:
         stmt = select(User).where(User.telegram_id == telegram_id)
         result = await session.execute(stmt)
         user = result.scalar_one_or_none()
@@ -175,33 +231,23 @@ class UserService:
 
         session.add(user)
         await session.commit()
-        return True
+      UserService.invalidate(telegram_id)
+      return True
 
     @staticmethod
     async def is_subscription_valid(telegram_id: int) -> bool:
-      async with db.async_session_maker() as session:
-        stmt = select(User).where(User.telegram_id == telegram_id)
-        query = await session.execute(stmt)
-        user = query.scalar()
-        if user is None:
-          return False
-        
-        return user.subscription_expires and user.subscription_expires > datetime.datetime.now(datetime.timezone.utc)
+      return UserService.is_subscription_active(await UserService.get_by_tgid(telegram_id))
 
     @staticmethod
     async def subscription_expiration_date(telegram_id: int) -> datetime.datetime | None:
-      async with db.async_session_maker() as session:
-        stmt = select(User).where(User.telegram_id == telegram_id)
-        query = await session.execute(stmt)
-        user = query.scalar()
-        if user is None:
-          return None
-        
-        return user.subscription_expires
+      user = await UserService.get_by_tgid(telegram_id)
+      if user is None:
+        return None
+      return user.subscription_expires
 
     @staticmethod
     async def add_session(telegram_id: int, api_id: int, api_hash: str, session_string: str):
-      async with db.async_session_maker() as session:
+      async with db.session() as session:
         stmt = select(User).where(User.telegram_id == telegram_id)
         query = await session.execute(stmt)
         user = query.scalar()
@@ -210,10 +256,11 @@ class UserService:
         
         user.sessions.append(Session(session_string=session_string, api_id=api_id, api_hash=api_hash))
         await session.commit()
+      UserService.invalidate(telegram_id)
 
     @staticmethod
     async def remove_session(telegram_id: int, session_id: int):
-      async with db.async_session_maker() as session:
+      async with db.session() as session:
         result = await session.execute(
           select(User)
             .where(User.telegram_id == telegram_id)
@@ -227,7 +274,28 @@ class UserService:
         if not target:
           return False
         
+        filter_ids = [f.id for f in target.filters]
         user.sessions.remove(target)
 
         await session.commit()
-        return True
\ No newline at end of file
+      UserService.invalidate(telegram_id)
+      filter_index.remove(*filter_ids)
+      cluster.publish_ids("filter", filter_ids)
+      cluster.publish("session_removed", str(session_id))
+      await _session_removed(session_id)
+      return True
+
+# writes in other workers reach this one's caches through the cluster, see services/cluster.py
+def _forget_session_owner(session_id: int | str):
+    telegram_id = _session_owners.get(int(session_id))
+    if telegram_id is not None:
+        user_cache.pop(telegram_id)
+
+async def _session_removed(session_id: int | str):
+    _session_owners.pop(int(session_id), None)
+    await client_pool.discard(int(session_id))
+
+cluster.subscribe("user", lambda telegram_id: user_cache.pop(int(telegram_id)))
+cluster.subscribe("session", _forget_session_owner)
+cluster.subscribe("session_removed", _session_removed)
+cluster.on_resync(user_cache.clear)
@@ -0,0 +1,32 @@
+"""
+Just enough bot configuration for config.py to import, values already in
+the environment (or a config.json in the repo root) win.
+"""
+import tempfile
+import json
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for name, value in {
+  "TOKEN": "0:test",
+  "DATABASE_URL": os.environ.get("TEST_DATABASE_URL") or "postgresql+asyncpg://localhost/test",
+  "PRICE_30_DAYS": "1",
+  "ADMIN_ID_LIST": "[]",
+  "REQUIRED_CHANNEL_IDS": "[]",
+  "REQUIRED_CHANNEL_LINKS": "[]",
+  "REQUIRED_CHANNEL_NAMES": "[]",
+}.items():
+  os.environ.setdefault(name, value)
+
+# the bot reads config.json and languages/ from the working directory
+if not os.path.exists(os.path.join(ROOT, "config.json")):
+  workdir = tempfile.mkdtemp(prefix="bot-tests-")
+  with open(os.path.join(workdir, "config.json"), "w") as f:
+    json.dump({"proxies": [], "api_credentials": [{"api_id": 1, "api_hash": "test"}]}, f)
+  os.symlink(os.path.join(ROOT, "languages"), os.path.join(workdir, "languages"))
+  os.chdir(workdir)
+else:
+  os.chdir(ROOT)
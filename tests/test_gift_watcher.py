@@ -0,0 +1,154 @@
+"""
+Drop detection and purchases of the gift watcher on FakeGiftBackend, with a
+FilterIndex of their own and in-memory sessions, no Telegram nor database.
+"""
+import datetime
+import asyncio
+import pytest
+
+for module in ("sqlalchemy", "asyncpg", "pyrogram"):
+  pytest.importorskip(module)
+
+from models.filter import Filter
+from models.session import Session
+from models.user import User
+from services.filter_index import FilterIndex
+from services.gift_watcher import FakeGiftBackend, Gift, GiftWatcher, PurchaseResult
+
+def user(telegram_id: int = 1, expires_in: datetime.timedelta = datetime.timedelta(days=1)) -> User:
+  expires = datetime.datetime.now(datetime.timezone.utc) + expires_in
+  return User(id=telegram_id, telegram_id=telegram_id, can_receive_messages=True, subscription_expires=expires)
+
+def session(id: int, owner: User) -> Session:
+  s = Session(id=id, api_id=0, api_hash="", session_string="")
+  s.user = owner
+  return s
+
+def gift_filter(id: int, session_id: int, amount_stars: int = 1000, min_price: int = 0, max_price: int = -1, min_supply: int = 0, max_supply: int = -1) -> Filter:
+  return Filter(
+    id=id, session_id=session_id, recipient_telegram_id=100 + id, active=True, amount_stars=amount_stars,
+    min_price=min_price, max_price=max_price, min_supply=min_supply, max_supply=max_supply,
+  )
+
+def watcher(backend: FakeGiftBackend, sessions: list[Session], filters: list[Filter], **kwargs) -> tuple[GiftWatcher, list[PurchaseResult]]:
+  by_id = {s.id: s for s in sessions}
+  index = FilterIndex()
+  index.load(filters)
+  notified = []
+
+  async def get_sessions(ids: list[int]) -> list[Session]:
+    return [by_id[i] for i in ids if i in by_id]
+
+  async def notify(result: PurchaseResult):
+    notified.append(result)
+
+  return GiftWatcher(backend, notify, get_sessions=get_sessions, index=index, **kwargs), notified
+
+class CountingBackend(FakeGiftBackend):
+  """Keeps the highest number of purchases in flight at once, fails after `fail_after` purchases."""
+
+  def __init__(self, fail_after: int | None = None):
+    super().__init__(catalog_latency=0, buy_latency=0.01)
+    self.fail_after = fail_after
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.attempts = 0
+
+  async def buy(self, session: Session, gift: Gift, recipient_telegram_id: int):
+    self.attempts += 1
+    if self.fail_after is not None and self.attempts > self.fail_after:
+      raise RuntimeError("BALANCE_TOO_LOW")
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    try:
+      await super().buy(session, gift, recipient_telegram_id)
+    finally:
+      self.in_flight -= 1
+
+def test_released_limited_gift_is_bought_for_matching_filters():
+  async def run():
+    backend = FakeGiftBackend(catalog_latency=0, buy_latency=0)
+    owner = user()
+    w, notified = watcher(backend, [session(1, owner)], [
+      gift_filter(1, 1, amount_stars=300, max_price=500),
+      gift_filter(2, 1, min_price=600),
+    ])
+    backend.release(Gift(id=1, price=50, supply=1000, available=1000, file_id=None))
+
+    # the first snapshot was already on sale
+    assert await w.poll() == []
+    backend.release(Gift(id=2, price=100, supply=1000, available=1000, file_id=None))
+    backend.release(Gift(id=3, price=100, supply=None, available=None, file_id=None))
+    assert [g.id for g in await w.poll()] == [2, 3]
+    await w.drain()
+
+    # filter 2 wants pricier gifts, the unlimited gift 3 is not sniped
+    assert backend.purchases == [(1, 2, 101)] * 3
+    assert [(r.gift.id, r.amount_succeeded, r.amount_tried, r.error) for r in notified] == [(2, 3, 3, None)]
+    assert notified[0].owner_telegram_id == owner.telegram_id
+    assert w.last_latency is not None
+
+  asyncio.run(run())
+
+def test_unlimited_budget_is_capped():
+  async def run():
+    backend = FakeGiftBackend(catalog_latency=0, buy_latency=0)
+    w, notified = watcher(backend, [session(1, user())], [gift_filter(1, 1, amount_stars=-1)], max_purchases_per_filter=7)
+
+    results = await w.dispatch(Gift(id=1, price=1, supply=100000, available=100000, file_id=None))
+    assert [(r.amount_succeeded, r.amount_tried) for r in results] == [(7, 7)]
+    assert len(backend.purchases) == 7
+
+  asyncio.run(run())
+
+def test_purchases_per_session_bounds_purchases_in_flight():
+  async def run():
+    backend = CountingBackend()
+    owner = user()
+    w, notified = watcher(backend, [session(1, owner), session(2, owner)], [
+      gift_filter(1, 1), gift_filter(2, 1), gift_filter(3, 2),
+    ], purchases_per_session=2)
+
+    results = await w.dispatch(Gift(id=1, price=100, supply=10, available=10, file_id=None))
+    assert sorted(r.amount_succeeded for r in results) == [10, 10, 10]
+    # session 1 shares its two slots between filters 1 and 2, session 2 buys alongside
+    assert backend.max_in_flight == 4
+    assert sorted(session_id for session_id, _, _ in backend.purchases) == [1] * 20 + [2] * 10
+
+  asyncio.run(run())
+
+def test_error_stops_the_remaining_purchases():
+  async def run():
+    backend = CountingBackend(fail_after=3)
+    w, notified = watcher(backend, [session(1, user())], [gift_filter(1, 1)], purchases_per_session=1)
+
+    results = await w.dispatch(Gift(id=1, price=100, supply=10, available=10, file_id=None))
+    assert [(r.amount_succeeded, r.amount_tried, r.error) for r in results] == [(3, 4, "BALANCE_TOO_LOW")]
+    assert notified == results
+
+  asyncio.run(run())
+
+def test_expired_subscriptions_buy_nothing():
+  async def run():
+    backend = FakeGiftBackend(catalog_latency=0, buy_latency=0)
+    w, notified = watcher(backend, [session(1, user(expires_in=-datetime.timedelta(minutes=1)))], [gift_filter(1, 1)])
+
+    assert await w.dispatch(Gift(id=1, price=100, supply=10, available=10, file_id=None)) == []
+    assert backend.purchases == []
+    assert notified == []
+
+  asyncio.run(run())
+
+def test_warm_forgets_sessions_without_filters():
+  async def run():
+    backend = FakeGiftBackend(catalog_latency=0, buy_latency=0)
+    owner = user()
+    w, _ = watcher(backend, [session(1, owner), session(2, owner)], [gift_filter(1, 1), gift_filter(2, 2)])
+    await w.dispatch(Gift(id=1, price=100, supply=1, available=1, file_id=None))
+    assert set(w._semaphores) == {1, 2}
+
+    w.index.remove(2)
+    await w.warm()
+    assert set(w._semaphores) == {1}
+
+  asyncio.run(run())
@@ -0,0 +1,123 @@
+"""
+Failed deliveries of the notification outbox, against a stand-in bot. The
+persisted case also needs TEST_DATABASE_URL (see test_user_upsert.py).
+"""
+import asyncio
+import os
+import pytest
+
+for module in ("sqlalchemy", "asyncpg", "aiogram"):
+  pytest.importorskip(module)
+
+from types import SimpleNamespace
+from sqlalchemy import text
+
+from db import Database
+from models.notification import Notification
+from services import notifications
+from services.notifications import NotificationOutbox
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+class FlakyBot:
+  """Fails the first `failures` messages with a network error."""
+
+  def __init__(self, failures: int):
+    self.failures = failures
+    self.messages: list[tuple[int, str]] = []
+    self.stickers: list[int] = []
+
+  async def send_message(self, chat_id: int, text: str, reply_to_message_id: int | None = None):
+    if self.failures > 0:
+      self.failures -= 1
+      raise ConnectionResetError("connection reset by peer")
+    self.messages.append((chat_id, text))
+    return SimpleNamespace(message_id=len(self.messages))
+
+  async def send_sticker(self, chat_id: int, file_id: str):
+    self.stickers.append(chat_id)
+    return SimpleNamespace(message_id=0)
+
+class StickerCache:
+  async def send(self, bot: FlakyBot, chat_id: int, gift_id: int | str, file_id: str):
+    return await bot.send_sticker(chat_id, file_id)
+
+def notification(recipient: int = 1, **kwargs) -> Notification:
+  return Notification(recipient=recipient, gift_id=5, gift_price=10, gift_file_id="file", amount_succeeded=1, amount_tried=1, **kwargs)
+
+def outbox(persist: bool = False) -> NotificationOutbox:
+  o = NotificationOutbox(rate=1000, chat_interval=0, workers=1, persist=persist)
+  o.retry_delay = 0.01
+  return o
+
+async def settle(o: NotificationOutbox, timeout: float = 2):
+  async def idle():
+    while len(o) or o._busy:
+      await asyncio.sleep(0.01)
+  await asyncio.wait_for(idle(), timeout)
+
+def test_failed_delivery_is_retried_without_the_sticker(monkeypatch):
+  monkeypatch.setattr(notifications, "sticker_cache", StickerCache())
+
+  async def run():
+    o, bot = outbox(), FlakyBot(failures=2)
+    await o.start(bot)
+    try:
+      await o.enqueue(notification())
+      await settle(o)
+    finally:
+      await o.stop()
+    assert len(bot.messages) == 1
+    # sent along the first attempt, the retries carry the text only
+    assert bot.stickers == [1]
+
+  asyncio.run(run())
+
+def test_outbox_gives_up_after_max_delivery_attempts(monkeypatch):
+  monkeypatch.setattr(notifications, "sticker_cache", StickerCache())
+
+  async def run():
+    o, bot = outbox(), FlakyBot(failures=100)
+    await o.start(bot)
+    try:
+      await o.enqueue(notification(), notification(recipient=2))
+      await settle(o)
+    finally:
+      await o.stop()
+    assert bot.messages == []
+    assert bot.failures == 100 - 2 * o.max_delivery_attempts
+
+  asyncio.run(run())
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_persisted_notifications_are_dead_lettered(monkeypatch):
+  monkeypatch.setattr(notifications, "sticker_cache", StickerCache())
+
+  async def run():
+    database = Database(TEST_DATABASE_URL, echo=False)
+    async with database.engine.begin() as conn:
+      await conn.execute(text("DROP SCHEMA public CASCADE"))
+      await conn.execute(text("CREATE SCHEMA public"))
+    await database.migrate()
+    monkeypatch.setattr(notifications, "db", database)
+    try:
+      o, bot = outbox(persist=True), FlakyBot(failures=NotificationOutbox.max_delivery_attempts)
+      await o.start(bot)
+      await o.enqueue(notification(recipient=1))
+      await settle(o)
+      await o.stop()
+
+      async with database.engine.connect() as conn:
+        rows = (await conn.execute(text("SELECT recipient, attempts, failed_at IS NOT NULL FROM notifications"))).all()
+      assert rows == [(1, NotificationOutbox.max_delivery_attempts, True)]
+
+      # a dead row is not resent by the next leader
+      o = outbox(persist=True)
+      await o.start(bot)
+      await settle(o)
+      await o.stop()
+      assert bot.messages == []
+    finally:
+      await database.close()
+
+  asyncio.run(run())
@@ -0,0 +1,76 @@
+"""
+Sticker cache persistence, against a stand-in bot and a temporary folder.
+"""
+import asyncio
+import json
+import os
+import pytest
+
+pytest.importorskip("aiogram")
+
+from types import SimpleNamespace
+from aiogram.exceptions import TelegramBadRequest
+
+from services.stickers import StickerCache
+
+class StickerBot:
+  """Rejects `stale` file ids, an upload comes back as `uploaded`."""
+
+  def __init__(self, stale: set[str], uploaded: str = "fresh"):
+    self.stale = stale
+    self.uploaded = uploaded
+    self.sent: list[object] = []
+
+  async def send_sticker(self, chat_id: int, sticker):
+    if sticker in self.stale:
+      raise TelegramBadRequest(method=None, message="Bad Request: wrong file identifier/HTTP URL specified")
+    self.sent.append(sticker)
+    return SimpleNamespace(message_id=1, sticker=SimpleNamespace(file_id=sticker if isinstance(sticker, str) else self.uploaded))
+
+  async def get_file(self, file_id: str):
+    return SimpleNamespace(file_path=file_id)
+
+  async def download_file(self, file_path: str, destination: str):
+    with open(destination, "w") as f:
+      f.write("tgs")
+
+def test_constructor_touches_no_disk(tmp_path):
+  folder = tmp_path / "cache"
+  StickerCache(folder=str(folder))
+  assert not folder.exists()
+
+def test_stale_file_id_is_forgotten_on_disk(tmp_path):
+  folder = tmp_path / "cache"
+  folder.mkdir()
+  (folder / "file_ids.json").write_text(json.dumps({"1": "stale", "2": "kept"}))
+
+  async def run():
+    cache = StickerCache(folder=str(folder))
+    bot = StickerBot(stale={"stale"})
+    await cache.send(bot, 10, 1, "bot-side")
+    return bot
+
+  bot = asyncio.run(run())
+  # uploaded from the downloaded file, whose file_id replaces the stale one
+  assert bot.sent[0] != "stale" and not isinstance(bot.sent[0], str)
+  assert json.loads((folder / "file_ids.json").read_text()) == {"1": "fresh", "2": "kept"}
+  assert os.path.exists(folder / "1.tgs")
+
+def test_stale_file_id_stays_forgotten_when_the_upload_fails(tmp_path):
+  folder = tmp_path / "cache"
+  folder.mkdir()
+  (folder / "file_ids.json").write_text(json.dumps({"1": "stale"}))
+
+  class FailingUploads(StickerBot):
+    async def send_sticker(self, chat_id: int, sticker):
+      if not isinstance(sticker, str):
+        raise ConnectionResetError("connection reset by peer")
+      return await super().send_sticker(chat_id, sticker)
+
+  async def run():
+    cache = StickerCache(folder=str(folder))
+    with pytest.raises(ConnectionResetError):
+      await cache.send(FailingUploads(stale={"stale"}), 10, 1, "bot-side")
+
+  asyncio.run(run())
+  assert json.loads((folder / "file_ids.json").read_text()) == {}
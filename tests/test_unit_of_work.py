@@ -0,0 +1,56 @@
+"""
+Sessions shared by the tasks of one update, against a real postgres, see
+test_user_upsert.py for TEST_DATABASE_URL.
+"""
+import asyncio
+import os
+import pytest
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+  pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+from sqlalchemy import text
+
+from db import Database
+
+async def backend_pid(database: Database) -> tuple[object, int]:
+  async with database.session() as session:
+    pid = (await session.execute(text("SELECT pg_backend_pid()"))).scalar()
+    await asyncio.sleep(0.01)
+    return session, pid
+
+def test_tasks_of_an_update_share_its_session():
+  async def run():
+    database = Database(TEST_DATABASE_URL, echo=False)
+    try:
+      async with database.unit_of_work():
+        results = await asyncio.gather(*(backend_pid(database) for _ in range(5)))
+      assert len({id(session) for session, _ in results}) == 1
+      assert len({pid for _, pid in results}) == 1
+    finally:
+      await database.close()
+
+  asyncio.run(run())
+
+def test_tasks_spawned_inside_a_session_get_their_own():
+  async def run():
+    database = Database(TEST_DATABASE_URL, echo=False)
+    try:
+      async with database.unit_of_work():
+        async with database.session() as outer:
+          outer_pid = (await outer.execute(text("SELECT pg_backend_pid()"))).scalar()
+          # used to wait for the lock this block holds, forever
+          results = await asyncio.wait_for(asyncio.gather(*(backend_pid(database) for _ in range(3))), timeout=10)
+          # and the block's session is still usable meanwhile
+          assert (await outer.execute(text("SELECT pg_backend_pid()"))).scalar() == outer_pid
+
+        assert all(session is not outer for session, _ in results)
+        assert outer_pid not in {pid for _, pid in results}
+        # once the block is left, later tasks share the unit's session again
+        session, pid = await asyncio.create_task(backend_pid(database))
+        assert session is outer and pid == outer_pid
+    finally:
+      await database.close()
+
+  asyncio.run(run())
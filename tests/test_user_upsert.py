@@ -0,0 +1,101 @@
+"""
+Concurrent /start registrations against a real postgres.
+
+Needs TEST_DATABASE_URL (postgresql+asyncpg://...) pointing at a disposable
+database, its public schema is dropped before every test. Run from the repo
+root with `python -m pytest tests`.
+"""
+import asyncio
+import os
+import pytest
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+  # before importing the bot, which needs its whole environment
+  pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+from sqlalchemy import text
+
+from db import Database
+from services import user as user_service
+from services.user import UserService, user_cache
+
+async def fresh_database(monkeypatch) -> Database:
+  database = Database(TEST_DATABASE_URL, echo=False, pool_size=20, max_overflow=20)
+  async with database.engine.begin() as conn:
+    await conn.execute(text("DROP SCHEMA public CASCADE"))
+    await conn.execute(text("CREATE SCHEMA public"))
+  await database.migrate()
+  monkeypatch.setattr(user_service, "db", database)
+  user_cache.clear()
+  return database
+
+async def count_users(database: Database, telegram_id: int | None = None) -> int:
+  async with database.engine.connect() as conn:
+    if telegram_id is None:
+      result = await conn.execute(text("SELECT count(*) FROM users"))
+    else:
+      result = await conn.execute(text("SELECT count(*) FROM users WHERE telegram_id = :telegram_id"), {"telegram_id": telegram_id})
+    return result.scalar()
+
+def test_same_user_hammering_start_gets_one_row(monkeypatch):
+  async def run():
+    database = await fresh_database(monkeypatch)
+    try:
+      users = await asyncio.gather(*(UserService.upsert(42, "same") for _ in range(100)))
+      assert {u.id for u in users} == {users[0].id}
+      assert await count_users(database, 42) == 1
+      assert user_cache.get(42).id == users[0].id
+    finally:
+      await database.close()
+
+  asyncio.run(run())
+
+def test_different_users_get_distinct_ids(monkeypatch):
+  async def run():
+    database = await fresh_database(monkeypatch)
+    try:
+      users = await asyncio.gather(*(UserService.upsert(telegram_id, f"user{telegram_id}") for telegram_id in range(1, 201)))
+      assert len({u.id for u in users}) == 200
+      assert await count_users(database) == 200
+    finally:
+      await database.close()
+
+  asyncio.run(run())
+
+def test_mixed_starts_refresh_username_and_reachability(monkeypatch):
+  async def run():
+    database = await fresh_database(monkeypatch)
+    try:
+      first = await UserService.upsert(7, "old")
+      await UserService.update_receive_messages(7, False)
+
+      users = await asyncio.gather(*(UserService.upsert(telegram_id, f"user{telegram_id}") for telegram_id in [7] * 20 + list(range(100, 120))))
+      again = [u for u in users if u.telegram_id == 7]
+      assert {u.id for u in again} == {first.id}
+      assert all(u.telegram_username == "user7" and u.can_receive_messages for u in again)
+      assert await count_users(database) == 21
+    finally:
+      await database.close()
+
+  asyncio.run(run())
+
+def test_sequence_continues_after_legacy_ids(monkeypatch):
+  async def run():
+    database = await fresh_database(monkeypatch)
+    try:
+      # ids handed out by the old max(id) + 1, with the sequence never advanced
+      async with database.engine.begin() as conn:
+        for legacy_id in range(10):
+          await conn.execute(text("INSERT INTO users (id, telegram_id) VALUES (:id, :telegram_id)"), {"id": legacy_id, "telegram_id": 1000 + legacy_id})
+        await conn.execute(text("SELECT setval('users_id_seq', 1, false)"))
+        await conn.execute(text("DELETE FROM schema_migrations WHERE version = 4"))
+      await database.migrate()
+
+      users = await asyncio.gather(*(UserService.upsert(telegram_id, None) for telegram_id in range(1, 51)))
+      assert min(u.id for u in users) == 10
+      assert len({u.id for u in users}) == 50
+    finally:
+      await database.close()
+
+  asyncio.run(run())
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+import time
+
+_MISSING = object()
+
+class TTLCache:
+  """Least-recently-used mapping whose entries also expire `ttl` seconds after being set."""
+
+  def __init__(self, max_size: int = 1024, ttl: float = 60):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def __contains__(self, key: Hashable) -> bool:
+    return self.get(key, _MISSING) is not _MISSING
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    item = self._data.get(key)
+    if item is None:
+      return default
+
+    expires_at, value = item
+    if expires_at <= time.monotonic():
+      del self._data[key]
+      return default
+
+    self._data.move_to_end(key)
+    return value
+
+  def set(self, key: Hashable, value: Any, ttl: float | None = None):
+    self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+    self._data.move_to_end(key)
+    while len(self._data) > self.max_size:
+      self._data.popitem(last=False)
+
+  def pop(self, key: Hashable, default: Any = None) -> Any:
+    item = self._data.pop(key, None)
+    return default if item is None else item[1]
+
+  def clear(self):
+    self._data.clear()
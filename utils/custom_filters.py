@@ -1,6 +1,7 @@
 from aiogram import types
 from aiogram.filters import BaseFilter
 from services.user import UserService
+from models.user import User
 
 from config import ADMIN_ID_LIST
 
@@ -9,9 +10,9 @@ class AdminIdFilter(BaseFilter):
         return message.from_user.id in ADMIN_ID_LIST
     
 class IsUserExistFilter(BaseFilter):
-  async def __call__(self, message: types.Message):
-      return await UserService.is_exist(message.from_user.id)
+  async def __call__(self, message: types.Message, user: User | None = None):
+      return user is not None
 
 class UserSubscriptionValidFilter(BaseFilter):
-  async def __call__(self, message: types.Message):
-      return await UserService.is_subscription_valid(message.from_user.id)
\ No newline at end of file
+  async def __call__(self, message: types.Message, user: User | None = None):
+      return UserService.is_subscription_active(user)
\ No newline at end of file
@@ -0,0 +1,23 @@
+from Crypto.Cipher import AES
+import hashlib
+import secrets
+
+class Cipher:
+  """AES-256-GCM with a key derived from a secret, the nonce and tag travel with the ciphertext."""
+
+  nonce_size = 12
+  tag_size = 16
+
+  def __init__(self, secret: str, purpose: str):
+    # one key per purpose, the same secret never encrypts two kinds of data under one key
+    self.key = hashlib.sha256(f"{purpose}:{secret}".encode()).digest()
+
+  def encrypt(self, data: bytes) -> bytes:
+    nonce = secrets.token_bytes(self.nonce_size)
+    ciphertext, tag = AES.new(self.key, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(data)
+    return nonce + tag + ciphertext
+
+  def decrypt(self, blob: bytes) -> bytes:
+    """Raises ValueError when the blob was not encrypted with this key or was tampered with."""
+    nonce, tag, ciphertext = blob[:self.nonce_size], blob[self.nonce_size:self.nonce_size + self.tag_size], blob[self.nonce_size + self.tag_size:]
+    return AES.new(self.key, AES.MODE_GCM, nonce=nonce).decrypt_and_verify(ciphertext, tag)
@@ -0,0 +1,132 @@
+from typing import Any, Mapping
+from datetime import datetime, timedelta, timezone
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import select, delete, or_, and_, cast, func
+from sqlalchemy.dialects.postgresql import insert, JSONB
+from config import FSM_TTL, FSM_CACHE_SIZE, FSM_CACHE_TTL
+from models.fsm import FsmState
+from utils.cache import TTLCache
+from db import Database, db
+import traceback
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+class PostgresStorage(BaseStorage):
+  """
+  aiogram FSM storage in postgres, so every webhook worker sees the same flows
+  and a restart does not lose them.
+
+  One row per key holds the state and the data. Reads can go through an
+  in-process cache that every write updates (write-through), but another
+  worker may move a flow on meanwhile, so `cache_ttl` stays 0 (off) unless
+  the bot runs as a single worker. Cleared rows and rows untouched for `ttl`
+  seconds are deleted in batches by a background task.
+  """
+
+  def __init__(self, database: Database, ttl: float = 24 * 60 * 60, cache_size: int = 10000, cache_ttl: float = 0, cleanup_interval: float = 600, cleanup_batch: int = 1000):
+    self.db = database
+    self.ttl = ttl
+    self.cleanup_interval = cleanup_interval
+    self.cleanup_batch = cleanup_batch
+    self.cache_ttl = cache_ttl
+    self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    # storage key -> (state, data)
+    self._cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+    self._task: asyncio.Task | None = None
+
+  def start(self):
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+
+  async def close(self):
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+
+  def _key(self, key: StorageKey) -> str:
+    return self.key_builder.build(key)
+
+  async def _load(self, key: str) -> tuple[str | None, dict]:
+    record = self._cache.get(key)
+    if record is None:
+      async with self.db.session() as session:
+        row = (await session.execute(select(FsmState.state, FsmState.data).where(FsmState.key == key))).first()
+      record = (row.state, row.data) if row is not None else (None, {})
+      if self.cache_ttl > 0:
+        self._cache.set(key, record)
+    return record
+
+  async def _write(self, key: str, **values):
+    statement = insert(FsmState).values(key=key, **values).on_conflict_do_update(
+      index_elements=[FsmState.key],
+      set_={**values, "updated_at": func.now()},
+    )
+    try:
+      async with self.db.session() as session:
+        await session.execute(statement)
+        await session.commit()
+    except BaseException:
+      # the cached record may be ahead of the table now
+      self._cache.pop(key)
+      raise
+
+  async def set_state(self, key: StorageKey, state: StateType = None):
+    key = self._key(key)
+    state = state.state if isinstance(state, State) else state
+    record = self._cache.get(key)
+    if record is not None:
+      self._cache.set(key, (state, record[1]))
+    await self._write(key, state=state)
+
+  async def get_state(self, key: StorageKey) -> str | None:
+    state, _ = await self._load(self._key(key))
+    return state
+
+  async def set_data(self, key: StorageKey, data: Mapping[str, Any]):
+    key = self._key(key)
+    data = dict(data)
+    record = self._cache.get(key)
+    if record is not None:
+      self._cache.set(key, (record[0], data))
+    await self._write(key, data=data)
+
+  async def get_data(self, key: StorageKey) -> dict[str, Any]:
+    _, data = await self._load(self._key(key))
+    return dict(data)
+
+  async def cleanup(self) -> int:
+    """Deletes cleared and expired rows, `cleanup_batch` per transaction."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+    deleted = 0
+    while True:
+      stale = (
+        select(FsmState.key)
+        .where(or_(FsmState.updated_at < cutoff, and_(FsmState.state.is_(None), FsmState.data == cast({}, JSONB))))
+        .limit(self.cleanup_batch)
+        .with_for_update(skip_locked=True)
+      )
+      async with self.db.async_session_maker() as session:
+        result = await session.execute(delete(FsmState).where(FsmState.key.in_(stale.scalar_subquery())))
+        await session.commit()
+      deleted += result.rowcount
+      if result.rowcount < self.cleanup_batch:
+        return deleted
+
+  async def _run(self):
+    while True:
+      try:
+        deleted = await self.cleanup()
+        if deleted:
+          logger.info(f"deleted {deleted} stale fsm states")
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        tb_str = traceback.format_exc()
+        logger.warning(f"failed to clean up fsm states: {e} / {tb_str}")
+      await asyncio.sleep(self.cleanup_interval)
+
+fsm_storage = PostgresStorage(db, ttl=FSM_TTL, cache_size=FSM_CACHE_SIZE, cache_ttl=FSM_CACHE_TTL)
@@ -0,0 +1,33 @@
+import aiohttp
+from config import HTTP_POOL_SIZE, HTTP_LIMIT_PER_HOST, HTTP_DNS_TTL, HTTP_TIMEOUT
+
+class HttpClient:
+  """
+  Application-wide aiohttp session: keep-alive connections pooled per host,
+  cached DNS lookups and a cap on concurrent connections to one host.
+  """
+
+  def __init__(self, limit: int = 100, limit_per_host: int = 10, dns_ttl: int = 300, timeout: float = 15):
+    self.limit = limit
+    self.limit_per_host = limit_per_host
+    self.dns_ttl = dns_ttl
+    self.timeout = timeout
+    self._session: aiohttp.ClientSession | None = None
+
+  @property
+  def session(self) -> aiohttp.ClientSession:
+    # created on first use as well, code running before startup (ngrok lookup) shares it too
+    if self._session is None or self._session.closed:
+      connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=self.dns_ttl)
+      self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+    return self._session
+
+  async def start(self):
+    self.session
+
+  async def close(self):
+    if self._session is not None and not self._session.closed:
+      await self._session.close()
+    self._session = None
+
+http_client = HttpClient(limit=HTTP_POOL_SIZE, limit_per_host=HTTP_LIMIT_PER_HOST, dns_ttl=HTTP_DNS_TTL, timeout=HTTP_TIMEOUT)
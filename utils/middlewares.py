@@ -0,0 +1,20 @@
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from services.user import UserService
+from db import db
+
+class DatabaseMiddleware(BaseMiddleware):
+  """Runs every update in one unit of work, services called while handling it share a single connection."""
+
+  async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]], event: TelegramObject, data: dict[str, Any]) -> Any:
+    async with db.unit_of_work():
+      return await handler(event, data)
+
+class UserMiddleware(BaseMiddleware):
+  """Loads the sender once per update and hands it to filters and handlers as `user`."""
+
+  async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]], event: TelegramObject, data: dict[str, Any]) -> Any:
+    from_user = data.get("event_from_user")
+    data["user"] = await UserService.get_by_tgid(from_user.id) if from_user is not None else None
+    return await handler(event, data)
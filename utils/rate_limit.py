@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+class RateLimiter:
+  """Token bucket allowing `rate` calls per `per` seconds, with bursts up to `rate`."""
+
+  def __init__(self, rate: float, per: float = 1.0):
+    self.rate = rate
+    self.per = per
+    self._tokens = float(rate)
+    self._updated_at = time.monotonic()
+    self._paused_until = 0.0
+
+  def pause(self, seconds: float):
+    """Holds every caller back, e.g. while Telegram asks to retry after a flood wait."""
+    self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+  async def acquire(self):
+    while True:
+      now = time.monotonic()
+      if now < self._paused_until:
+        await asyncio.sleep(self._paused_until - now)
+        continue
+
+      self._tokens = min(float(self.rate), self._tokens + (now - self._updated_at) * self.rate / self.per)
+      self._updated_at = now
+      if self._tokens >= 1:
+        self._tokens -= 1
+        return
+      await asyncio.sleep((1 - self._tokens) * self.per / self.rate)